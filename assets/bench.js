@@ -15,6 +15,7 @@
   let autoUploadAttempts = 0;
   const autoUploadMaxAttempts = 3;
   const dailyClickLocks = new Set(); // key: instance+YYYYMMDD to ensure single immediate attempt per click
+  let lastJobId = null; // bench job whose results are currently shown
   const clearAutoUpload = () => { if (autoUploadTimer){ clearTimeout(autoUploadTimer); autoUploadTimer=null; } };
 
   function collectUploadBody(){
@@ -27,7 +28,8 @@
     const after  = { mean: parseFloat($('after-mean').textContent)||null, std: parseFloat($('after-std').textContent)||null };
     let improvement = null; if (isFinite(before.mean) && isFinite(after.mean)){ improvement = ((before.mean - after.mean)/before.mean)*100; }
     const notes = $('user-notes').value.trim();
-    const body = { image, instanceId: instance||undefined, githubUrl: isGithub(idraw)?idraw:undefined, workload_b64, before, after, improvement, notes, ts: Date.now() };
+    // jobId lets the helper use its own measurement and statistics instead of these display values
+    const body = { image, instanceId: instance||undefined, githubUrl: isGithub(idraw)?idraw:undefined, workload_b64, before, after, improvement, jobId: lastJobId||undefined, notes, ts: Date.now() };
     return body;
   }
 
@@ -162,7 +164,39 @@
     }catch(e){ log(ulog, String(e)); }
   }
 
-  let runAbort=null;
+  // /api/bench/run only enqueues the job; poll its status until a worker has finished it
+  const sleep = (ms, signal) => new Promise((resolve, reject) => {
+    const t = setTimeout(resolve, ms);
+    signal?.addEventListener('abort', () => { clearTimeout(t); reject(new DOMException('Aborted', 'AbortError')); }, { once: true });
+  });
+  // Live container output (last lines + current phase) while the job runs, via Server-Sent Events
+  function followBenchJob(jobId){
+    if (typeof EventSource === 'undefined') return null;
+    const es = new EventSource(`${ENDPOINT}/api/bench/jobs/${encodeURIComponent(jobId)}/stream`);
+    const tail = []; let phase = '';
+    const render = () => log($('before-log'), `${phase ? `Running ${phase}…` : 'Waiting for container…'}\n${tail.join('\n')}`);
+    es.addEventListener('line', (ev) => { tail.push(ev.data); if (tail.length > 20) tail.shift(); render(); });
+    es.addEventListener('phase', (ev) => { try { const p = JSON.parse(ev.data); phase = p.mark === 'start' ? p.phase : ''; } catch {} render(); });
+    es.addEventListener('done', () => es.close());
+    return es;
+  }
+  async function waitBenchJob(jobId, signal){
+    // cancelOnDisconnect: the helper kills the container if this page stops polling (tab closed, network gone)
+    let st = await getJSON('/api/bench/run', { method:'POST', signal, body: JSON.stringify({ jobId, cancelOnDisconnect: true }) });
+    const es = followBenchJob(jobId);
+    try{
+      while (st.status === 'queued' || st.status === 'running'){
+        if (!es) log($('before-log'), st.status === 'queued' ? `Queued (position ${st.position ?? '?'})…` : 'Running…');
+        await sleep(2000, signal);
+        st = await getJSON(`/api/bench/jobs/${encodeURIComponent(jobId)}`, { signal });
+      }
+    } finally { es?.close(); }
+    if (st.status !== 'done') throw new Error(st.error || `Job ${st.status}`);
+    return st.result || {};
+  }
+
+  let runAbort=null, runJobId=null;
+  const cancelUrl = (jobId) => `${ENDPOINT}/api/bench/jobs/${encodeURIComponent(jobId)}/cancel`;
   async function runBenchmark(){
     // reset UI
     log($('bench-cmd'), ''); log($('pull-log'), '');
@@ -177,15 +211,21 @@
     const inst=parseInstanceId(idInput); if(!inst){ log($('before-log'),'Cannot infer instance id from input'); return; }
     const image=imageFromInstance(inst); $('bench-image').textContent=image;
 
+    lastJobId=null;
     let prep; try{ prep=await getJSON('/api/bench/prepare', { method:'POST', body: JSON.stringify({ instance: inst, image, code }) }); }catch(e){ log($('before-log'), String(e)); return; }
     const cmd=genDockerCmd(prep.hostWorkloadPath, image); log($('bench-cmd'), cmd);
 
-    if(runAbort){ runAbort.abort(); runAbort=null; } runAbort=new AbortController();
+    cancelRun(); runAbort=new AbortController(); runJobId=prep.jobId;
     try{
-      const data=await getJSON('/api/bench/run', { method:'POST', signal: runAbort.signal, body: JSON.stringify({ jobId: prep.jobId }) });
-      const pullLines=[]; const rawBefore=(data.before&&data.before.raw)||''; const rawAfter=(data.after&&data.after.raw)||'';
-      const collectPull=(txt)=>{ txt.split(/\n/).forEach(line=>{ if(/pull|download|extract/i.test(line)) pullLines.push(line); }); };
-      collectPull(rawBefore); collectPull(rawAfter); if(pullLines.length) log($('pull-log'), pullLines.join('\n'));
+      const data=await waitBenchJob(prep.jobId, runAbort.signal);
+      runJobId=null;
+      // The raw log stays on the helper; fetch only its head to show pull/download progress
+      const pullLines=[];
+      try{
+        const head = await fetch(`${ENDPOINT}/api/bench/jobs/${encodeURIComponent(prep.jobId)}/log?offset=0&length=65536`, { signal: runAbort.signal });
+        if (head.ok) (await head.text()).split(/\n/).forEach(line=>{ if(/pull|download|extract/i.test(line)) pullLines.push(line); });
+      }catch(e){}
+      if(pullLines.length) log($('pull-log'), pullLines.join('\n'));
 
       const bMean=(data.before&&data.before.mean!=null)? String(data.before.mean):null;
       const bStd=(data.before&&data.before.std!=null)? String(data.before.std):null;
@@ -225,12 +265,19 @@
         impBox.style.display = '';
       }
 
+      lastJobId=prep.jobId;
       const bm=parseFloat(data.before?.mean), am=parseFloat(data.after?.mean);
-      if(isFinite(bm)&&isFinite(am)){ const diff=((bm-am)/bm)*100; const tag=diff>=0?'faster':'slower'; $('bench-diff').textContent=`Improvement: ${tag} ${Math.abs(diff).toFixed(2)}%`; } else { $('bench-diff').textContent='Improvement: —'; }
+      const ci=data.stats?.ci?.improvement;
+      const ciTxt=(ci && ci[0]!=null && ci[1]!=null) ? ` (${Math.round((data.stats.ci.level||0.95)*100)}% CI ${ci[0].toFixed(2)}% … ${ci[1].toFixed(2)}%)` : '';
+      if(isFinite(bm)&&isFinite(am)){ const diff=((bm-am)/bm)*100; const tag=diff>=0?'faster':'slower'; $('bench-diff').textContent=`Improvement: ${tag} ${Math.abs(diff).toFixed(2)}%${ciTxt}`; } else { $('bench-diff').textContent='Improvement: —'; }
     }catch(e){ log($('before-log'), String(e)); }
   }
 
-  function cancelRun(){ if(runAbort){ runAbort.abort(); runAbort=null; } }
+  function cancelRun(){
+    if(runAbort){ runAbort.abort(); runAbort=null; }
+    // Stop the container on the helper too, so an abandoned run does not skew the next one
+    if(runJobId){ fetch(cancelUrl(runJobId), { method:'POST' }).catch(()=>{}); runJobId=null; }
+  }
 
   document.addEventListener('DOMContentLoaded', () => {
     $('helper-endpoint') && ($('helper-endpoint').textContent = ENDPOINT);
@@ -252,6 +299,7 @@
     });
     $('btn-bench-run')?.addEventListener('click', runBenchmark);
     $('btn-bench-cancel')?.addEventListener('click', cancelRun);
+    window.addEventListener('pagehide', () => { if(runJobId && navigator.sendBeacon) navigator.sendBeacon(cancelUrl(runJobId)); });
     $('copy-before')?.addEventListener('click', () => copyText(`Mean: ${$('before-mean').textContent} | Std: ${$('before-std').textContent}`));
     $('copy-after')?.addEventListener('click', () => copyText(`Mean: ${$('after-mean').textContent} | Std: ${$('after-std').textContent}`));
     $('btn-one-submit')?.addEventListener('click', oneClickSubmit);
@@ -0,0 +1,119 @@
+"""Local stand-in for the GitHub REST endpoints the helper's upload paths use (point SWEF_GITHUB_API at it).
+
+Covers the per-submission PR flow (repo, refs, contents, pulls) and the batched outbox flow (blobs, trees,
+commits). Branches and files are remembered so repeated uploads take the same paths as against GitHub.
+"""
+import json, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeGitHub:
+    def __init__(self, latency: float = 0.0, default_branch: str = "main"):
+        self.latency = latency
+        self.default_branch = default_branch
+        self.lock = threading.Lock()
+        self.refs = {f"heads/{default_branch}": "a" * 40}
+        self.files = set()
+        self.pulls = 0
+        self.calls = {}
+        self.server = None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, obj):
+                body = json.dumps(obj).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                try:
+                    return json.loads(self.rfile.read(n) or b"null")
+                except ValueError:
+                    return None
+
+            def _handle(self, method):
+                path = self.path.split("?")[0]
+                with fake.lock:
+                    key = f"{method} {re.sub(r'/repos/[^/]+/[^/]+', '/repos/:repo', path).split('/contents/')[0]}"
+                    fake.calls[key] = fake.calls.get(key, 0) + 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                body = self._body() if method in ("POST", "PUT", "PATCH") else None
+                code, obj = fake.route(method, path, body)
+                self._send(code, obj)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-github", daemon=True).start()
+        return f"http://{host}:{self.server.server_port}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def route(self, method: str, path: str, body):
+        m = re.fullmatch(r"/repos/[^/]+/[^/]+(/.*)?", path)
+        if not m:
+            return 404, {"message": "Not Found"}
+        rest = m.group(1) or ""
+        with self.lock:
+            if method == "GET" and rest == "":
+                return 200, {"default_branch": self.default_branch}
+            if method == "GET" and rest.startswith("/git/ref/"):
+                sha = self.refs.get(rest[len("/git/ref/"):])
+                return (200, {"object": {"sha": sha}}) if sha else (404, {"message": "Not Found"})
+            if method == "GET" and rest.startswith("/branches/"):
+                sha = self.refs.get("heads/" + rest[len("/branches/"):])
+                return (200, {"commit": {"sha": sha}}) if sha else (404, {"message": "Branch not found"})
+            if method == "GET" and rest.startswith("/git/trees/"):
+                return 200, {"sha": "t" * 40, "truncated": False, "tree": [{"path": p, "type": "blob"} for p in sorted(self.files)]}
+            if method == "GET" and rest.startswith("/git/commits/"):
+                return 200, {"sha": rest.rsplit("/", 1)[-1], "tree": {"sha": "t" * 40}}
+            if method == "GET" and rest.startswith("/contents/"):
+                target = rest[len("/contents/"):]
+                if target in self.files:
+                    return 200, {"path": target, "sha": "f" * 40}
+                names = [p.rsplit("/", 1)[-1] for p in self.files if p.rsplit("/", 1)[0] == target]
+                return (200, [{"name": n, "type": "file"} for n in names]) if names else (404, {"message": "Not Found"})
+            if method == "GET" and rest == "/pulls":
+                return 200, []
+            if method == "POST" and rest == "/git/refs":
+                self.refs[(body or {}).get("ref", "")[len("refs/"):]] = (body or {}).get("sha")
+                return 201, {"ref": (body or {}).get("ref")}
+            if method == "PATCH" and rest.startswith("/git/refs/"):
+                self.refs[rest[len("/git/refs/"):]] = (body or {}).get("sha")
+                return 200, {"object": {"sha": (body or {}).get("sha")}}
+            if method == "PUT" and rest.startswith("/contents/"):
+                self.files.add(rest[len("/contents/"):])
+                return 201, {"content": {"path": rest[len("/contents/"):]}}
+            if method == "POST" and rest == "/git/trees":
+                for item in (body or {}).get("tree") or []:
+                    self.files.add(item.get("path"))
+                return 201, {"sha": "c" * 40}
+            if method == "POST" and rest in ("/git/blobs", "/git/commits"):
+                return 201, {"sha": ("b" if rest.endswith("blobs") else "d") * 40}
+            if method == "POST" and rest == "/pulls":
+                self.pulls += 1
+                return 201, {"number": self.pulls, "html_url": f"https://github.invalid/pull/{self.pulls}"}
+        return 404, {"message": "Not Found"}
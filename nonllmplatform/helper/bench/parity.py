@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Check that the streaming PerfLogParser reads the same Mean/Std as the original whole-log parser.
+
+The legacy parser below is parse_perf_two as it was before the incremental parser replaced it (it
+sliced the log with str.index). Every case is fed to both, in one piece and in small chunks, and the
+BEFORE/AFTER mean and std must agree. Exit status 1 on any mismatch.
+
+  python bench/parity.py
+"""
+import os, re, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ.setdefault("SWEF_WORK_ROOT", os.path.join(os.environ.get("TMPDIR", "/tmp"), "swef-parity"))
+from synthetic import perf_log
+import helper_server as hs
+
+def legacy_parse_perf_two(txt: str):
+    def extract(tag: str):
+        start_tag = f"PERF_START:{tag}"
+        end_tag = f"PERF_END:{tag}"
+        try:
+            s = txt.index(start_tag)
+            e = txt.index(end_tag, s)
+            seg = txt[s:e]
+        except ValueError:
+            return {"mean": None, "std": None}
+        m1 = re.search(r"(?ms)^\+\s+echo\s+PERF_START:\s*\n^PERF_START:\s*\n^\+\s+python\s+.*\n", seg)
+        m2 = re.search(r"(?m)^PERF_START:\s*$", seg)
+        start_idx = m1.end() if m1 else m2.end() if m2 else None
+        m3 = re.search(r"(?ms)^PERF_END:\s*\n^\+\s+echo\s+PERF_END:\s*", seg)
+        m4 = re.search(r"(?m)^PERF_END:\s*$", seg)
+        end_idx = m3.start() if m3 else m4.start() if m4 else None
+        if start_idx is not None and end_idx is not None and end_idx > start_idx:
+            inner_core = seg[start_idx:end_idx]
+        else:
+            try:
+                i_s = seg.index("PERF_START:")
+                i_e = seg.index("PERF_END:", i_s)
+                inner_core = seg[i_s + len("PERF_START:"): i_e]
+            except ValueError:
+                inner_core = None
+        core = (inner_core if inner_core is not None else seg).strip()
+        m = hs.MEAN_RE.search(core)
+        sdev = hs.STD_RE.search(core)
+        return {"mean": float(m.group(1)) if m else None, "std": float(sdev.group(1)) if sdev else None}
+    return {"before": extract("BEFORE"), "after": extract("AFTER")}
+
+def phase(tag, body, inner=True, trace=True):
+    lines = [f"PERF_START:{tag}"]
+    if inner:
+        lines += (["+ echo PERF_START:"] if trace else []) + ["PERF_START:"] + (["+ python /tmp/workload.py"] if trace else [])
+    lines += body
+    if inner:
+        lines += ["PERF_END:"] + (["+ echo PERF_END:"] if trace else [])
+    lines.append(f"PERF_END:{tag}")
+    return "\n".join(lines) + "\n"
+
+CASES = {
+    "synthetic": perf_log(log_kb=64, samples=200),
+    "plain": phase("BEFORE", ["Mean: 1.5", "Std Dev: 0.1"]) + phase("AFTER", ["Mean: 1.0", "Std Dev: 0.05"]),
+    "no inner markers": phase("BEFORE", ["Mean: 2.0", "Std Dev: 0.2"], inner=False) + phase("AFTER", ["Mean: 1.0", "Std: 0.1"], inner=False),
+    "no trace lines": phase("BEFORE", ["Mean: 3.0", "Std Dev: 0.3"], trace=False) + phase("AFTER", ["Mean: 2.0", "Std Dev: 0.2"], trace=False),
+    "noise around phases": "pulling...\n+ set +e\n" + phase("BEFORE", ["warming up", "Mean: 1.2", "Std Dev: 0.01"])
+                           + "+ git apply /tmp/patch.diff\n" + phase("AFTER", ["Mean: 0.8", "Std Dev: 0.02", "done"]) + "+ exit\n",
+    "outer end without newline": "PERF_START:BEFORE\nPERF_START:\nMean: 1.5\nStd Dev: 0.1\nPERF_END:\nprogress 100%PERF_END:BEFORE\n"
+                                 + phase("AFTER", ["Mean: 1.0", "Std Dev: 0.05"]),
+    "inner end without newline": "PERF_START:BEFORE\nPERF_START:\nMean: 1.5\nStd Dev: 0.1PERF_END:\nPERF_END:BEFORE\n"
+                                 + "PERF_START:AFTER\nPERF_START:\nMean: 1.0\nStd Dev: 0.05PERF_END:\nPERF_END:AFTER\n",
+    "start without newline": "downloading 100%PERF_START:BEFORE\nPERF_START:\nMean: 1.5\nStd Dev: 0.1\nPERF_END:\nPERF_END:BEFORE\n"
+                             + "ok PERF_START:AFTER\nMean: 1.1\nStd Dev: 0.1\nPERF_END:AFTER",
+    "missing after": phase("BEFORE", ["Mean: 1.5", "Std Dev: 0.1"]) + "ERROR: docker内部不完全，没有/tmp/patch.diff\n",
+    "unterminated after": phase("BEFORE", ["Mean: 1.5", "Std Dev: 0.1"]) + "PERF_START:AFTER\nPERF_START:\nTraceback (most recent call last):\n",
+    "crlf": phase("BEFORE", ["Mean: 1.5", "Std Dev: 0.1"]).replace("\n", "\r\n") + phase("AFTER", ["Mean: 1.0", "Std Dev: 0.05"]).replace("\n", "\r\n"),
+}
+
+def streamed(txt: str, size: int):
+    parser = hs.PerfLogParser()
+    data = txt.encode("utf-8")
+    for i in range(0, len(data), size):
+        parser.feed(data[i:i + size])
+    return parser.close()
+
+def close(a, b):
+    return a == b or (a is not None and b is not None and abs(a - b) <= 1e-12 * max(1.0, abs(a)))
+
+def main():
+    failures = 0
+    for name, txt in CASES.items():
+        want = legacy_parse_perf_two(txt)
+        for how, got in (("whole", hs.parse_perf_two(txt)), ("chunked", streamed(txt, 7))):
+            for side in ("before", "after"):
+                for key in ("mean", "std"):
+                    if not close(want[side][key], got[side][key]):
+                        failures += 1
+                        print(f"MISMATCH {name} ({how}) {side}.{key}: legacy {want[side][key]!r}, parser {got[side][key]!r}")
+    print(f"{len(CASES)} cases, {failures} mismatches")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
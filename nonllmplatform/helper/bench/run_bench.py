@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""Benchmark and load-test the helper itself, against the fake docker in bench/bin and a local fake GitHub API.
+
+Scenarios:
+  parse      parse_perf_two on a multi-MB synthetic PERF log
+  state      save/load of a job state whose before/after carry many samples and long core text
+  append     concurrent append_submission calls
+  endpoints  the HTTP API served by uvicorn while benchmark jobs run, then once they have finished,
+             including /api/upload_run through the fake GitHub API
+
+Each row reports throughput, p50/p99/max latency, the Python allocation high-water mark while the
+row ran (tracemalloc; --no-tracemalloc for undistorted latencies) and the process RSS high-water mark.
+
+  python bench/run_bench.py
+  python bench/run_bench.py --scenarios parse,append --log-mb 32
+  python bench/run_bench.py --json before.json
+  python bench/run_bench.py --baseline before.json --tolerance 0.25   # exit status 1 on regressions
+"""
+import argparse, json, os, random, shutil, socket, sys, tempfile, threading, time, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+from synthetic import perf_log, phase_lines
+from fake_github import FakeGitHub
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+SCENARIOS = ("parse", "state", "append", "endpoints")
+
+def rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))]
+
+class Row:
+    """Latencies of one measured operation; use as a context manager around the batch."""
+
+    def __init__(self, name, note=""):
+        self.name, self.note = name, note
+        self.latencies, self.errors = [], 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.t0
+        self.peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        return False
+
+    def time(self, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            ok = fn(*args, **kwargs)
+        except Exception:
+            ok = False
+        dt = time.perf_counter() - t0
+        with self.lock:
+            self.latencies.append(dt)
+            if ok is False:
+                self.errors += 1
+        return ok
+
+    def result(self):
+        lat = sorted(self.latencies)
+        ms = lambda v: round(v * 1000, 3) if v is not None else None
+        return {"name": self.name, "n": len(lat), "errors": self.errors,
+                "ops_s": round(len(lat) / self.wall, 1) if self.wall else None,
+                "p50_ms": ms(percentile(lat, 0.50)), "p99_ms": ms(percentile(lat, 0.99)), "max_ms": ms(lat[-1] if lat else None),
+                "peak_kb": round(self.peak / 1024) if self.peak is not None else None, "rss_mb": rss_mb(), "note": self.note}
+
+def run_threads(n, target):
+    threads = [threading.Thread(target=target, args=(i,), daemon=True) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def setup_env(args):
+    """Point the helper at a throwaway work root, the fake docker and the fake GitHub; returns (helper module, fake GitHub)."""
+    work = tempfile.mkdtemp(prefix="swef-bench-")
+    home = os.path.join(work, "home")
+    os.makedirs(os.path.join(home, ".SWEfficiency"))
+    with open(os.path.join(home, ".SWEfficiency", "github_token"), "w", encoding="utf-8") as f:
+        f.write("fake-token")
+    github = FakeGitHub(latency=args.gh_latency / 1000.0)
+    os.environ.update({
+        "HOME": home,
+        "SWEF_WORK_ROOT": os.path.join(work, "root"),
+        "SWEF_DOCKER_BACKEND": "cli",
+        "PATH": os.path.join(HERE, "bin") + os.pathsep + os.environ.get("PATH", ""),
+        "SWEF_FAKE_STATE": os.path.join(work, "containers"),
+        "SWEF_FAKE_LOG_KB": str(args.job_log_kb),
+        "SWEF_FAKE_SAMPLES": str(args.job_samples),
+        "SWEF_FAKE_PHASE_SECS": str(args.phase_secs),
+        "SWEF_GITHUB_API": github.start(),
+        "SWEF_BENCH_WORKERS": str(args.workers),
+        "SWEF_UPLOAD_MIN_IMPROVEMENT": "0",
+        "SWEF_GC_INTERVAL": "0",
+    })
+    import helper_server
+    return helper_server, github, work
+
+def bench_parse(hs, args):
+    log = perf_log(log_kb=int(args.log_mb * 1024 / 2), samples=args.samples)
+    mb = len(log.encode("utf-8")) / (1024 * 1024)
+    row = Row(f"parse_perf_two {mb:.0f}MB")
+    with row:
+        for _ in range(args.repeat):
+            row.time(lambda: hs.parse_perf_two(log)["after"]["mean"] is not None)
+    res = row.result()
+    res["note"] = f"{mb * res['n'] / (sum(row.latencies) or 1):.1f} MB/s"
+    return [res]
+
+def bench_state(hs, args):
+    rng = random.Random(1)
+    core = "".join(l for l in phase_lines("BEFORE", 256, 10, 1.0, rng) if not l.startswith("+"))
+    def phase(mean):
+        return {"mean": mean, "std": 0.01, "samples": [mean * rng.uniform(0.97, 1.03) for _ in range(args.samples)], "core": core}
+    state = {"status": "done", "result": {"ok": True, "before": phase(1.0), "after": phase(0.7)}}
+    size = len(json.dumps(state)) / (1024 * 1024)
+    rows = []
+    job_ids = []
+    for i in range(args.repeat):
+        job_id = f"bench-state-{i}"
+        os.makedirs(os.path.join(hs.ROOT_DIR, job_id), exist_ok=True)
+        job_ids.append(job_id)
+    save, load = Row(f"save_job_state {size:.1f}MB"), Row(f"load_job_state {size:.1f}MB")
+    with save:
+        for job_id in job_ids:
+            save.time(hs.save_job_state, job_id, state)
+    with load:
+        for job_id in job_ids:
+            load.time(lambda: hs.load_job_state(job_id) is not None)
+    rows += [save.result(), load.result()]
+    return rows
+
+def bench_append(hs, args):
+    workload = "import time\n" + "x = [i * i for i in range(1000)]\n" * 40
+    core = "workload output line\n" * 200
+    def record(t, i):
+        return {"id": f"bench-{t}-{i}", "ts": int(time.time()), "instanceId": f"bench__inst-{i % 50}", "image": "img",
+                "workload": workload + f"# {t}-{i}\n", "before": {"mean": 1.0, "std": 0.01, "core": core},
+                "after": {"mean": 0.7, "std": 0.01, "core": core}, "improvement": 30.0,
+                "stats": {"speedup": 1.0 / 0.7, "improvement": 30.0, "significant": True}, "notes": None}
+    per_thread = max(1, args.appends // args.clients)
+    row = Row(f"append_submission x{args.clients} threads")
+    with row:
+        run_threads(args.clients, lambda t: [row.time(hs.append_submission, record(t, i)) for i in range(per_thread)])
+    with open(hs.SUBMIT_FILE, "rb") as f:
+        lines = sum(1 for _ in f)
+    res = row.result()
+    res["note"] = f"{lines} lines in submissions.jsonl"
+    return [res]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(hs):
+    import uvicorn
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(hs.app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, name="uvicorn", daemon=True).start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("uvicorn did not start")
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+def bench_endpoints(hs, args, github):
+    import requests
+    server, base = start_server(hs)
+    local = threading.local()
+    def session():
+        if not hasattr(local, "s"):
+            local.s = requests.Session()
+        return local.s
+    def call(method, path, body=None):
+        r = session().request(method, base + path, json=body, timeout=120)
+        r.content
+        return r.status_code < 400
+
+    # Bench jobs: prepared and queued up front, watched until they finish
+    jobs, submitted, finished = [], {}, {}
+    job_row = Row(f"bench job end-to-end ({args.workers} workers)")
+    job_row.__enter__()
+    for i in range(args.jobs):
+        prep = session().post(base + "/api/bench/prepare", json={"instance": f"bench__inst-{i}", "image": "img",
+                                                                  "code": f"print({i})", "patch": "diff"}).json()
+        job_id = prep["jobId"]
+        submitted[job_id] = time.perf_counter()
+        session().post(base + "/api/bench/run", json={"jobId": job_id, "force": True})
+        jobs.append(job_id)
+    def watch():
+        s = requests.Session()
+        pending = set(jobs)
+        while pending:
+            for job_id in list(pending):
+                st = s.get(f"{base}/api/bench/jobs/{job_id}", timeout=60).json()
+                if st.get("status") not in ("queued", "running"):
+                    finished[job_id] = (time.perf_counter(), st.get("status"))
+                    pending.discard(job_id)
+            time.sleep(0.05)
+    watcher = threading.Thread(target=watch, name="job-watch", daemon=True)
+    watcher.start()
+
+    def batch(name, method, path_fn, body_fn=None):
+        row = Row(name)
+        per_client = max(1, args.requests // args.clients)
+        with row:
+            run_threads(args.clients, lambda c: [row.time(call, method, path_fn(c, i), body_fn(c, i) if body_fn else None)
+                                                 for i in range(per_client)])
+        return row.result()
+
+    rows = []
+    busy = f"[{args.jobs} jobs queued]"
+    pick = lambda c, i: jobs[(c * 7919 + i) % len(jobs)]
+    rows.append(batch(f"GET /api/health {busy}", "GET", lambda c, i: "/api/health"))
+    rows.append(batch(f"GET /api/bench/queue {busy}", "GET", lambda c, i: "/api/bench/queue"))
+    rows.append(batch(f"GET /api/bench/jobs/{{id}} {busy}", "GET", lambda c, i: f"/api/bench/jobs/{pick(c, i)}"))
+    rows.append(batch(f"POST /api/submit {busy}", "POST", lambda c, i: "/api/submit",
+                      lambda c, i: {"notes": f"bench {c}-{i}", "meta": {"client": c, "i": i}}))
+    rows.append(batch(f"GET /api/submissions {busy}", "GET", lambda c, i: "/api/submissions?limit=50"))
+    rows.append(batch(f"GET /metrics {busy}", "GET", lambda c, i: "/metrics"))
+
+    watcher.join()
+    job_row.latencies = [finished[j][0] - submitted[j] for j in jobs]
+    job_row.errors = sum(1 for j in jobs if finished[j][1] != "done")
+    job_row.__exit__(None, None, None)
+    rows.insert(0, job_row.result())
+
+    idle = "[idle]"
+    rows.append(batch(f"GET /api/bench/jobs/{{id}} {idle}", "GET", lambda c, i: f"/api/bench/jobs/{pick(c, i)}"))
+    rows.append(batch(f"GET /api/bench/jobs/{{id}}/log {idle}", "GET",
+                      lambda c, i: f"/api/bench/jobs/{pick(c, i)}/log?offset={(i * 65536) % max(1, args.job_log_kb * 1024)}&length=65536"))
+    rows.append(batch(f"GET /api/submissions/columns {idle}", "GET", lambda c, i: "/api/submissions/columns"))
+    rows.append(batch(f"POST /api/aggregate {idle}", "POST", lambda c, i: "/api/aggregate", lambda c, i: {}))
+    upload = batch(f"POST /api/upload_run {idle}", "POST", lambda c, i: "/api/upload_run",
+                   lambda c, i: {"image": "img", "instanceId": f"bench__upload-{c}-{i}", "workload_b64": "",
+                                 "before": {"mean": 1.0, "std": 0.01}, "after": {"mean": 0.7 - 0.0001 * i, "std": 0.01},
+                                 "notes": f"bench {c}-{i}"})
+    upload["note"] = f"{github.pulls} PRs, {sum(github.calls.values())} GitHub calls"
+    rows.append(upload)
+    server.should_exit = True
+    return rows
+
+def print_rows(rows):
+    cols = [("name", 48), ("n", 6), ("errors", 6), ("ops_s", 9), ("p50_ms", 10), ("p99_ms", 10), ("max_ms", 10),
+            ("peak_kb", 9), ("rss_mb", 8), ("note", 0)]
+    fmt = lambda v: "-" if v is None else str(v)
+    print("  ".join(name.ljust(width) if width else name for name, width in cols))
+    for row in rows:
+        print("  ".join(fmt(row.get(name)).ljust(width) if width else fmt(row.get(name)) for name, width in cols))
+
+def compare(rows, baseline, tolerance):
+    """Regressions against a previous --json run: slower p50/p99, lower throughput or a higher allocation peak."""
+    base = {r["name"]: r for r in baseline.get("rows") or []}
+    found = []
+    for row in rows:
+        old = base.get(row["name"])
+        if old is None:
+            continue
+        for key in ("p50_ms", "p99_ms", "peak_kb"):
+            # Small absolute differences are noise, whatever the ratio
+            slack = 0.5 if key != "peak_kb" else 64
+            if row.get(key) is not None and old.get(key) is not None and row[key] > old[key] * (1 + tolerance) + slack:
+                found.append(f"{row['name']}: {key} {old[key]} -> {row[key]}")
+        if row.get("ops_s") and old.get("ops_s") and row["ops_s"] < old["ops_s"] * (1 - tolerance):
+            found.append(f"{row['name']}: ops_s {old['ops_s']} -> {row['ops_s']}")
+        if row.get("errors", 0) > old.get("errors", 0):
+            found.append(f"{row['name']}: errors {old.get('errors', 0)} -> {row['errors']}")
+    return found
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    ap.add_argument("--log-mb", type=float, default=8, help="size of the log given to parse_perf_two")
+    ap.add_argument("--samples", type=int, default=20000, help="samples per phase in the parse and state scenarios")
+    ap.add_argument("--repeat", type=int, default=5, help="iterations of the parse and state scenarios")
+    ap.add_argument("--appends", type=int, default=2000, help="total append_submission calls")
+    ap.add_argument("--clients", type=int, default=8, help="concurrent threads for append and endpoint load")
+    ap.add_argument("--requests", type=int, default=400, help="requests per endpoint")
+    ap.add_argument("--jobs", type=int, default=16, help="bench jobs run during the endpoint scenario")
+    ap.add_argument("--workers", type=int, default=2, help="SWEF_BENCH_WORKERS for the helper under test")
+    ap.add_argument("--job-log-kb", type=int, default=1024, help="fake docker output per phase")
+    ap.add_argument("--job-samples", type=int, default=200, help="fake docker samples per phase")
+    ap.add_argument("--phase-secs", type=float, default=0.5, help="fake docker wall time per phase")
+    ap.add_argument("--gh-latency", type=float, default=0, help="milliseconds added to every fake GitHub response")
+    ap.add_argument("--no-tracemalloc", action="store_true", help="skip allocation tracking")
+    ap.add_argument("--json", help="write the results to this file")
+    ap.add_argument("--baseline", help="results of an earlier --json run to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="relative slack before a difference counts as a regression")
+    ap.add_argument("--keep", action="store_true", help="keep the temporary work root")
+    args = ap.parse_args(argv)
+    wanted = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in wanted if s not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    hs, github, work = setup_env(args)
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    rows = []
+    try:
+        for name in wanted:
+            if name == "parse":
+                rows += bench_parse(hs, args)
+            elif name == "state":
+                rows += bench_state(hs, args)
+            elif name == "append":
+                rows += bench_append(hs, args)
+            elif name == "endpoints":
+                rows += bench_endpoints(hs, args, github)
+    finally:
+        github.stop()
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+    print_rows(rows)
+    result = {"ts": int(time.time()), "args": vars(args), "tracemalloc": not args.no_tracemalloc, "rows": rows}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+"""Synthetic container output in the shape /perf.sh produces, shared by the fake docker and the runner.
+
+Each phase is an outer PERF_START:<TAG> ... PERF_END:<TAG> segment around the lone PERF_START: / PERF_END:
+markers, padded with `bash -x` trace lines and workload output up to log_kb, with `samples` timings as
+PERF_SAMPLE lines followed by the Mean/Std Dev summary.
+"""
+import json, random, statistics
+
+def phase_lines(tag: str, log_kb: int = 256, samples: int = 100, mean: float = 1.0, rng=None):
+    rng = rng or random.Random(0)
+    values = [mean * rng.uniform(0.97, 1.03) for _ in range(max(2, samples))]
+    budget = log_kb * 1024
+    yield f"PERF_START:{tag}\n"
+    yield "+ echo PERF_START:\n"
+    yield "PERF_START:\n"
+    yield "+ python /tmp/workload.py\n"
+    while budget > 0:
+        # Alternate trace noise and workload output so both the trace filter and core capture are exercised
+        line = (f"+ trace {tag} {rng.random():.12f} " if budget % 2 else f"workload {tag} {rng.random():.12f} ") + "x" * 64 + "\n"
+        budget -= len(line)
+        yield line
+    for i in range(0, len(values), 50):
+        yield f"PERF_SAMPLE {json.dumps({'values': values[i:i + 50]})}\n"
+    yield f"Mean: {statistics.fmean(values)}\n"
+    yield f"Std Dev: {statistics.stdev(values)}\n"
+    yield "PERF_END:\n"
+    yield "+ echo PERF_END:\n"
+    yield f"PERF_END:{tag}\n"
+
+def phase_mean(tag: str, speedup: float = 1.4) -> float:
+    return 1.0 if tag.upper().startswith("BEFORE") else 1.0 / speedup
+
+def perf_log(tags=("BEFORE", "AFTER"), log_kb: int = 256, samples: int = 100, speedup: float = 1.4, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return "".join(line for tag in tags for line in phase_lines(tag, log_kb, samples, phase_mean(tag, speedup), rng))
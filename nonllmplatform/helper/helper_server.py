@@ -3,16 +3,27 @@
 # TODO: We will update this script to be more applicable to other platforms later.  
 # TODO: We will update this script to be more applicable to other operating systems later.
 
-import os, json, pathlib, subprocess, shlex, time
-from typing import Optional, List
+import os, json, pathlib, subprocess, shlex, time, threading, atexit, shutil
+from collections import deque
+from typing import Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request, Body, HTTPException
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse, Response
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import re, secrets
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 import hashlib
 import base64, requests
+import statistics, math, random
+import zlib
+import mmap
+import socket, http.client, urllib.parse
+import bisect, struct
+import glob, pstats
+import functools
+import platform, sys
 
 def env_list(name: str, default: List[str], fallback_names: List[str] = []) -> List[str]:
     v = os.environ.get(name, "")
@@ -43,6 +54,26 @@ DATA_REPO = os.environ.get("SWEF_DATA_REPO", "lichanghengxjtu/SWEf-data")
 DATA_PATH = os.environ.get("SWEF_DATA_PATH", "Non_LLM_user_data")
 GH_CLIENT_ID = os.environ.get("SWEF_GH_CLIENT_ID")
 GH_CLIENT_SECRET = os.environ.get("SWEF_GH_CLIENT_SECRET")
+# One cpuset per worker slot, separated by ";" (e.g. "2-3;4-5"); each slot's containers are pinned to its cpuset
+BENCH_CPUSETS = [c.strip() for c in os.environ.get("SWEF_BENCH_CPUSETS", "").split(";") if c.strip()]
+BENCH_WORKERS = max(1, int(os.environ.get("SWEF_BENCH_WORKERS", "") or len(BENCH_CPUSETS) or 1))
+BENCH_CPUS = os.environ.get("SWEF_BENCH_CPUS", "")
+BENCH_MEMORY = os.environ.get("SWEF_BENCH_MEMORY", "")
+RESULT_CACHE_DIR = os.path.join(ROOT_DIR, "cache", "results")
+RESULT_CACHE_MAX = int(os.environ.get("SWEF_RESULT_CACHE_MAX", "500") or 500)
+RESULT_CACHE_BYTES = int(os.environ.get("SWEF_RESULT_CACHE_MB", "64") or 64) * 1024 * 1024
+UPLOAD_MIN_IMPROVEMENT = float(os.environ.get("SWEF_UPLOAD_MIN_IMPROVEMENT", "15") or 15)
+BENCH_ORPHAN_SECS = int(os.environ.get("SWEF_BENCH_ORPHAN_SECS", "30") or 30)
+BENCH_QUEUE_MAX = int(os.environ.get("SWEF_BENCH_QUEUE_MAX", "1000") or 1000)
+OBJECTS_DIR = os.path.join(ROOT_DIR, "objects")
+JOB_RETENTION_DAYS = float(os.environ.get("SWEF_JOB_RETENTION_DAYS", "30") or 30)
+WORK_QUOTA_BYTES = int(float(os.environ.get("SWEF_WORK_QUOTA_MB", "2048") or 2048) * 1024 * 1024)
+GC_INTERVAL = int(os.environ.get("SWEF_GC_INTERVAL", "3600") or 3600)
+IMAGE_TTL = int(os.environ.get("SWEF_IMAGE_TTL", "21600") or 0)
+IMAGE_STATE_FILE = os.path.join(ROOT_DIR, "images.json")
+POOL_DEFAULT = os.environ.get("SWEF_POOL", "0").lower() in ("1", "true", "yes", "on")
+POOL_MAX_PER_IMAGE = max(1, int(os.environ.get("SWEF_POOL_MAX", "2") or 2))
+POOL_IDLE_SECS = int(os.environ.get("SWEF_POOL_IDLE", "600") or 600)
 
 app = FastAPI(title="SWEfficiency Non-LLM helper")
 
@@ -61,8 +92,37 @@ def ensure_sandbox(path: str) -> str:
         raise HTTPException(403, "path escapes sandbox")
     return str(p)
 
-def run_cmd(cmd: str, timeout: int = 240) -> subprocess.CompletedProcess:
-    return subprocess.run(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+def run_cmd(cmd, timeout: int = 240) -> subprocess.CompletedProcess:
+    args = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+
+def stream_cmd(cmd, on_line, timeout: int = 240, on_start=None) -> int:
+    """Run cmd and hand every output line (bytes, newline included) to on_line as it is produced.
+
+    on_start, if given, receives a callable that kills the process (used to cancel it from another thread)."""
+    args = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if on_start:
+        on_start(proc.kill)
+    timed_out = threading.Event()
+    def on_timeout():
+        timed_out.set()
+        proc.kill()
+    timer = threading.Timer(timeout, on_timeout)
+    timer.start()
+    try:
+        for line in iter(proc.stdout.readline, b""):
+            on_line(line)
+        proc.wait()
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return proc.returncode
 
 def ok():
     return JSONResponse({"ok": True, "ts": int(time.time())})
@@ -74,215 +134,3576 @@ def check_origin(request: Request):
     if origin and not any(origin_lc.startswith(o) for o in allowed_lc):
         raise HTTPException(403, "origin not allowed")
 
-@app.get("/api/health")
-def health(request: Request):
+# Metrics: in-process counters and histograms, served by /metrics in the Prometheus text format.
+# Recording is a dict update under one lock; series are keyed by their sorted label pairs.
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+METRICS = {
+    "swef_image_pull_seconds": ("histogram", "Time spent pulling an image"),
+    "swef_image_requests_total": ("counter", "Image requests by outcome (cached, pulled, shared, error)"),
+    "swef_container_start_seconds": ("histogram", "Time from starting a benchmark container (or exec into a warm one) to its first output"),
+    "swef_bench_phase_seconds": ("histogram", "Duration of measured phases by phase (before, after, patch) and mode"),
+    "swef_bench_jobs_total": ("counter", "Finished benchmark jobs by status"),
+    "swef_parse_perf_seconds": ("histogram", "Time spent in parse_perf_two"),
+    "swef_github_request_seconds": ("histogram", "GitHub API latency by endpoint, method and status"),
+    "swef_submissions_appended_total": ("counter", "Records appended to submissions.jsonl"),
+    "swef_submission_bytes_total": ("counter", "Bytes appended to submissions.jsonl"),
+}
+_metrics_lock = threading.Lock()
+_metric_series = {name: {} for name in METRICS}
+
+def metric_inc(name: str, value: float = 1.0, **labels):
+    key = tuple(sorted(labels.items()))
+    with _metrics_lock:
+        series = _metric_series[name]
+        series[key] = series.get(key, 0.0) + value
+
+def metric_observe(name: str, seconds: float, **labels):
+    key = tuple(sorted(labels.items()))
+    i = bisect.bisect_left(METRIC_BUCKETS, seconds)
+    with _metrics_lock:
+        h = _metric_series[name].get(key)
+        if h is None:
+            h = _metric_series[name][key] = [[0] * (len(METRIC_BUCKETS) + 1), 0.0, 0]
+        h[0][i] += 1
+        h[1] += seconds
+        h[2] += 1
+
+def _metric_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+def render_metrics(gauges: Dict[str, tuple]) -> str:
+    """Text exposition of every recorded series; gauges maps name -> (help, value) sampled at scrape time."""
+    out = []
+    with _metrics_lock:
+        snapshot = {name: {k: (list(v[0]), v[1], v[2]) if isinstance(v, list) else v for k, v in series.items()}
+                    for name, series in _metric_series.items()}
+    for name, (kind, help_text) in METRICS.items():
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} {kind}")
+        for key, v in sorted(snapshot[name].items()):
+            if kind == "counter":
+                out.append(f"{name}{_metric_labels(key)} {v:g}")
+                continue
+            counts, total, n = v
+            cum = 0
+            for bound, c in zip(METRIC_BUCKETS, counts):
+                cum += c
+                out.append(f"{name}_bucket{_metric_labels(key + (('le', f'{bound:g}'),))} {cum}")
+            out.append(f"{name}_bucket{_metric_labels(key + (('le', '+Inf'),))} {n}")
+            out.append(f"{name}_sum{_metric_labels(key)} {total:.6f}")
+            out.append(f"{name}_count{_metric_labels(key)} {n}")
+    for name, (help_text, value) in gauges.items():
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} gauge")
+        out.append(f"{name} {value:g}")
+    return "\n".join(out) + "\n"
+
+# Docker backends. Everything the helper does with Docker goes through docker_backend():
+#   engine – HTTP over the Docker Engine unix socket (no CLI process per call, structured errors)
+#   cli    – the docker CLI through run_cmd/stream_cmd
+#   fake   – in-process stand-in that emits PERF markers, for exercising the helper without Docker
+# SWEF_DOCKER_BACKEND=auto (default) uses the engine when its socket exists and the CLI otherwise.
+# Mounts are (host_path, container_path, readonly) tuples; limits are dicts with any of
+# cpuset / cpus / memory / pids / network / cap_drop / no_new_privileges. Attached run/exec take an
+# on_start callback that receives a stop() for the local end (CLI process or Engine stream).
+DOCKER_BACKEND = (os.environ.get("SWEF_DOCKER_BACKEND", "auto") or "auto").lower()
+DOCKER_SOCK = os.environ.get("SWEF_DOCKER_SOCK") or (
+    os.environ.get("DOCKER_HOST", "")[len("unix://"):] if os.environ.get("DOCKER_HOST", "").startswith("unix://") else "/var/run/docker.sock")
+
+class DockerError(RuntimeError):
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+def _line_splitter(on_line):
+    """Feed arbitrary byte chunks, get complete lines (newline included) passed to on_line."""
+    buf = bytearray()
+    def feed(chunk: bytes, final: bool = False):
+        buf.extend(chunk)
+        while True:
+            i = buf.find(b"\n")
+            if i < 0:
+                break
+            on_line(bytes(buf[:i + 1]))
+            del buf[:i + 1]
+        if final and buf:
+            on_line(bytes(buf))
+            buf.clear()
+    return feed
+
+def _memory_bytes(value: str) -> int:
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*", str(value).lower())
+    if not m:
+        raise ValueError(f"bad memory limit: {value}")
+    return int(float(m.group(1)) * 1024 ** " kmgt".index(m.group(2) or " "))
+
+class CliDocker:
+    name = "cli"
+
+    @staticmethod
+    def _flags(mounts, limits, name=None, labels=None) -> List[str]:
+        args = []
+        if name:
+            args += ["--name", name]
+        for k, v in (labels or {}).items():
+            args += ["--label", f"{k}={v}"]
+        for src, dst, ro in mounts or []:
+            args += ["--mount", f"type=bind,src={src},dst={dst}" + (",readonly" if ro else "")]
+        limits = limits or {}
+        if limits.get("cpuset"):
+            args.append(f"--cpuset-cpus={limits['cpuset']}")
+        if limits.get("cpus"):
+            args.append(f"--cpus={limits['cpus']}")
+        if limits.get("memory"):
+            args.append(f"--memory={limits['memory']}")
+        if limits.get("pids"):
+            args.append(f"--pids-limit={limits['pids']}")
+        if limits.get("network"):
+            args.append(f"--network={limits['network']}")
+        for cap in limits.get("cap_drop") or []:
+            args.append(f"--cap-drop={cap}")
+        if limits.get("no_new_privileges"):
+            args += ["--security-opt", "no-new-privileges"]
+        return args
+
+    def version(self) -> dict:
+        cp = run_cmd(["docker", "version", "--format", "{{json .}}"], timeout=20)
+        out = cp.stdout.decode("utf-8", "ignore")
+        if cp.returncode != 0:
+            raise DockerError(out.strip() or f"docker version exited with {cp.returncode}", cp.returncode)
+        try:
+            return json.loads(out)
+        except ValueError:
+            return {"raw": out}
+
+    def info(self) -> dict:
+        cp = run_cmd(["docker", "info", "--format", "{{json .}}"], timeout=20)
+        out = cp.stdout.decode("utf-8", "ignore")
+        if cp.returncode != 0:
+            raise DockerError(out.strip() or f"docker info exited with {cp.returncode}", cp.returncode)
+        try:
+            return json.loads(out)
+        except ValueError:
+            return {"raw": out}
+
+    def image_id(self, image: str) -> Optional[str]:
+        cp = run_cmd(["docker", "image", "inspect", "--format", "{{.Id}}", image], timeout=30)
+        out = cp.stdout.decode("utf-8", "ignore").strip()
+        return out if cp.returncode == 0 and out.startswith("sha256:") else None
+
+    def pull(self, image: str, on_progress=None, timeout: int = 240) -> dict:
+        lines = []
+        def on_line(line: bytes):
+            text = line.decode("utf-8", "ignore").rstrip()
+            lines.append(text)
+            if on_progress:
+                on_progress({"status": text})
+        code = stream_cmd(["docker", "pull", image], on_line, timeout=timeout)
+        res = {"output": "\n".join(lines)[-4000:]}
+        if code != 0:
+            res["error"] = f"docker pull exited with {code}"
+        return res
+
+    def run(self, image: str, cmd: List[str], mounts=None, limits=None, name: Optional[str] = None, labels=None,
+            on_line=None, timeout: int = 1800, detach: bool = False, remove: bool = True, on_start=None):
+        args = ["docker", "run"] + (["-d"] if detach else []) + (["--rm"] if remove else [])
+        args += self._flags(mounts, limits, name, labels) + [image] + list(cmd)
+        if detach:
+            cp = run_cmd(args, timeout=120)
+            if cp.returncode != 0:
+                raise DockerError(cp.stdout.decode("utf-8", "ignore").strip() or f"could not start container for {image}", cp.returncode)
+            return cp.stdout.decode("utf-8", "ignore").strip()
+        return stream_cmd(args, on_line or (lambda line: None), timeout=timeout, on_start=on_start)
+
+    def exec(self, container: str, cmd: List[str], on_line=None, timeout: int = 300, on_start=None) -> int:
+        return stream_cmd(["docker", "exec", container] + list(cmd), on_line or (lambda line: None), timeout=timeout, on_start=on_start)
+
+    def update(self, container: str, limits: dict):
+        flags = [f for f in self._flags(None, {k: limits.get(k) for k in ("cpuset", "cpus", "memory")})]
+        if flags:
+            run_cmd(["docker", "update"] + flags + [container], timeout=60)
+
+    def kill(self, container: str, signal: str = "KILL"):
+        run_cmd(["docker", "kill", "-s", signal, container], timeout=30)
+
+    def remove(self, container: str):
+        run_cmd(["docker", "rm", "-f", container], timeout=60)
+
+    def stats(self, container: str) -> dict:
+        cp = run_cmd(["docker", "stats", "--no-stream", "--format", "{{json .}}", container], timeout=30)
+        if cp.returncode != 0:
+            raise DockerError(cp.stdout.decode("utf-8", "ignore").strip(), cp.returncode)
+        return json.loads(cp.stdout.decode("utf-8", "ignore") or "{}")
+
+    def containers(self, label: str) -> List[str]:
+        cp = run_cmd(["docker", "ps", "-a", "--filter", f"label={label}", "--format", "{{.Names}}"], timeout=30)
+        return cp.stdout.decode("utf-8", "ignore").split() if cp.returncode == 0 else []
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.unix_path)
+        self.sock = sock
+
+class EngineDocker:
+    name = "engine"
+
+    def __init__(self, sock_path: str):
+        self.sock_path = sock_path
+
+    def _open(self, method: str, path: str, body=None, params=None, timeout: Optional[float] = 60):
+        if params:
+            path += "?" + urllib.parse.urlencode(params)
+        conn = _UnixHTTPConnection(self.sock_path, timeout=timeout)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        conn.request(method, path, body=data, headers={"Content-Type": "application/json"} if data is not None else {})
+        resp = conn.getresponse()
+        if resp.status >= 400:
+            raw = resp.read()
+            conn.close()
+            try:
+                msg = json.loads(raw).get("message") or raw.decode("utf-8", "ignore")
+            except ValueError:
+                msg = raw.decode("utf-8", "ignore")
+            raise DockerError(f"{method} {path.split('?')[0]}: {msg}", resp.status)
+        return conn, resp
+
+    def _call(self, method: str, path: str, body=None, params=None, timeout: Optional[float] = 60):
+        conn, resp = self._open(method, path, body, params, timeout)
+        try:
+            raw = resp.read()
+        finally:
+            conn.close()
+        return json.loads(raw) if raw.strip() else None
+
+    @staticmethod
+    def _demux(resp, on_line):
+        """Docker's multiplexed stdout/stderr stream: 8-byte header (stream, 0, 0, 0, size) per frame."""
+        feed = _line_splitter(on_line)
+        while True:
+            header = resp.read(8)
+            if len(header) < 8:
+                break
+            size = int.from_bytes(header[4:8], "big")
+            feed(resp.read(size))
+        feed(b"", final=True)
+
+    @staticmethod
+    def _host_config(mounts, limits) -> dict:
+        limits = limits or {}
+        hc = {"Mounts": [{"Type": "bind", "Source": src, "Target": dst, "ReadOnly": bool(ro)} for src, dst, ro in mounts or []]}
+        if limits.get("cpuset"):
+            hc["CpusetCpus"] = str(limits["cpuset"])
+        if limits.get("cpus"):
+            hc["NanoCpus"] = int(float(limits["cpus"]) * 1e9)
+        if limits.get("memory"):
+            hc["Memory"] = _memory_bytes(limits["memory"])
+        if limits.get("pids"):
+            hc["PidsLimit"] = int(limits["pids"])
+        if limits.get("network"):
+            hc["NetworkMode"] = limits["network"]
+        if limits.get("cap_drop"):
+            hc["CapDrop"] = list(limits["cap_drop"])
+        if limits.get("no_new_privileges"):
+            hc["SecurityOpt"] = ["no-new-privileges"]
+        return hc
+
+    def version(self) -> dict:
+        return self._call("GET", "/version", timeout=20)
+
+    def info(self) -> dict:
+        return self._call("GET", "/info", timeout=20)
+
+    def image_id(self, image: str) -> Optional[str]:
+        try:
+            info = self._call("GET", f"/images/{urllib.parse.quote(image, safe='/:@')}/json", timeout=30)
+        except DockerError:
+            return None
+        return (info or {}).get("Id")
+
+    def pull(self, image: str, on_progress=None, timeout: int = 240) -> dict:
+        ref, tag = image, "latest"
+        last = image.rsplit("/", 1)[-1]
+        if "@" in last:
+            ref, tag = image.split("@", 1)[0], image.split("@", 1)[1]
+        elif ":" in last:
+            ref, tag = image.rsplit(":", 1)
+        lines, layers = [], {}
+        res = {}
+        conn, resp = self._open("POST", "/images/create", params={"fromImage": ref, "tag": tag}, timeout=timeout)
+        try:
+            for raw in resp:
+                try:
+                    ev = json.loads(raw)
+                except ValueError:
+                    continue
+                if ev.get("error"):
+                    res["error"] = ev["error"]
+                    break
+                if ev.get("id") and ev.get("progressDetail", {}).get("total"):
+                    layers[ev["id"]] = (ev["progressDetail"].get("current", 0), ev["progressDetail"]["total"])
+                elif ev.get("status"):
+                    lines.append(f"{ev['id']}: {ev['status']}" if ev.get("id") else ev["status"])
+                if on_progress:
+                    done, total = sum(c for c, _ in layers.values()), sum(t for _, t in layers.values())
+                    on_progress({"status": ev.get("status"), "layers": len(layers), "current": done, "total": total})
+        finally:
+            conn.close()
+        res["output"] = "\n".join(lines)[-4000:]
+        return res
+
+    def _create(self, image, cmd, mounts, limits, name, labels, auto_remove=False) -> str:
+        body = {"Image": image, "Cmd": list(cmd), "Labels": dict(labels or {}), "AttachStdout": True, "AttachStderr": True,
+                "HostConfig": dict(self._host_config(mounts, limits), AutoRemove=auto_remove)}
+        params = {"name": name} if name else None
+        return self._call("POST", "/containers/create", body, params)["Id"]
+
+    def run(self, image: str, cmd: List[str], mounts=None, limits=None, name: Optional[str] = None, labels=None,
+            on_line=None, timeout: int = 1800, detach: bool = False, remove: bool = True, on_start=None):
+        cid = self._create(image, cmd, mounts, limits, name, labels, auto_remove=detach and remove)
+        if detach:
+            self._call("POST", f"/containers/{cid}/start")
+            return cid
+        timed_out = threading.Event()
+        def on_timeout():
+            timed_out.set()
+            try:
+                self.kill(cid)
+            except DockerError:
+                pass
+        timer = threading.Timer(timeout, on_timeout)
+        try:
+            self._call("POST", f"/containers/{cid}/start")
+            timer.start()
+            conn, resp = self._open("GET", f"/containers/{cid}/logs", params={"follow": 1, "stdout": 1, "stderr": 1}, timeout=None)
+            if on_start:
+                on_start(lambda: self._shutdown(conn))
+            try:
+                self._demux(resp, on_line or (lambda line: None))
+            finally:
+                conn.close()
+            code = self._call("POST", f"/containers/{cid}/wait", timeout=None).get("StatusCode", -1)
+        finally:
+            timer.cancel()
+            if remove:
+                try:
+                    self.remove(cid)
+                except DockerError:
+                    pass
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return code
+
+    @staticmethod
+    def _shutdown(conn):
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, AttributeError):
+            pass
+
+    def exec(self, container: str, cmd: List[str], on_line=None, timeout: int = 300, on_start=None) -> int:
+        eid = self._call("POST", f"/containers/{container}/exec", {"Cmd": list(cmd), "AttachStdout": True, "AttachStderr": True})["Id"]
+        conn, resp = self._open("POST", f"/exec/{eid}/start", {"Detach": False, "Tty": False}, timeout=None)
+        if on_start:
+            on_start(lambda: self._shutdown(conn))
+        timed_out = threading.Event()
+        def on_timeout():
+            timed_out.set()
+            self._shutdown(conn)
+        timer = threading.Timer(timeout, on_timeout)
+        timer.start()
+        try:
+            self._demux(resp, on_line or (lambda line: None))
+        except OSError:
+            if not timed_out.is_set():
+                raise
+        finally:
+            timer.cancel()
+            conn.close()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        code = self._call("GET", f"/exec/{eid}/json").get("ExitCode")
+        return code if code is not None else -1
+
+    def update(self, container: str, limits: dict):
+        hc = self._host_config(None, {k: limits.get(k) for k in ("cpuset", "cpus", "memory")})
+        hc.pop("Mounts")
+        if "Memory" in hc:
+            hc["MemorySwap"] = -1
+        if hc:
+            self._call("POST", f"/containers/{container}/update", hc)
+
+    def kill(self, container: str, signal: str = "KILL"):
+        self._call("POST", f"/containers/{container}/kill", params={"signal": signal}, timeout=30)
+
+    def remove(self, container: str):
+        try:
+            self._call("DELETE", f"/containers/{container}", params={"force": 1}, timeout=60)
+        except DockerError as e:
+            if e.status != 404:
+                raise
+
+    def stats(self, container: str) -> dict:
+        return self._call("GET", f"/containers/{container}/stats", params={"stream": 0}, timeout=30)
+
+    def containers(self, label: str) -> List[str]:
+        lst = self._call("GET", "/containers/json", params={"all": 1, "filters": json.dumps({"label": [label]})}) or []
+        return [(c.get("Names") or ["/" + c["Id"][:12]])[0].lstrip("/") for c in lst]
+
+class FakeDocker:
+    """Pretends to be Docker: every `echo PERF_START:<TAG>` in a script yields a PERF phase with samples."""
+    name = "fake"
+    PHASE_RE = re.compile(r"echo PERF_START:(\w+)")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._containers = {}
+
+    def version(self) -> dict:
+        return {"Version": "fake", "ApiVersion": "fake"}
+
+    def info(self) -> dict:
+        return {"NCPU": os.cpu_count(), "OperatingSystem": "fake"}
+
+    def image_id(self, image: str) -> Optional[str]:
+        return "sha256:" + hashlib.sha256(image.encode("utf-8")).hexdigest()
+
+    def pull(self, image: str, on_progress=None, timeout: int = 240) -> dict:
+        if on_progress:
+            on_progress({"status": "Downloaded newer image", "layers": 0, "current": 0, "total": 0})
+        return {"output": f"fake: pulled {image}"}
+
+    def _emit(self, script: str, on_line) -> int:
+        for tag in self.PHASE_RE.findall(script or ""):
+            base = 1.0 if tag.upper().startswith("BEFORE") else 0.7
+            samples = [base * random.uniform(0.98, 1.02) for _ in range(5)]
+            on_line(f"PERF_START:{tag}\n".encode())
+            on_line(f"{SAMPLE_PREFIX} {json.dumps(samples)}\n".encode())
+            on_line(f"Mean: {statistics.fmean(samples):.6f}\nStd Dev: {statistics.stdev(samples):.6f}\n".encode())
+            on_line(f"PERF_END:{tag}\n".encode())
+        return 0
+
+    def run(self, image: str, cmd: List[str], mounts=None, limits=None, name: Optional[str] = None, labels=None,
+            on_line=None, timeout: int = 1800, detach: bool = False, remove: bool = True, on_start=None):
+        name = name or f"fake-{secrets.token_hex(6)}"
+        if detach:
+            with self._lock:
+                self._containers[name] = {"image": image, "labels": dict(labels or {}), "limits": dict(limits or {})}
+            return name
+        return self._emit(cmd[-1] if cmd else "", on_line or (lambda line: None))
+
+    def exec(self, container: str, cmd: List[str], on_line=None, timeout: int = 300, on_start=None) -> int:
+        with self._lock:
+            if container not in self._containers:
+                raise DockerError(f"No such container: {container}", 404)
+        return self._emit(cmd[-1] if cmd else "", on_line or (lambda line: None))
+
+    def update(self, container: str, limits: dict):
+        with self._lock:
+            if container in self._containers:
+                self._containers[container]["limits"].update(limits)
+
+    def kill(self, container: str, signal: str = "KILL"):
+        self.remove(container)
+
+    def remove(self, container: str):
+        with self._lock:
+            self._containers.pop(container, None)
+
+    def stats(self, container: str) -> dict:
+        return {"name": container, "cpu_stats": {}, "memory_stats": {}}
+
+    def containers(self, label: str) -> List[str]:
+        key, _, value = label.partition("=")
+        with self._lock:
+            return [n for n, c in self._containers.items() if key in c["labels"] and (not value or c["labels"][key] == value)]
+
+_docker_backend = []
+
+def docker_backend():
+    if not _docker_backend:
+        kind = DOCKER_BACKEND
+        if kind == "auto":
+            kind = "engine" if os.path.exists(DOCKER_SOCK) else "cli"
+        _docker_backend.append(EngineDocker(DOCKER_SOCK) if kind == "engine" else FakeDocker() if kind == "fake" else CliDocker())
+    return _docker_backend[0]
+
+@app.get("/api/health")
+def health(request: Request):
+    check_origin(request)
+    os.makedirs(ROOT_DIR, exist_ok=True)
+    return {
+        "ok": True,
+        "root": ROOT_DIR,
+        "server": "swefficiency-helper",
+        "docker_sock": os.path.exists("/var/run/docker.sock"),
+        "allowed_origins": ALLOWED_ORIGINS,
+        "queue": bench_queue_info(),
+        "outbox": outbox_status(),
+        "sweeps": sweeps_status(),
+        "host": (_host["fingerprint"] or {}).get("id"),
+    }
+
+@app.get("/api/docker/check")
+def docker_check(request: Request):
+    check_origin(request)
+    backend = docker_backend()
+    try:
+        return {"available": True, "backend": backend.name, "output": json.dumps(backend.version())}
+    except Exception as e:
+        return {"available": False, "backend": backend.name, "error": str(e)}
+
+# Host fingerprint: what a result was measured on. The static part (CPU model and cores, frequency
+# governor, memory, OS and kernel, Docker engine and the CPUs/memory it can hand out) is probed once and
+# again after HOST_TTL; its "id" only changes when one of those does. Every run adds its container limits
+# and the load around it. With normalize=true a fixed calibration loop is timed in the same container
+# (or by the helper's own Python when the image has none) and timings are also reported rescaled to a
+# machine on which that loop takes SWEF_CALIBRATION_REF seconds. Speedup ratios are unaffected by the
+# rescaling; it is the absolute means that become comparable across machines.
+HOST_TTL = int(os.environ.get("SWEF_HOST_TTL", "600"))
+CALIBRATION_REF = float(os.environ.get("SWEF_CALIBRATION_REF", "0.05"))
+CALIBRATION_SRC = (
+    "import time\n"
+    "def work():\n"
+    "    d = {}\n"
+    "    for i in range(200000):\n"
+    "        k = i % 997\n"
+    "        d[k] = d.get(k, 0) + i * i\n"
+    "    return sorted(str(v) for v in d.values())\n"
+    "best = None\n"
+    "for _ in range(7):\n"
+    "    t = time.perf_counter(); work(); t = time.perf_counter() - t\n"
+    "    best = t if best is None or t < best else best\n"
+    "print('SWEF_CALIBRATION %.6f' % best)\n"
+)
+CALIBRATION_STEP = f"(python3 -c {shlex.quote(CALIBRATION_SRC)} || python -c {shlex.quote(CALIBRATION_SRC)}) 2>/dev/null || true"
+CALIBRATION_RE = re.compile(rb"SWEF_CALIBRATION ([0-9.eE+-]+)\s*$")
+_host_lock = threading.Lock()
+_host = {"fingerprint": None, "probing": False, "calibration": None}
+
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _sysctl(name: str) -> Optional[str]:
+    try:
+        cp = run_cmd(["sysctl", "-n", name], timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    out = cp.stdout.decode("utf-8", "ignore").strip()
+    return out if cp.returncode == 0 and out else None
+
+def _int_or_none(v) -> Optional[int]:
+    try:
+        return int(str(v).strip())
+    except (TypeError, ValueError):
+        return None
+
+def _probe_cpu() -> dict:
+    cpu = {"model": None, "logical": os.cpu_count(), "physical": None, "governor": None, "maxMHz": None}
+    cpuinfo = _read_text("/proc/cpuinfo")
+    if cpuinfo:
+        cores, package = set(), None
+        for line in cpuinfo.splitlines():
+            key, _, value = line.partition(":")
+            key, value = key.strip(), value.strip()
+            if key == "model name" and not cpu["model"]:
+                cpu["model"] = value
+            elif key == "physical id":
+                package = value
+            elif key == "core id":
+                cores.add((package, value))
+        cpu["physical"] = len(cores) or None
+        cpu["governor"] = (_read_text("/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor") or "").strip() or None
+        khz = _int_or_none(_read_text("/sys/devices/system/cpu/cpu0/cpufreq/cpuinfo_max_freq"))
+        cpu["maxMHz"] = khz // 1000 if khz else None
+    elif platform.system() == "Darwin":
+        cpu["model"] = _sysctl("machdep.cpu.brand_string")
+        cpu["physical"] = _int_or_none(_sysctl("hw.physicalcpu"))
+        hz = _int_or_none(_sysctl("hw.cpufrequency_max"))  # Intel only
+        cpu["maxMHz"] = hz // 1000000 if hz else None
+    cpu["model"] = cpu["model"] or platform.processor() or None
+    return cpu
+
+def _probe_memory() -> Optional[int]:
+    meminfo = _read_text("/proc/meminfo")
+    if meminfo:
+        m = re.search(r"^MemTotal:\s+(\d+)\s*kB", meminfo, re.M)
+        return int(m.group(1)) * 1024 if m else None
+    return _int_or_none(_sysctl("hw.memsize")) if platform.system() == "Darwin" else None
+
+def _probe_docker() -> dict:
+    backend = docker_backend()
+    docker = {"backend": backend.name}
+    try:
+        v = backend.version()
+        server = v.get("Server") if isinstance(v.get("Server"), dict) else v
+        docker.update(version=server.get("Version"), os=server.get("Os"), arch=server.get("Arch"), kernel=server.get("KernelVersion"))
+        info = backend.info()
+        docker.update(cpus=info.get("NCPU"), memory=info.get("MemTotal"), system=info.get("OperatingSystem"),
+                      cgroup=info.get("CgroupVersion"), cgroupDriver=info.get("CgroupDriver"))
+    except Exception as e:
+        docker["error"] = str(e)
+    return docker
+
+def host_fingerprint(refresh: bool = False) -> dict:
+    """The cached host fingerprint, probed again when older than HOST_TTL (or with refresh)."""
+    with _host_lock:
+        fp = _host["fingerprint"]
+        if fp is not None and not refresh and time.time() - fp["probed"] < HOST_TTL:
+            return fp
+    fp = {"cpu": _probe_cpu(), "memory": _probe_memory(),
+          "os": {"system": platform.system(), "release": platform.release(), "machine": platform.machine(),
+                 "python": platform.python_version()},
+          "docker": _probe_docker(), "helper_version": "1.0"}
+    # Errors are transient; only the measured properties identify the host
+    stable = dict(fp, docker={k: v for k, v in fp["docker"].items() if k != "error"})
+    fp["id"] = hashlib.sha256(json.dumps(stable, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    fp["probed"] = int(time.time())
+    with _host_lock:
+        prev = _host["fingerprint"]
+        fp["since"] = prev["since"] if prev is not None and prev["id"] == fp["id"] else fp["probed"]
+        _host["fingerprint"] = fp
+    return fp
+
+def ensure_host_fingerprint() -> Optional[dict]:
+    """Cached fingerprint without blocking; a missing or stale one is probed in the background."""
+    with _host_lock:
+        fp = _host["fingerprint"]
+        if (fp is None or time.time() - fp["probed"] >= HOST_TTL) and not _host["probing"]:
+            _host["probing"] = True
+            def probe():
+                try:
+                    host_fingerprint(refresh=True)
+                finally:
+                    with _host_lock:
+                        _host["probing"] = False
+            threading.Thread(target=probe, name="host-fingerprint", daemon=True).start()
+    return fp
+
+def host_load() -> dict:
+    """System load right now: load averages and how many bench jobs this helper is running."""
+    out = {"ts": int(time.time()), "jobs": len(bench_queue_info()["running"])}
+    try:
+        out["loadavg"] = [round(x, 2) for x in os.getloadavg()]
+    except OSError:
+        out["loadavg"] = None
+    return out
+
+def host_calibration() -> Optional[float]:
+    """Seconds the calibration loop takes in the helper's own Python (cached for HOST_TTL)."""
+    with _host_lock:
+        cached = _host["calibration"]
+        if cached is not None and time.time() - cached[1] < HOST_TTL:
+            return cached[0]
+    try:
+        cp = run_cmd([sys.executable, "-c", CALIBRATION_SRC], timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    m = CALIBRATION_RE.search(cp.stdout.strip())
+    if cp.returncode != 0 or not m:
+        return None
+    seconds = float(m.group(1))
+    with _host_lock:
+        _host["calibration"] = (seconds, time.time())
+    return seconds
+
+def normalized_timings(result: dict, seconds: Optional[float], source: str) -> dict:
+    """Phase means/stds rescaled by CALIBRATION_REF / seconds."""
+    if not seconds or seconds <= 0:
+        return {"factor": None, "source": source, "error": "calibration did not run"}
+    factor = CALIBRATION_REF / seconds
+    def scaled(ph: dict) -> dict:
+        return {k: ph[k] * factor if isinstance(ph.get(k), (int, float)) else None for k in ("mean", "std")}
+    out = {"factor": factor, "calibrationSeconds": seconds, "reference": CALIBRATION_REF, "source": source,
+           "before": scaled(result.get("before") or {}), "after": scaled(result.get("after") or {})}
+    if result.get("patches"):
+        out["patches"] = [dict(scaled(p), name=p.get("name")) for p in result["patches"]]
+    return out
+
+@app.get("/api/host")
+def host_info(request: Request, refresh: bool = False, calibrate: bool = False):
+    check_origin(request)
+    res = {"ok": True, "host": host_fingerprint(refresh), "load": host_load()}
+    if calibrate:
+        seconds = host_calibration()
+        res["calibration"] = {"seconds": seconds, "reference": CALIBRATION_REF,
+                              "factor": CALIBRATION_REF / seconds if seconds else None}
+    return JSONResponse(res)
+
+# Image manager: remembers the local digest and last pull time of every image it has pulled.
+# An image that is already local is only pulled again once IMAGE_TTL has passed (or with force),
+# and concurrent requests for the same image share a single in-flight pull.
+_image_lock = threading.Lock()
+_image_inflight = {}
+_image_state = None
+_prewarm_tasks = {}
+_pull_progress = {}
+
+def image_for_instance(instance: str) -> str:
+    return f"docker.io/sweperf/sweperf_annotate:{instance}"
+
+def _load_image_state() -> dict:
+    global _image_state
+    if _image_state is None:
+        try:
+            with open(IMAGE_STATE_FILE, "r", encoding="utf-8") as f:
+                _image_state = json.load(f)
+        except Exception:
+            _image_state = {}
+    return _image_state
+
+def _save_image_state():
+    try:
+        os.makedirs(ROOT_DIR, exist_ok=True)
+        with open(IMAGE_STATE_FILE + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(_image_state, f, indent=1)
+        os.replace(IMAGE_STATE_FILE + ".tmp", IMAGE_STATE_FILE)
+    except Exception:
+        pass
+
+def image_local_digest(image: str) -> Optional[str]:
+    try:
+        return docker_backend().image_id(image)
+    except Exception:
+        return None
+
+def _pull_image(image: str, force: bool) -> dict:
+    now = int(time.time())
+    with _image_lock:
+        entry = dict(_load_image_state().get(image) or {})
+    digest = image_local_digest(image)
+    fresh = digest and entry.get("digest") == digest and now - int(entry.get("pulled", 0)) < IMAGE_TTL
+    if fresh and not force:
+        metric_inc("swef_image_requests_total", outcome="cached")
+        return {"image": image, "digest": digest, "pulled": False, "cached": True}
+    res = {"image": image, "pulled": True, "cached": False}
+    def on_progress(p: dict):
+        with _image_lock:
+            _pull_progress[image] = dict(p, ts=int(time.time()))
+    t0 = time.monotonic()
+    try:
+        res.update(docker_backend().pull(image, on_progress, timeout=240))
+    except Exception as e:
+        res["error"] = str(e)
+    finally:
+        with _image_lock:
+            _pull_progress.pop(image, None)
+    metric_observe("swef_image_pull_seconds", time.monotonic() - t0)
+    metric_inc("swef_image_requests_total", outcome="error" if res.get("error") else "pulled")
+    new_digest = image_local_digest(image)
+    res["digest"] = new_digest or digest
+    res["changed"] = bool(new_digest and digest and new_digest != digest)
+    if new_digest:
+        entry.update({"digest": new_digest, "pulled": now})
+    entry.update({"checked": now, "error": res.get("error")})
+    with _image_lock:
+        _load_image_state()[image] = entry
+        _save_image_state()
+    return res
+
+def ensure_image(image: str, force: bool = False, timeout: int = 300) -> dict:
+    """Make sure image is available locally, pulling only when needed; concurrent callers share one pull."""
+    with _image_lock:
+        waiter = _image_inflight.get(image)
+        if waiter is None:
+            waiter = _image_inflight[image] = {"event": threading.Event(), "result": None}
+            leader = True
+        else:
+            leader = False
+    if not leader:
+        metric_inc("swef_image_requests_total", outcome="shared")
+        waiter["event"].wait(timeout)
+        return dict(waiter["result"] or {"image": image, "error": "pull still in progress"}, shared=True)
+    try:
+        waiter["result"] = _pull_image(image, force)
+    except Exception as e:
+        waiter["result"] = {"image": image, "error": str(e)}
+    finally:
+        with _image_lock:
+            _image_inflight.pop(image, None)
+        waiter["event"].set()
+    return dict(waiter["result"])
+
+def _run_prewarm(task_id: str, images: List[str], parallel: int, force: bool):
+    task = _prewarm_tasks[task_id]
+    def one(image):
+        res = ensure_image(image, force=force)
+        res.pop("output", None)
+        with _image_lock:
+            task["results"][image] = res
+            task["done"] += 1
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        list(pool.map(one, images))
+    task["finished"] = int(time.time())
+
+class PrewarmReq(BaseModel):
+    images: Optional[List[str]] = None
+    instances: Optional[List[str]] = None
+    parallel: Optional[int] = 2
+    force: Optional[bool] = False
+
+@app.post("/api/images/prewarm")
+def images_prewarm(req: PrewarmReq, request: Request):
+    check_origin(request)
+    images = list(req.images or []) + [image_for_instance(i) for i in (req.instances or [])]
+    images = list(dict.fromkeys(i.strip() for i in images if i and i.strip()))
+    if not images:
+        raise HTTPException(400, "no images given")
+    task_id = f"prewarm-{int(time.time())}-{secrets.token_hex(4)}"
+    _prewarm_tasks[task_id] = {"id": task_id, "total": len(images), "done": 0, "results": {}, "started": int(time.time()), "finished": None}
+    parallel = max(1, min(int(req.parallel or 1), 8))
+    threading.Thread(target=_run_prewarm, args=(task_id, images, parallel, bool(req.force)), name=task_id, daemon=True).start()
+    return JSONResponse({"ok": True, "taskId": task_id, "total": len(images)}, status_code=202)
+
+@app.get("/api/images")
+def images_status(request: Request):
+    check_origin(request)
+    with _image_lock:
+        return JSONResponse({
+            "ok": True,
+            "ttl": IMAGE_TTL,
+            "images": dict(_load_image_state()),
+            "inflight": list(_image_inflight),
+            "progress": dict(_pull_progress),
+            "prewarm": list(_prewarm_tasks.values()),
+        })
+
+class RunReq(BaseModel):
+    repo: str
+    commit: Optional[str] = None
+    test: Optional[str] = None
+    image: Optional[str] = "ubuntu:22.04"
+    subdir: Optional[str] = "job"
+
+@app.post("/api/run")
+def run_pipeline(req: RunReq, request: Request):
+    check_origin(request)
+    os.makedirs(ROOT_DIR, exist_ok=True)
+    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, req.subdir or "job"))
+    os.makedirs(job_dir, exist_ok=True)
+
+    pull = ensure_image(req.image)
+
+    limits = {"cpus": "1", "memory": "1g", "pids": 256, "network": "none", "cap_drop": ["ALL"], "no_new_privileges": True}
+    script = (
+        f"set -e; echo 'repo={req.repo}'; echo 'commit={req.commit or ''}'; "
+        f"echo 'test={req.test or ''}'; echo 'working in /work'; ls -la /work; "
+    )
+    try:
+        out = []
+        docker_backend().run(req.image, ["/bin/bash", "-lc", script], [(job_dir, "/work", False)], limits,
+                             on_line=out.append, timeout=180)
+        pull_txt = pull.get("output") or f"image {req.image}: {'up to date' if pull.get('cached') else pull.get('error') or 'pulled'}"
+        combined = pull_txt + "\n---\n" + b"".join(out).decode("utf-8","ignore")
+        return PlainTextResponse(combined, media_type="text/plain")
+    except Exception as e:
+        return PlainTextResponse(f"error: {e}", status_code=500)
+
+# Submission log: submissions.jsonl is append-only; submissions.idx is a sidecar with one
+# [offset, length, ts, instanceId, day, hash] line per record, appended alongside it. The in-memory
+# index maps instanceId / day / content hash to record positions so queries seek straight to the
+# matching lines (through mmap) instead of rescanning the file.
+SUBMIT_INDEX_FILE = os.path.join(ROOT_DIR, "submissions.idx")
+_submit_lock = threading.Lock()
+_submit_index = {"loaded": False, "size": 0, "entries": [], "instance": {}, "day": {}, "hash": {}}
+# Records are stored compact: the workload text and each phase's captured output ("core") go to
+# submissions.objects/ by sha256 and the line keeps workloadSha / coreSha instead, so resubmitting a
+# workload costs a few bytes. Content hashes are computed over the expanded record, so they still
+# match the names of files already uploaded to the data repo.
+SUBMIT_OBJECTS_DIR = os.path.join(ROOT_DIR, "submissions.objects")
+# submissions.cols is a fixed-width little-endian table with one row per indexed record, in index
+# order; submissions.cols.json gives its NumPy dtype and the instance names the `instance` column
+# points into. Analysis can memory-map it without parsing any JSON:
+#   meta = json.load(open("submissions.cols.json"))
+#   cols = np.memmap("submissions.cols", dtype=np.dtype([tuple(f) for f in meta["dtype"]]), mode="r")
+#   cols["improvement"][cols["instance"] == meta["instances"].index("astropy__astropy-12699")]
+SUBMIT_COLUMNS_FILE = os.path.join(ROOT_DIR, "submissions.cols")
+SUBMIT_COLUMNS_META = SUBMIT_COLUMNS_FILE + ".json"
+SUBMIT_COLUMNS = [("ts", "<i8"), ("offset", "<i8"), ("before_mean", "<f8"), ("before_std", "<f8"), ("after_mean", "<f8"),
+                  ("after_std", "<f8"), ("improvement", "<f8"), ("speedup", "<f8"), ("instance", "<u4"), ("flags", "<u4")]
+SUBMIT_ROW = struct.Struct("<qqddddddII")
+SUBMIT_FLAG_SIGNIFICANT = 1
+_submit_columns = {"loaded": False, "rows": 0, "instances": [], "ids": {}}
+
+def compact_record(rec: dict) -> dict:
+    """The record as written to submissions.jsonl: workload and phase output replaced by blob references."""
+    out = dict(rec)
+    if isinstance(out.get("workload"), str):
+        out["workloadSha"] = store_blob(out.pop("workload").encode("utf-8"), SUBMIT_OBJECTS_DIR)
+    for side in ("before", "after"):
+        ph = out.get(side)
+        if isinstance(ph, dict) and isinstance(ph.get("core"), str) and ph["core"]:
+            ph = dict(ph)
+            ph["coreSha"] = store_blob(ph.pop("core").encode("utf-8"), SUBMIT_OBJECTS_DIR)
+            out[side] = ph
+    return out
+
+def _submit_blob(sha: str) -> Optional[str]:
+    try:
+        with open(blob_path(sha, SUBMIT_OBJECTS_DIR), "r", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, HTTPException):
+        return None
+
+def expand_record(rec: dict) -> dict:
+    """Inverse of compact_record; records written before compaction come back unchanged."""
+    sides = [s for s in ("before", "after") if isinstance(rec.get(s), dict) and "coreSha" in rec[s]]
+    if "workloadSha" not in rec and not sides:
+        return rec
+    out = dict(rec)
+    if "workloadSha" in out:
+        out["workload"] = _submit_blob(out.pop("workloadSha"))
+    for side in sides:
+        ph = dict(out[side])
+        ph["core"] = _submit_blob(ph.pop("coreSha"))
+        out[side] = ph
+    return out
+
+def submission_hash(rec: dict) -> str:
+    """Content fingerprint of a submission; its first 8 hex digits name the uploaded file."""
+    key = json.dumps({
+        "instanceId": rec.get("instanceId"),
+        "workload": rec.get("workload"),
+        "before": rec.get("before"),
+        "after": rec.get("after"),
+        "improvement": rec.get("improvement"),
+        "notes": rec.get("notes")
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def _submission_entry(offset: int, line: bytes, rec: Optional[dict] = None) -> Optional[list]:
+    """Index entry for a stored line; rec is the full record when the caller still has it."""
+    try:
+        rec = rec if rec is not None else expand_record(json.loads(line))
+        ts = int(float(rec.get("ts") or 0))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    instance = rec.get("instanceId") or (rec.get("meta") or {}).get("instanceId") or ""
+    day = datetime.utcfromtimestamp(ts).strftime("%Y%m%d") if ts > 0 else ""
+    return [offset, len(line), ts, instance, day, submission_hash(rec)]
+
+def _index_add(entry: list):
+    idx = _submit_index
+    pos = len(idx["entries"])
+    idx["entries"].append(entry)
+    idx["size"] = entry[0] + entry[1]
+    for name, key in (("instance", entry[3]), ("day", entry[4]), ("hash", entry[5][:8])):
+        if key:
+            idx[name].setdefault(key, []).append(pos)
+
+def _index_catch_up():
+    """Load the sidecar once, then index whatever was appended to the JSONL file behind our back."""
+    idx = _submit_index
+    rewrite = False
+    if not idx["loaded"]:
+        idx["loaded"] = True
+        try:
+            with open(SUBMIT_INDEX_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None
+                    if not entry or entry[0] != idx["size"]:
+                        rewrite = True  # gap or torn write: re-index from here
+                        break
+                    _index_add(entry)
+        except FileNotFoundError:
+            rewrite = True
+    try:
+        size = os.path.getsize(SUBMIT_FILE)
+    except OSError:
+        size = 0
+    if size < idx["size"]:
+        # File was truncated or replaced: start over
+        idx.update({"size": 0, "entries": [], "instance": {}, "day": {}, "hash": {}})
+        _submit_columns.update({"loaded": True, "rows": 0, "instances": [], "ids": {}})
+        for path in (SUBMIT_COLUMNS_FILE, SUBMIT_COLUMNS_META):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        rewrite = True
+    if size == idx["size"] and not rewrite:
+        return
+    added = []
+    with open(SUBMIT_FILE, "ab+") as f:
+        f.seek(idx["size"])
+        offset = idx["size"]
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partial record still being written
+            entry = _submission_entry(offset, line)
+            offset += len(line)
+            if entry is None:
+                idx["size"] = offset
+                continue
+            _index_add(entry)
+            added.append(entry)
+    if rewrite:
+        _write_index_entries(idx["entries"], rewrite=True)
+    else:
+        _write_index_entries(added)
+
+def _write_index_entries(entries: list, rewrite: bool = False):
+    if not entries and not rewrite:
+        return
+    with open(SUBMIT_INDEX_FILE, "w" if rewrite else "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+def _columns_row(entry: list, rec: dict) -> bytes:
+    def num(v) -> float:
+        return float(v) if isinstance(v, (int, float)) else math.nan
+    before, after = rec.get("before") or {}, rec.get("after") or {}
+    stats = rec.get("stats") or {}
+    speedup = stats.get("speedup")
+    if speedup is None and isinstance(before, dict) and isinstance(after, dict):
+        speedup = speedup_of(before, after)["speedup"]
+    ids = _submit_columns["ids"]
+    if entry[3] not in ids:
+        ids[entry[3]] = len(_submit_columns["instances"])
+        _submit_columns["instances"].append(entry[3])
+    return SUBMIT_ROW.pack(entry[2], entry[0], num(before.get("mean")), num(before.get("std")), num(after.get("mean")),
+                           num(after.get("std")), num(rec.get("improvement")), num(speedup), ids[entry[3]],
+                           SUBMIT_FLAG_SIGNIFICANT if stats.get("significant") else 0)
+
+def _columns_catch_up(latest: Optional[dict] = None):
+    """Bring submissions.cols level with the index (under _submit_lock); latest is the record just appended."""
+    cols = _submit_columns
+    if not cols["loaded"]:
+        cols["loaded"] = True
+        try:
+            with open(SUBMIT_COLUMNS_META, "r", encoding="utf-8") as f:
+                cols["instances"] = json.load(f).get("instances") or []
+            cols["rows"] = os.path.getsize(SUBMIT_COLUMNS_FILE) // SUBMIT_ROW.size
+        except (OSError, ValueError):
+            cols["instances"], cols["rows"] = [], 0
+        cols["ids"] = {name: i for i, name in enumerate(cols["instances"])}
+    entries = _submit_index["entries"]
+    known = len(cols["instances"])
+    if cols["rows"] > len(entries) or (cols["rows"] and not known):
+        cols.update({"rows": 0, "instances": [], "ids": {}})  # out of step with the index: rebuild
+        known = -1
+    if cols["rows"] < len(entries):
+        with open(SUBMIT_COLUMNS_FILE, "r+b" if cols["rows"] else "wb") as out:
+            out.truncate(cols["rows"] * SUBMIT_ROW.size)
+            out.seek(0, os.SEEK_END)
+            missing = entries[cols["rows"]:]
+            if latest is not None and len(missing) == 1:
+                out.write(_columns_row(missing[0], latest))
+            else:
+                with open(SUBMIT_FILE, "rb") as f:
+                    for entry in missing:
+                        f.seek(entry[0])
+                        try:
+                            rec = json.loads(f.read(entry[1]))
+                        except ValueError:
+                            rec = {}
+                        out.write(_columns_row(entry, rec))
+        cols["rows"] = len(entries)
+    if len(cols["instances"]) != known:
+        tmp = SUBMIT_COLUMNS_META + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dtype": SUBMIT_COLUMNS, "itemsize": SUBMIT_ROW.size, "instances": cols["instances"]}, f, ensure_ascii=False)
+        os.replace(tmp, SUBMIT_COLUMNS_META)
+
+def append_submission(rec: dict) -> list:
+    """Append a record (compacted) to submissions.jsonl, index it and add its summary row; returns its index entry."""
+    os.makedirs(ROOT_DIR, exist_ok=True)
+    stored = compact_record(rec)
+    line = (json.dumps(stored, ensure_ascii=False) + "\n").encode("utf-8")
+    with _submit_lock:
+        _index_catch_up()
+        _columns_catch_up()
+        with open(SUBMIT_FILE, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(line)
+        entry = _submission_entry(offset, line, rec)
+        _index_add(entry)
+        _write_index_entries([entry])
+        _columns_catch_up(stored)
+    metric_inc("swef_submissions_appended_total")
+    metric_inc("swef_submission_bytes_total", len(line))
+    return entry
+
+def query_submissions(instance: Optional[str] = None, day: Optional[str] = None, content_hash: Optional[str] = None,
+                      since: Optional[int] = None, until: Optional[int] = None,
+                      offset: int = 0, limit: int = 50, newest_first: bool = True) -> dict:
+    with _submit_lock:
+        _index_catch_up()
+        idx = _submit_index
+        entries = idx["entries"]
+        postings = []
+        if instance:
+            postings.append(idx["instance"].get(instance, []))
+        if day:
+            postings.append(idx["day"].get(day, []))
+        if content_hash:
+            postings.append([p for p in idx["hash"].get(content_hash[:8], []) if entries[p][5].startswith(content_hash)])
+        if postings:
+            postings.sort(key=len)
+            others = [set(p) for p in postings[1:]]
+            positions = [p for p in postings[0] if all(p in o for o in others)]
+        else:
+            positions = range(len(entries))
+        if since is not None or until is not None:
+            lo, hi = since if since is not None else -1, until if until is not None else float("inf")
+            positions = [p for p in positions if lo <= entries[p][2] <= hi]
+        positions = list(positions)
+        if newest_first:
+            positions.reverse()
+        total = len(positions)
+        page = [entries[p] for p in positions[offset:offset + limit]]
+    items = []
+    if page:
+        with open(SUBMIT_FILE, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for off, length, ts, inst, d, h in page:
+                try:
+                    rec = json.loads(mm[off:off + length])
+                except ValueError:
+                    continue
+                items.append({"offset": off, "hash": h, "record": rec})
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
+
+@app.get("/api/submissions")
+def list_submissions(request: Request, instanceId: Optional[str] = None, day: Optional[str] = None,
+                     hash: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None,
+                     offset: int = 0, limit: int = 50, order: str = "desc", full: bool = False):
+    check_origin(request)
+    if day and not re.fullmatch(r"\d{8}", day):
+        raise HTTPException(400, "day must be YYYYMMDD")
+    if hash and not re.fullmatch(r"[0-9a-f]{8,64}", hash):
+        raise HTTPException(400, "hash must be at least 8 hex digits")
+    res = query_submissions(instanceId, day, hash, since, until, max(0, offset), max(1, min(limit, 500)), order != "asc")
+    for item in res["items"]:
+        if full:
+            item["record"] = expand_record(item["record"])
+        else:
+            # Workload text dominates record size; fetch it with full=1 when needed
+            item["record"].pop("workload", None)
+    return JSONResponse({"ok": True, **res})
+
+@app.get("/api/submissions/columns")
+def submission_columns(request: Request):
+    check_origin(request)
+    with _submit_lock:
+        _index_catch_up()
+        _columns_catch_up()
+        rows = _submit_columns["rows"]
+        instances = list(_submit_columns["instances"])
+    return JSONResponse({"ok": True, "dtype": SUBMIT_COLUMNS, "itemsize": SUBMIT_ROW.size, "rows": rows, "instances": instances,
+                         "path": SUBMIT_COLUMNS_FILE, "url": "/api/submissions/columns.bin"})
+
+@app.get("/api/submissions/columns.bin")
+def submission_columns_bin(request: Request):
+    check_origin(request)
+    with _submit_lock:
+        _index_catch_up()
+        _columns_catch_up()
+        length = _submit_columns["rows"] * SUBMIT_ROW.size
+    if not length:
+        return Response(b"", media_type="application/octet-stream")
+    with open(SUBMIT_COLUMNS_FILE, "rb") as f:
+        data = f.read(length)
+    return Response(data, media_type="application/octet-stream", headers={"X-Swef-Rows": str(length // SUBMIT_ROW.size)})
+
+# Aggregates: per-instance summaries folded incrementally from submissions.jsonl (and, optionally, a
+# checkout of the data repo with one JSON file per submission), rendered in the shapes the site's
+# assets/data/leaderboard.json, criteria_results.json and analysis.json use. aggregate/state.json
+# checkpoints the folded state with the byte offset reached in submissions.jsonl and the data-repo files
+# already read, each with its content hash; a refresh only reads what was added since. A record is
+# counted once: local lines are matched against earlier lines through the submission index, and an
+# uploaded record found in both places through the data-repo hashes, so nothing grows per local record.
+AGGREGATE_DIR = os.path.join(ROOT_DIR, "aggregate")
+AGGREGATE_STATE_FILE = os.path.join(AGGREGATE_DIR, "state.json")
+AGGREGATE_DATA_DIR = os.environ.get("SWEF_AGGREGATE_DATA_DIR", "")
+AGGREGATE_SAMPLES_MAX = 1000  # speedups kept per instance; past that the median is an estimate
+AGGREGATE_OUTPUTS = ("leaderboard.json", "criteria_results.json", "analysis.json")
+_aggregate_lock = threading.Lock()
+_aggregate = {}
+
+def _aggregate_empty() -> dict:
+    return {"offset": 0, "files": {}, "records": 0, "skipped": 0, "instances": {}}
+
+def _aggregate_load() -> dict:
+    if not _aggregate:
+        try:
+            with open(AGGREGATE_STATE_FILE, "r", encoding="utf-8") as f:
+                _aggregate.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        if not isinstance(_aggregate.get("files"), dict):  # missing, unreadable or the old per-record "seen" layout
+            _aggregate.clear()
+            _aggregate.update(_aggregate_empty())
+        _aggregate["_hashes"] = {h for h in _aggregate["files"].values() if h}
+    return _aggregate
+
+def _local_duplicate(entries: list, by_hash: dict, pos: int, content_hash: str) -> bool:
+    """True when a line of submissions.jsonl before index position `pos` has the same content hash."""
+    return any(p < pos and entries[p][5] == content_hash for p in by_hash.get(content_hash[:8], ()))
+
+def _aggregate_save(state: dict):
+    os.makedirs(AGGREGATE_DIR, exist_ok=True)
+    tmp = AGGREGATE_STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        # json.dumps runs the C encoder; json.dump into a file would not
+        f.write(json.dumps({k: v for k, v in state.items() if not k.startswith("_")}, ensure_ascii=False, separators=(",", ":")))
+    os.replace(tmp, AGGREGATE_STATE_FILE)
+
+def aggregate_fold(state: dict, rec: dict) -> bool:
+    """Fold one submission record into its instance summary; False when it carries no measurement."""
+    instance = rec.get("instanceId")
+    stats = rec.get("stats") or {}
+    speedup = stats.get("speedup")
+    if speedup is None and isinstance(rec.get("before"), dict) and isinstance(rec.get("after"), dict):
+        speedup = speedup_of(rec["before"], rec["after"])["speedup"]
+    if not instance or not isinstance(speedup, (int, float)) or speedup <= 0:
+        state["skipped"] += 1
+        return False
+    state["records"] += 1
+    ts = int(float(rec.get("ts") or 0))
+    inst = state["instances"].setdefault(instance, {"n": 0, "mean": 0.0, "m2": 0.0, "best": None, "bestTs": None,
+                                                    "significant": 0, "regressions": 0, "last": 0, "speedups": []})
+    # Welford running mean/variance for the confidence interval
+    inst["n"] += 1
+    delta = speedup - inst["mean"]
+    inst["mean"] += delta / inst["n"]
+    inst["m2"] += delta * (speedup - inst["mean"])
+    if inst["best"] is None or speedup > inst["best"]:
+        inst["best"], inst["bestTs"] = speedup, ts
+    if stats.get("significant") and speedup > 1:
+        inst["significant"] += 1
+    if speedup < 1:
+        inst["regressions"] += 1
+    inst["last"] = max(inst["last"], ts)
+    bisect.insort(inst["speedups"], speedup)
+    if len(inst["speedups"]) > AGGREGATE_SAMPLES_MAX:
+        # Dropping the smallest and the largest value keeps the median where it is
+        inst["speedups"].pop(0)
+        inst["speedups"].pop()
+    return True
+
+def aggregate_refresh(data_dir: Optional[str] = None, rebuild: bool = False) -> dict:
+    """Fold everything appended since the checkpoint, re-render the outputs if anything changed."""
+    t0 = time.perf_counter()
+    with _aggregate_lock:
+        state = _aggregate_load()
+        with _submit_lock:
+            _index_catch_up()
+            entries = _submit_index["entries"]
+            by_hash = _submit_index["hash"]
+            size = _submit_index["size"]
+        if rebuild or size < state["offset"]:  # size < offset: submissions.jsonl was truncated or replaced
+            rebuild = True
+            state.clear()
+            state.update(_aggregate_empty(), _hashes=set())
+        folded = 0
+        if size > state["offset"]:
+            start = state["offset"]
+            first = bisect.bisect_left([e[0] for e in entries], start)
+            with open(SUBMIT_FILE, "rb") as f:
+                f.seek(start)
+                data = f.read(size - start)
+            for pos in range(first, len(entries)):
+                entry = entries[pos]
+                if entry[5] in state["_hashes"] or _local_duplicate(entries, by_hash, pos, entry[5]):
+                    continue
+                try:
+                    rec = json.loads(data[entry[0] - start:entry[0] - start + entry[1]])
+                except ValueError:
+                    continue
+                folded += aggregate_fold(state, rec)
+            state["offset"] = size
+        data_dir = data_dir or AGGREGATE_DATA_DIR
+        if data_dir and os.path.isdir(data_dir):
+            for base, _, names in os.walk(data_dir):
+                for name in names:
+                    if not name.endswith(".json"):
+                        continue
+                    rel = os.path.relpath(os.path.join(base, name), data_dir)
+                    if rel in state["files"]:
+                        continue
+                    state["files"][rel] = None
+                    try:
+                        with open(os.path.join(base, name), "r", encoding="utf-8") as f:
+                            rec = json.load(f)
+                    except (OSError, ValueError):
+                        continue
+                    if not isinstance(rec, dict):
+                        continue
+                    content_hash = submission_hash(rec)
+                    if content_hash in state["_hashes"] or _local_duplicate(entries, by_hash, len(entries), content_hash):
+                        continue
+                    state["files"][rel] = content_hash
+                    state["_hashes"].add(content_hash)
+                    folded += aggregate_fold(state, rec)
+        outputs_missing = not all(os.path.exists(os.path.join(AGGREGATE_DIR, n)) for n in AGGREGATE_OUTPUTS)
+        if folded or rebuild or outputs_missing:
+            _aggregate_save(state)
+            for name, doc in render_aggregates(state).items():
+                tmp = os.path.join(AGGREGATE_DIR, name + ".tmp")
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(doc, ensure_ascii=False, separators=(",", ":")))
+                os.replace(tmp, os.path.join(AGGREGATE_DIR, name))
+        return {"folded": folded, "records": state["records"], "skipped": state["skipped"],
+                "instances": len(state["instances"]), "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+def instance_summary(instance: str, inst: dict) -> dict:
+    xs = inst["speedups"]
+    ci = None
+    if inst["n"] > 1:
+        half = t_quantile(1.0 - (1.0 - STATS_CONFIDENCE) / 2.0, inst["n"] - 1) * math.sqrt(inst["m2"] / (inst["n"] - 1) / inst["n"])
+        ci = [inst["mean"] - half, inst["mean"] + half]
+    # Past AGGREGATE_SAMPLES_MAX only the middle of the distribution is kept, so the median is an estimate
+    return {"instance": instance, "n": inst["n"], "best": inst["best"], "median": statistics.median(xs) if xs else None,
+            "medianApprox": inst["n"] > len(xs), "mean": inst["mean"], "ci": ci, "significant": inst["significant"], "regressions": inst["regressions"],
+            "date": datetime.utcfromtimestamp(inst["bestTs"] or inst["last"]).strftime("%Y-%m-%d")}
+
+def render_aggregates(state: dict) -> dict:
+    """The three site JSON documents, in the same shapes as the hand-maintained files under assets/data."""
+    rows = [instance_summary(k, v) for k, v in state["instances"].items()]
+    x = lambda v: f"{v:.2f}×" if v is not None else "–"
+    med = lambda r: ("≈" if r["medianApprox"] else "") + x(r["median"])
+    ci = lambda r: f"{r['ci'][0]:.2f}–{r['ci'][1]:.2f}×" if r["ci"] else "–"
+    columns = ["Rank", "Instance", "Best speedup", "Median speedup", "95% CI (mean)", "Submissions", "Date"]
+    def ranked(key):
+        ordered = sorted(rows, key=lambda r: (-(key(r) or 0), r["instance"]))
+        return [[i, r["instance"], x(r["best"]), med(r), ci(r), r["n"], r["date"]] for i, r in enumerate(ordered, start=1)]
+    sig_rows = sorted((r for r in rows if r["significant"]), key=lambda r: (-r["significant"], -r["significant"] / r["n"], r["instance"]))
+    leaderboard = {"criteria": [
+        {"id": "best", "name": "Best speedup", "columns": columns, "rows": ranked(lambda r: r["best"])},
+        {"id": "median", "name": "Median speedup", "columns": columns, "rows": ranked(lambda r: r["median"])},
+        {"id": "significant", "name": "Significant wins", "columns": ["Rank", "Instance", "Significant", "Submissions", "Share", "Date"],
+         "rows": [[i, r["instance"], r["significant"], r["n"], f"{100.0 * r['significant'] / r['n']:.0f}%", r["date"]]
+                  for i, r in enumerate(sig_rows, start=1)]},
+    ]}
+
+    bests = [r["best"] for r in rows]
+    medians = [r["median"] for r in rows if r["median"]]
+    hmean = statistics.harmonic_mean(bests) if bests else None
+    n_sig = sum(1 for r in rows if r["significant"])
+    n_reg = sum(1 for r in rows if r["regressions"])
+    criteria_results = {
+        "media": {"criteriaBasePath": "assets/images/criteria/", "resultsBasePath": "assets/images/results/",
+                  "defaultRatio": 0.30, "minSide": 180, "maxSide": 320},
+        "criteria": [
+            {"id": "best", "label": "Best", "title": "Best speedup", "image": None,
+             "body": "Largest T_before / T_after measured for the instance across all submissions."},
+            {"id": "median", "label": "Median", "title": "Median speedup", "image": None,
+             "body": "Median speedup over the instance's submissions, with a 95% confidence interval of the mean. "
+                     f"Past {AGGREGATE_SAMPLES_MAX} submissions it is estimated from the middle of the distribution (marked ≈)."},
+            {"id": "significant", "label": "Significant", "title": "Significant wins", "image": None,
+             "body": "Submissions whose speedup is above 1× and significant under Welch's t-test (p < 0.05)."},
+        ],
+        "results": [
+            {"id": "best", "label": "Best", "title": "Best speedup", "image": None,
+             "body": f"{len(rows)} instances measured; harmonic mean of best speedups {x(hmean)}, "
+                     f"median {x(statistics.median(bests) if bests else None)}."},
+            {"id": "median", "label": "Median", "title": "Median speedup", "image": None,
+             "body": f"Median of per-instance medians {x(statistics.median(medians) if medians else None)} "
+                     f"over {state['records']} submissions."},
+            {"id": "significant", "label": "Significant", "title": "Significant wins", "image": None,
+             "body": f"{n_sig} of {len(rows)} instances have at least one significant win; {n_reg} have a measured regression."},
+        ],
+    }
+
+    buckets = [("< 1×", 0, 1), ("1–1.1×", 1, 1.1), ("1.1–1.5×", 1.1, 1.5), ("1.5–2×", 1.5, 2), ("2–5×", 2, 5), ("≥ 5×", 5, float("inf"))]
+    top = sorted(rows, key=lambda r: -r["best"])[:5]
+    analysis = {"items": [
+        {"id": "a1", "title": "Coverage",
+         "body": f"{state['records']} measured submissions over {len(rows)} instances ({state['skipped']} records without a measurement skipped)."},
+        {"id": "a2", "title": "Distribution of best speedups",
+         "body": "; ".join(f"{label}: {sum(1 for b in bests if lo <= b < hi)}" for label, lo, hi in buckets)},
+        {"id": "a3", "title": "Largest speedups",
+         "body": "; ".join(f"{r['instance']} {x(r['best'])} ({r['n']} submissions)" for r in top) or "No data yet."},
+        {"id": "a4", "title": "Regressions",
+         "body": f"{n_reg} instances have at least one submission slower than its baseline."},
+    ]}
+    return {"leaderboard.json": leaderboard, "criteria_results.json": criteria_results, "analysis.json": analysis}
+
+class AggregateReq(BaseModel):
+    dataDir: Optional[str] = None  # checkout of the data repo to fold in (default: SWEF_AGGREGATE_DATA_DIR)
+    rebuild: Optional[bool] = False  # drop the checkpoint and fold everything again
+
+@app.post("/api/aggregate")
+def aggregate_run(req: AggregateReq, request: Request):
+    check_origin(request)
+    return JSONResponse({"ok": True, **aggregate_refresh(req.dataDir, bool(req.rebuild))})
+
+@app.get("/api/aggregate/{name}")
+def aggregate_output(name: str, request: Request):
+    check_origin(request)
+    if name not in AGGREGATE_OUTPUTS:
+        raise HTTPException(404, f"unknown aggregate {name}")
+    aggregate_refresh()
+    with open(os.path.join(AGGREGATE_DIR, name), "r", encoding="utf-8") as f:
+        return JSONResponse(json.load(f))
+
+class SubmitReq(BaseModel):
+    email: Optional[str] = None
+    notes: Optional[str] = None
+    meta: Optional[dict] = None
+
+@app.post("/api/submit")
+def submit(req: SubmitReq, request: Request):
+    check_origin(request)
+    rec = {"ts": int(time.time()), "email": req.email, "notes": req.notes, "meta": req.meta or {}}
+    append_submission(rec)
+    return ok()
+
+class BenchPrepareReq(BaseModel):
+    instance: str
+    image: str
+    code: str
+    patch: Optional[str] = None  # replaces the patch shipped in the image (/tmp/patch.diff)
+    patches: Optional[Dict[str, str]] = None  # name -> diff, for tournament runs
+
+class BenchPrepareResp(BaseModel):
+    ok: bool
+    jobId: str
+    hostWorkloadPath: str
+
+# Content-addressed object store: workloads and patches are written once to objects/<aa>/<sha256>
+# and job directories only reference them from meta.json. Objects are never modified after
+# they are written, so they are mounted read-only into containers.
+def store_blob(data: bytes, root: str = OBJECTS_DIR) -> str:
+    sha = hashlib.sha256(data).hexdigest()
+    path = blob_path(sha, root)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{secrets.token_hex(4)}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return sha
+
+def blob_path(sha: str, root: str = OBJECTS_DIR) -> str:
+    if not re.fullmatch(r"[0-9a-f]{64}", sha or ""):
+        raise HTTPException(400, "invalid object id")
+    return os.path.join(root, sha[:2], sha)
+
+def job_files(job_dir: str, meta: dict) -> dict:
+    """Host paths of a job's workload, optional patch and tournament patches (objects or legacy job files)."""
+    def resolve(sha: Optional[str], legacy: str) -> Optional[str]:
+        path = blob_path(sha) if sha else os.path.join(job_dir, legacy)
+        return path if os.path.exists(path) else None
+    return {
+        "workload": resolve(meta.get("workload"), "workload.py"),
+        "patch": resolve(meta.get("patch"), "patch.diff"),
+        "patches": [(p, resolve(p.get("sha"), p.get("file") or "")) for p in meta.get("patches") or []],
+    }
+
+def prepare_job(instance: str, image: str, workload: str, patch: Optional[str] = None,
+                patches: Optional[Dict[str, str]] = None) -> str:
+    """Create a job directory whose meta.json points at already stored blobs (workload/patch are shas)."""
+    os.makedirs(ROOT_DIR, exist_ok=True)
+    ensure_gc_thread()
+    job_id = f"job-{int(time.time())}-{secrets.token_hex(4)}"
+    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, job_id))
+    os.makedirs(job_dir, exist_ok=True)
+    meta = {"instance": instance, "image": image, "created": int(time.time()), "workload": workload}
+    if patch:
+        meta["patch"] = patch
+    if patches:
+        meta["patches"] = [{"name": name, "sha": sha, "tag": f"PATCH_{i}"}
+                           for i, (name, sha) in enumerate(patches.items(), start=1)]
+    with open(os.path.join(job_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return job_id
+
+@app.post("/api/bench/prepare")
+def bench_prepare(req: BenchPrepareReq, request: Request):
+    check_origin(request)
+    workload = store_blob(req.code.encode("utf-8"))
+    job_id = prepare_job(req.instance, req.image, workload,
+                         store_blob(req.patch.encode("utf-8")) if req.patch else None,
+                         {name: store_blob(diff.encode("utf-8")) for name, diff in req.patches.items()} if req.patches else None)
+    return JSONResponse({"ok": True, "jobId": job_id, "hostWorkloadPath": blob_path(workload)})
+
+def read_job_meta(job_id: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(ensure_sandbox(os.path.join(ROOT_DIR, job_id)), "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def update_job_meta(job_id: str, **fields):
+    meta = read_job_meta(job_id)
+    if meta is None:
+        return
+    meta.update(fields)
+    path = os.path.join(ensure_sandbox(os.path.join(ROOT_DIR, job_id)), "meta.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+# Garbage collection of ROOT_DIR: job directories older than JOB_RETENTION_DAYS are removed, then the
+# oldest ones until everything fits in WORK_QUOTA_BYTES. Pinned jobs, jobs with a pending upload and
+# queued/running jobs are kept. Objects no surviving job references are swept afterwards (with a
+# grace period so a job being prepared right now does not lose its workload).
+OBJECT_GRACE_SECS = 3600
+_gc_lock = threading.Lock()
+_gc_thread: List[threading.Thread] = []
+_gc_last = {}
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for base, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(base, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def gc_run() -> dict:
+    _load_sweeps_once()
+    with _sweep_lock:
+        # Unfinished sweeps keep the workloads/patches of entries that have no job yet
+        sweep_blobs = {x for sw in _sweeps.values() for e in sw["entries"] if e["status"] in ("pending", "running")
+                       for x in (e.get("workload"), e.get("patch")) if x}
+    with _gc_lock:
+        now = time.time()
+        with _bench_cond:
+            active = {j for j, st in _bench_jobs.items() if st["status"] in ("queued", "running")}
+        jobs = []
+        try:
+            entries = [de for de in os.scandir(ROOT_DIR) if de.is_dir() and de.name.startswith("job-")]
+        except FileNotFoundError:
+            entries = []
+        for de in entries:
+            meta = read_job_meta(de.name) or {}
+            keep = de.name in active or meta.get("pinned") or meta.get("pending_upload")
+            created = meta.get("created") or de.stat().st_mtime
+            jobs.append({"id": de.name, "path": de.path, "created": created, "keep": bool(keep),
+                         "bytes": _dir_bytes(de.path), "meta": meta})
+        removed = []
+        def drop(job):
+            try:
+                shutil.rmtree(job["path"])
+                removed.append(job["id"])
+                return True
+            except OSError:
+                return False
+        cutoff = now - JOB_RETENTION_DAYS * 86400
+        survivors = []
+        for job in sorted(jobs, key=lambda j: j["created"]):
+            if not job["keep"] and job["created"] < cutoff and drop(job):
+                continue
+            survivors.append(job)
+        objects_bytes = _dir_bytes(OBJECTS_DIR)
+        total = objects_bytes + sum(j["bytes"] for j in survivors)
+        for job in list(survivors):
+            if total <= WORK_QUOTA_BYTES:
+                break
+            if not job["keep"] and drop(job):
+                survivors.remove(job)
+                total -= job["bytes"]
+        # Sweep unreferenced objects
+        live = set()
+        for job in survivors:
+            m = job["meta"]
+            live.update(x for x in (m.get("workload"), m.get("patch")) if x)
+            live.update(p.get("sha") for p in m.get("patches") or [] if p.get("sha"))
+        live.update(sweep_blobs)
+        swept = 0
+        for base, _, files in os.walk(OBJECTS_DIR):
+            for name in files:
+                path = os.path.join(base, name)
+                try:
+                    if name not in live and now - os.stat(path).st_mtime > OBJECT_GRACE_SECS:
+                        size = os.stat(path).st_size
+                        os.remove(path)
+                        swept += 1
+                        total -= size
+                except OSError:
+                    pass
+        report = {"ts": int(now), "jobs": len(survivors), "removed": removed, "objectsSwept": swept,
+                  "bytes": total, "quota": WORK_QUOTA_BYTES, "retentionDays": JOB_RETENTION_DAYS}
+        _gc_last.clear()
+        _gc_last.update(report)
+        return report
+
+def _gc_loop():
+    while True:
+        try:
+            gc_run()
+        except Exception:
+            pass
+        time.sleep(GC_INTERVAL)
+
+def ensure_gc_thread():
+    with _gc_lock:
+        if not _gc_thread and GC_INTERVAL > 0:
+            t = threading.Thread(target=_gc_loop, name="work-gc", daemon=True)
+            _gc_thread.append(t)
+            t.start()
+
+@app.post("/api/gc")
+def gc_endpoint(request: Request):
+    check_origin(request)
+    return JSONResponse({"ok": True, **gc_run()})
+
+class PinReq(BaseModel):
+    pinned: Optional[bool] = True
+
+@app.post("/api/bench/jobs/{job_id}/pin")
+def bench_job_pin(job_id: str, req: PinReq, request: Request):
+    check_origin(request)
+    if read_job_meta(job_id) is None:
+        raise HTTPException(404, "unknown jobId")
+    update_job_meta(job_id, pinned=bool(req.pinned))
+    return JSONResponse({"ok": True, "jobId": job_id, "pinned": bool(req.pinned)})
+
+class BenchRunReq(BaseModel):
+    jobId: str
+    warm: Optional[bool] = None  # run in a pooled container via docker exec (default: SWEF_POOL)
+    mode: Optional[str] = None  # "single", "interleaved", "adaptive" or "tournament" (default with patches)
+    rounds: Optional[int] = None  # interleaved mode: number of BEFORE/AFTER round pairs (default 5)
+    target: Optional[float] = None  # adaptive mode: stop once the CI half-width / mean is below this (default 0.02)
+    budget: Optional[int] = None  # adaptive mode: seconds per phase (default 300)
+    maxBatches: Optional[int] = None  # adaptive mode: batches per phase (default 30)
+    force: Optional[bool] = False  # ignore a cached result for the same image/workload/patch/config
+    cancelOnDisconnect: Optional[bool] = False  # cancel once no client has polled/streamed the job for a while
+    profile: Optional[bool] = False  # extra untimed rounds under a profiler, returning a BEFORE/AFTER function diff
+    profiler: Optional[str] = None  # "cprofile" (default) or "sampling" (py-spy when the image has it)
+    normalize: Optional[bool] = False  # also report timings rescaled by a calibration loop timed in the same container
+
+# Log parser for PERF_START/END and Mean/Std extraction.
+# The container prints an outer segment per phase (PERF_START:BEFORE ... PERF_END:BEFORE); /perf.sh wraps the
+# workload itself in lone PERF_START: / PERF_END: lines, usually surrounded by `bash -x` trace lines ("+ ...").
+# Workloads may also print machine-readable samples as `PERF_SAMPLE <json>`, where <json> is a number, a list
+# of numbers or an object with "value"/"values" (and optionally "phase").
+MEAN_RE = re.compile(r"Mean\s*:\s*([0-9.+-Ee]+)")
+STD_RE = re.compile(r"(?:Std\s*Dev|Std)\s*:\s*([0-9.+-Ee]+)")
+SAMPLE_PREFIX = "PERF_SAMPLE"
+PHASE_START_RE = re.compile(r"PERF_START:(\w+)$")
+
+def _first_float(rx, line: str) -> Optional[float]:
+    m = rx.search(line)
+    if not m:
+        return None
+    try:
+        v = float(m.group(1))
+    except ValueError:
+        return None
+    return v if math.isfinite(v) else None
+
+def _sample_values(payload: str):
+    """Return (phase, [floats]) from the JSON payload of a PERF_SAMPLE line, or (None, []) if unreadable."""
+    try:
+        v = json.loads(payload)
+    except ValueError:
+        return None, []
+    phase = None
+    if isinstance(v, dict):
+        phase = v.get("phase")
+        v = v.get("values", v.get("value"))
+    vals = v if isinstance(v, list) else [v]
+    out = []
+    for x in vals:
+        if not isinstance(x, (int, float)) or isinstance(x, bool):
+            continue
+        try:
+            x = float(x)
+        except OverflowError:
+            continue
+        # json.loads accepts NaN/Infinity and 1e400 overflows to inf; none of them is a timing
+        if math.isfinite(x):
+            out.append(x)
+    return phase, out
+
+class PerfLogParser:
+    """Incremental single-pass parser: feed() output chunks in order, result() whenever a summary is needed.
+
+    Memory is bounded: partial lines are capped at MAX_LINE bytes, core/error text keeps the last
+    MAX_TEXT_LINES lines of each phase and at most MAX_SAMPLES samples are kept per phase.
+    """
+    MAX_LINE = 64 * 1024
+    MAX_TEXT_LINES = 2000
+    MAX_SAMPLES = 100000
+
+    def __init__(self, tags=("BEFORE", "AFTER")):
+        self.tags = list(tags)
+        self.pos = 0
+        self._line_start = 0
+        self.phases = {}
+        self._cur = None
+        self._partial = b""
+        self._overflow = False
+
+    def feed(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            if nl < 0:
+                rest = chunk[start:]
+                if not self._overflow:
+                    room = self.MAX_LINE - len(self._partial)
+                    self._partial += rest[:room]
+                    self._overflow = len(rest) > room
+                self.pos += len(rest)
+                return
+            piece = chunk[start:nl + 1]
+            self.pos += len(piece)
+            if not self._overflow:
+                self._partial += piece[:self.MAX_LINE - len(self._partial)]
+            self._line(self._partial.rstrip(b"\r\n").decode("utf-8", "ignore"))
+            self._line_start = self.pos
+            self._partial = b""
+            self._overflow = False
+            start = nl + 1
+
+    def close(self) -> dict:
+        if self._partial:
+            self._line(self._partial.rstrip(b"\r\n").decode("utf-8", "ignore"))
+            self._partial = b""
+        return self.result()
+
+    def _new_phase(self, tag: str) -> dict:
+        n = self.MAX_TEXT_LINES
+        ph = {"tag": tag, "start": self._line_start, "end": None, "state": "outer", "skip_python": False,
+              "seg": deque(maxlen=n), "seg_err": deque(maxlen=n), "core": deque(maxlen=n), "core_err": deque(maxlen=n),
+              "seg_mean": None, "seg_std": None, "core_mean": None, "core_std": None, "samples": []}
+        self.phases[tag] = ph
+        if tag not in self.tags:
+            self.tags.append(tag)
+        return ph
+
+    def _add_samples(self, ph: dict, vals):
+        room = self.MAX_SAMPLES - len(ph["samples"])
+        if room > 0:
+            ph["samples"].extend(vals[:room])
+
+    def _line(self, line: str):
+        stripped = line.strip()
+        ph = self._cur
+        if stripped.startswith(SAMPLE_PREFIX):
+            phase, vals = _sample_values(stripped[len(SAMPLE_PREFIX):].strip())
+            target = self.phases.get(phase) if phase else ph
+            if target is not None and vals:
+                self._add_samples(target, vals)
+                return
+        # Markers normally sit on their own line, but output without a trailing newline runs into them
+        # ("progress 100%PERF_END:BEFORE"); shell trace lines ("+ echo PERF_END:BEFORE") are not markers
+        trace = stripped.startswith("+")
+        if ph is None:
+            m = None if trace else PHASE_START_RE.search(stripped)
+            if m and m.group(1) not in self.phases:
+                self._cur = self._new_phase(m.group(1))
+            return
+        if not trace:
+            for marker, state, new_state in ((f"PERF_END:{ph['tag']}", None, None), ("PERF_START:", "outer", "inner"),
+                                             ("PERF_END:", "inner", "post")):
+                if stripped.endswith(marker) and (state is None or ph["state"] == state):
+                    head = stripped[:-len(marker)]
+                    if head:
+                        self._line(head)
+                    if new_state is None:
+                        ph["end"] = self.pos
+                        self._cur = None
+                    else:
+                        ph["state"] = new_state
+                        ph["skip_python"] = new_state == "inner"
+                    return
+        if ph["skip_python"]:
+            ph["skip_python"] = False
+            if re.match(r"\+\s+python\s", stripped):
+                ph["seg"].append(line)
+                return
+        mean = _first_float(MEAN_RE, line) if "Mean" in line else None
+        std = _first_float(STD_RE, line) if "Std" in line else None
+        err = None
+        if stripped and stripped[0] != "+":
+            err = line.rstrip()
+            if mean is not None or std is not None:
+                err = STD_RE.sub("", MEAN_RE.sub("", err)).rstrip()
+                err = err if err.strip() else None
+        ph["seg"].append(line)
+        if err:
+            ph["seg_err"].append(err)
+        if mean is not None and ph["seg_mean"] is None:
+            ph["seg_mean"] = mean
+        if std is not None and ph["seg_std"] is None:
+            ph["seg_std"] = std
+        if ph["state"] == "inner":
+            ph["core"].append(line)
+            if err:
+                ph["core_err"].append(err)
+            if mean is not None and ph["core_mean"] is None:
+                ph["core_mean"] = mean
+            if std is not None and ph["core_std"] is None:
+                ph["core_std"] = std
+
+    def phase_result(self, tag: str) -> dict:
+        ph = self.phases.get(tag)
+        if ph is None:
+            return {"core": "", "mean": None, "std": None, "error": None, "samples": [], "log": None}
+        # Prefer the inner (workload) block; fall back to the whole outer segment when /perf.sh printed no markers
+        key = "core" if ph["state"] != "outer" else "seg"
+        mean, std = ph[f"{key}_mean"], ph[f"{key}_std"]
+        samples = ph["samples"]
+        if mean is None and samples:
+            mean = statistics.fmean(samples)
+            std = statistics.stdev(samples) if len(samples) > 1 else 0.0
+        err = "\n".join(ph[f"{key}_err"]).strip()
+        end = ph["end"] if ph["end"] is not None else self.pos
+        return {"core": "\n".join(ph[key]).strip(), "mean": mean, "std": std, "error": (err if err else None), "samples": list(samples),
+                "log": {"offset": ph["start"], "length": end - ph["start"]}}
+
+    def result(self) -> dict:
+        return {tag.lower(): self.phase_result(tag) for tag in self.tags}
+
+# Parse BEFORE/AFTER two segments of output
+def parse_perf_two(txt: str):
+    t0 = time.perf_counter()
+    parser = PerfLogParser()
+    parser.feed(txt)
+    result = parser.close()
+    metric_observe("swef_parse_perf_seconds", time.perf_counter() - t0)
+    return result
+
+# Job logs: output.log is written plainly while the container runs (so /stream can tail it), then
+# compressed into output.log.gz as independent gzip members of LOG_BLOCK uncompressed bytes each.
+# output.log.idx.json records each member's compressed offset, so a ranged read only inflates the
+# blocks it touches. The concatenated members are still a normal gzip file for `gunzip`.
+LOG_BLOCK = 256 * 1024
+LOG_RANGE_MAX = 4 * 1024 * 1024
+
+def compress_job_log(job_dir: str) -> Optional[dict]:
+    plain = os.path.join(job_dir, "output.log")
+    if not os.path.exists(plain):
+        return None
+    gz_path = os.path.join(job_dir, "output.log.gz")
+    members = []
+    size = 0
+    with open(plain, "rb") as src, open(gz_path + ".tmp", "wb") as dst:
+        while True:
+            block = src.read(LOG_BLOCK)
+            if not block:
+                break
+            members.append(dst.tell())
+            comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+            dst.write(comp.compress(block) + comp.flush())
+            size += len(block)
+        compressed = dst.tell()
+    idx = {"block": LOG_BLOCK, "size": size, "compressed": compressed, "members": members}
+    with open(os.path.join(job_dir, "output.log.idx.json"), "w", encoding="utf-8") as f:
+        json.dump(idx, f)
+    os.replace(gz_path + ".tmp", gz_path)
+    os.remove(plain)
+    return idx
+
+def read_job_log(job_dir: str, offset: int, length: int):
+    """Return (bytes, total_size) for [offset, offset+length) of a job log, plain or compressed."""
+    plain = os.path.join(job_dir, "output.log")
+    if os.path.exists(plain):
+        try:
+            with open(plain, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                f.seek(offset)
+                return f.read(max(0, length)), size
+        except FileNotFoundError:
+            pass  # compressed in the meantime
+    idx_path = os.path.join(job_dir, "output.log.idx.json")
+    if not os.path.exists(idx_path):
+        raise FileNotFoundError("no log for this job")
+    with open(idx_path, "r", encoding="utf-8") as f:
+        idx = json.load(f)
+    size, block, members = idx["size"], idx["block"], idx["members"]
+    end = min(size, offset + max(0, length))
+    if offset >= end:
+        return b"", size
+    out = []
+    with open(os.path.join(job_dir, "output.log.gz"), "rb") as f:
+        for i in range(offset // block, (end - 1) // block + 1):
+            f.seek(members[i])
+            clen = (members[i + 1] if i + 1 < len(members) else idx["compressed"]) - members[i]
+            data = zlib.decompress(f.read(clen), 31)
+            lo = max(offset - i * block, 0)
+            hi = min(end - i * block, len(data))
+            out.append(data[lo:hi])
+    return b"".join(out), size
+
+# Shell run inside the container: BEFORE, git apply, AFTER
+BENCH_SCRIPT = (
+    "set +e; "
+    "if [ -f /perf.sh ]; then chmod +x /perf.sh; fi; "
+    "echo PERF_START:BEFORE; /perf.sh || true; echo PERF_END:BEFORE; "
+    "if [ ! -f /tmp/patch.diff ]; then echo 'ERROR: docker内部不完全，没有/tmp/patch.diff'; exit 2; fi; "
+    "cd /testbed 2>/dev/null || true; git apply /tmp/patch.diff || true; cd - >/dev/null 2>&1 || true; "
+    "echo PERF_START:AFTER; /perf.sh || true; echo PERF_END:AFTER"
+)
+
+# Statistics: speedup with confidence intervals from per-iteration (or per-round) samples.
+# Pure standard library so the helper keeps its small dependency set. Past BOOTSTRAP_MAX_SAMPLES per
+# side the bootstrap resamples means of consecutive blocks instead of single samples, so its cost is
+# bounded however many samples a phase reports (up to PerfLogParser.MAX_SAMPLES).
+STATS_CONFIDENCE = 0.95
+BOOTSTRAP_MAX_SAMPLES = 1000
+
+def trim_outliers(xs: List[float], k: float = 1.5):
+    """Drop values outside Tukey's fences [Q1 - k*IQR, Q3 + k*IQR]; returns (kept, removed_count)."""
+    if len(xs) < 4:
+        return list(xs), 0
+    q1, _, q3 = statistics.quantiles(xs, n=4)
+    lo, hi = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+    kept = [x for x in xs if lo <= x <= hi]
+    return kept, len(xs) - len(kept)
+
+def _betacf(a: float, b: float, x: float) -> float:
+    # Continued fraction for the regularized incomplete beta function (Lentz's method)
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        d = 1.0 / (d if abs(d) > tiny else tiny)
+        c = 1.0 + aa / c
+        c = c if abs(c) > tiny else tiny
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 1e-12:
+            break
+    return h
+
+def _betainc(a: float, b: float, x: float) -> float:
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x)
+    if x < (a + 1.0) / (a + b + 2.0):
+        return math.exp(lbeta) * _betacf(a, b, x) / a
+    return 1.0 - math.exp(lbeta) * _betacf(b, a, 1.0 - x) / b
+
+def welch_test(xs: List[float], ys: List[float]) -> Optional[dict]:
+    nx, ny = len(xs), len(ys)
+    if nx < 2 or ny < 2:
+        return None
+    vx, vy = statistics.variance(xs) / nx, statistics.variance(ys) / ny
+    diff = statistics.fmean(xs) - statistics.fmean(ys)
+    if vx + vy == 0:
+        # No spread at all: t is unbounded; report it as None since JSON has no infinity
+        return {"t": None if diff else 0.0, "df": nx + ny - 2, "p": 0.0 if diff else 1.0}
+    t = diff / math.sqrt(vx + vy)
+    df = (vx + vy) ** 2 / (vx ** 2 / (nx - 1) + vy ** 2 / (ny - 1))
+    p = _betainc(df / 2.0, 0.5, df / (df + t * t))
+    return {"t": t, "df": df, "p": min(1.0, p)}
+
+def mann_whitney(xs: List[float], ys: List[float]) -> Optional[dict]:
+    """Two-sided Mann-Whitney U test, normal approximation with tie correction."""
+    nx, ny = len(xs), len(ys)
+    if nx < 1 or ny < 1:
+        return None
+    pooled = sorted([(v, 0) for v in xs] + [(v, 1) for v in ys])
+    rank_x = 0.0
+    ties = 0.0
+    i, n = 0, nx + ny
+    while i < n:
+        j = i
+        while j + 1 < n and pooled[j + 1][0] == pooled[i][0]:
+            j += 1
+        avg = (i + j) / 2.0 + 1.0
+        cnt = j - i + 1
+        ties += cnt ** 3 - cnt
+        rank_x += avg * sum(1 for k in range(i, j + 1) if pooled[k][1] == 0)
+        i = j + 1
+    u = rank_x - nx * (nx + 1) / 2.0
+    mu = nx * ny / 2.0
+    sigma2 = nx * ny / 12.0 * ((n + 1) - ties / (n * (n - 1))) if n > 1 else 0.0
+    if sigma2 <= 0:
+        return {"u": u, "p": 1.0}
+    z = (abs(u - mu) - 0.5) / math.sqrt(sigma2)
+    return {"u": u, "z": z, "p": min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))}
+
+def block_means(xs: List[float], blocks: int) -> List[float]:
+    """Means of `blocks` consecutive runs of xs whose lengths differ by at most one."""
+    n = len(xs)
+    return [math.fsum(xs[i * n // blocks:(i + 1) * n // blocks]) / ((i + 1) * n // blocks - i * n // blocks) for i in range(blocks)]
+
+def bootstrap_ci(xs: List[float], ys: List[float], confidence: float = STATS_CONFIDENCE, seed: int = 0) -> Optional[dict]:
+    """Percentile bootstrap CI of mean(xs)/mean(ys) (speedup) and the matching improvement in %."""
+    if len(xs) < 2 or len(ys) < 2:
+        return None
+    blocked = len(xs) > BOOTSTRAP_MAX_SAMPLES or len(ys) > BOOTSTRAP_MAX_SAMPLES
+    if len(xs) > BOOTSTRAP_MAX_SAMPLES:
+        xs = block_means(xs, BOOTSTRAP_MAX_SAMPLES)
+    if len(ys) > BOOTSTRAP_MAX_SAMPLES:
+        ys = block_means(ys, BOOTSTRAP_MAX_SAMPLES)
+    nx, ny = len(xs), len(ys)
+    rounds = max(200, min(2000, 400000 // (nx + ny)))
+    rng = random.Random(seed)
+    ratios = []
+    for _ in range(rounds):
+        my = math.fsum(rng.choices(ys, k=ny)) / ny
+        if my > 0:
+            ratios.append((math.fsum(rng.choices(xs, k=nx)) / nx) / my)
+    if len(ratios) < rounds // 2:
+        return None
+    ratios.sort()
+    alpha = (1.0 - confidence) / 2.0
+    lo = ratios[int(alpha * (len(ratios) - 1))]
+    hi = ratios[int(math.ceil((1.0 - alpha) * (len(ratios) - 1)))]
+    return {"level": confidence, "resamples": len(ratios), "blocked": blocked, "speedup": [lo, hi],
+            "improvement": [(1.0 - 1.0 / lo) * 100 if lo > 0 else None, (1.0 - 1.0 / hi) * 100 if hi > 0 else None]}
+
+def speedup_stats(before: dict, after: dict, confidence: float = STATS_CONFIDENCE) -> dict:
+    """Server-side speedup for two phase results: trimmed samples, bootstrap CI and significance tests."""
+    xs, ys = [float(v) for v in (before.get("samples") or [])], [float(v) for v in (after.get("samples") or [])]
+    base = speedup_of(before, after)
+    out = {"n_before": len(xs), "n_after": len(ys), "speedup": base["speedup"], "improvement": base["improvement"],
+           "ci": None, "welch": None, "mannwhitney": None, "significant": None}
+    if len(xs) < 2 or len(ys) < 2:
+        out["note"] = "not enough samples for confidence intervals; speedup from phase means"
+        return out
+    xs, tx = trim_outliers(xs)
+    ys, ty = trim_outliers(ys)
+    out["trimmed"] = {"before": tx, "after": ty}
+    mx, my = statistics.fmean(xs), statistics.fmean(ys)
+    if mx > 0 and my > 0:
+        out["speedup"], out["improvement"] = mx / my, (mx - my) / mx * 100
+    out["ci"] = bootstrap_ci(xs, ys, confidence)
+    out["welch"] = welch_test(xs, ys)
+    out["mannwhitney"] = mann_whitney(xs, ys)
+    p = (out["welch"] or {}).get("p")
+    out["significant"] = (p < 1.0 - confidence) if p is not None else None
+    return out
+
+def improvement_lower_bound(stats: Optional[dict]) -> Optional[float]:
+    ci = (stats or {}).get("ci") or {}
+    lo = (ci.get("improvement") or [None])[0]
+    return lo if lo is not None else (stats or {}).get("improvement")
+
+# Tournament: measure BEFORE once, then each candidate patch from a clean tree in its own PATCH_<i> phase.
+# A patch that does not apply is reported as that phase's error instead of timing the baseline again.
+TREE_RESET = "(cd /testbed 2>/dev/null && git checkout -q -- . && git clean -fdq)"
+
+def tournament_script(patches: List[dict]) -> str:
+    parts = [
+        "set +e; ",
+        "if [ -f /perf.sh ]; then chmod +x /perf.sh; fi; ",
+        "echo PERF_START:BEFORE; /perf.sh || true; echo PERF_END:BEFORE; ",
+    ]
+    for p in patches:
+        src = f"/tmp/swef_patches/{p['tag']}.diff"
+        parts.append(
+            f"{TREE_RESET}; echo PERF_START:{p['tag']}; "
+            f"if (cd /testbed && git apply {src}); then /perf.sh || true; "
+            f"else echo 'ERROR: git apply failed for {p['tag']}'; fi; echo PERF_END:{p['tag']}; "
+        )
+    parts.append(f"{TREE_RESET}")
+    return "".join(parts)
+
+def speedup_of(before: dict, after: dict) -> dict:
+    b, a = before.get("mean"), after.get("mean")
+    if not (isinstance(b, (int, float)) and isinstance(a, (int, float))) or a <= 0 or b <= 0:
+        return {"speedup": None, "improvement": None}
+    return {"speedup": b / a, "improvement": (b - a) / b * 100}
+
+def rank_patches(before: dict, phases: List[dict]) -> List[dict]:
+    """Rank patch phases by speedup over the shared baseline; failed or unmeasured patches go last."""
+    table = []
+    for ph in phases:
+        st = speedup_stats(before, ph)
+        table.append(dict(ph, speedup=st["speedup"], improvement=st["improvement"], stats=st))
+    table.sort(key=lambda r: (r["speedup"] is None, -(r["speedup"] or 0)))
+    for i, r in enumerate(table, start=1):
+        r["rank"] = i
+    return table
+
+# Interleaved A/B: alternate BEFORE_R<i>/AFTER_R<i> phases so drift (thermal throttling, turbo, noisy
+# neighbours) lands on both sides. Even rounds run AFTER first (ABBA order) to also cancel linear drift.
+# Every phase starts from a clean tree; AFTER phases re-apply /tmp/patch.diff.
+def interleaved_script(rounds: int) -> str:
+    before = "{reset}; echo PERF_START:BEFORE_R{r}; /perf.sh || true; echo PERF_END:BEFORE_R{r}; "
+    after = (
+        "{reset}; echo PERF_START:AFTER_R{r}; "
+        "if (cd /testbed && git apply /tmp/patch.diff); then /perf.sh || true; "
+        "else echo 'ERROR: git apply failed'; fi; echo PERF_END:AFTER_R{r}; "
+    )
+    parts = [
+        "set +e; ",
+        "if [ -f /perf.sh ]; then chmod +x /perf.sh; fi; ",
+        "if [ ! -f /tmp/patch.diff ]; then echo 'ERROR: docker内部不完全，没有/tmp/patch.diff'; exit 2; fi; ",
+    ]
+    for r in range(1, rounds + 1):
+        order = (before, after) if r % 2 else (after, before)
+        parts.extend(step.format(reset=TREE_RESET, r=r) for step in order)
+    parts.append(TREE_RESET)
+    return "".join(parts)
+
+def aggregate_rounds(parsed: dict, prefix: str, rounds: int, suffix: str = "r", label: str = "round", key: str = "rounds") -> dict:
+    """Fold the per-round phases (<prefix>_<suffix><i>) of one side into one phase summary with per-round samples."""
+    per_round = []
+    samples = []
+    errors = []
+    for r in range(1, rounds + 1):
+        ph = parsed.get(f"{prefix}_{suffix}{r}") or {}
+        per_round.append({label: r, "mean": ph.get("mean"), "std": ph.get("std"), "error": ph.get("error"),
+                          "samples": ph.get("samples") or [], "log": ph.get("log")})
+        samples.extend(ph.get("samples") or [])
+        if ph.get("error"):
+            errors.append(f"[{label} {r}] {ph['error']}")
+    means = [r["mean"] for r in per_round if r["mean"] is not None]
+    return {
+        "mean": statistics.fmean(means) if means else None,
+        "std": statistics.stdev(means) if len(means) > 1 else (0.0 if means else None),
+        "error": "\n".join(errors) or None,
+        "samples": samples or means,
+        key: per_round,
+    }
+
+# Adaptive sampling: the helper re-runs /perf.sh in batches (BEFORE_B<i>, then AFTER_B<i>) inside one
+# long-lived container and stops a phase once the relative half-width of the mean's confidence interval
+# drops below the target, the phase's time budget is spent or the batch limit is reached.
+ADAPTIVE_TARGET = 0.02
+ADAPTIVE_BUDGET = 300
+ADAPTIVE_MIN_BATCHES = 3
+ADAPTIVE_MAX_BATCHES = 30
+
+@functools.lru_cache(maxsize=4096)
+def t_quantile(p: float, df: float) -> float:
+    """Quantile of Student's t distribution for p in (0.5, 1), by bisection on its CDF."""
+    lo, hi = 0.0, 1e3
+    for _ in range(80):
+        mid = (lo + hi) / 2.0
+        cdf = 1.0 - 0.5 * _betainc(df / 2.0, 0.5, df / (df + mid * mid))
+        lo, hi = (mid, hi) if cdf < p else (lo, mid)
+    return (lo + hi) / 2.0
+
+def relative_ci_halfwidth(xs: List[float], confidence: float = STATS_CONFIDENCE) -> Optional[float]:
+    if len(xs) < 2:
+        return None
+    m = statistics.fmean(xs)
+    if m <= 0:
+        return None
+    half = t_quantile(1.0 - (1.0 - confidence) / 2.0, len(xs) - 1) * statistics.stdev(xs) / math.sqrt(len(xs))
+    return half / m
+
+def adaptive_phase(side: str, run_step, parser: "PerfLogParser", options: dict) -> dict:
+    target = float(options.get("target") or ADAPTIVE_TARGET)
+    budget = float(options.get("budget") or ADAPTIVE_BUDGET)
+    max_batches = max(ADAPTIVE_MIN_BATCHES, min(int(options.get("maxBatches") or ADAPTIVE_MAX_BATCHES), 500))
+    t0 = time.time()
+    samples = []
+    batches, rel, reason = 0, None, None
+    while True:
+        batches += 1
+        tag = f"{side}_B{batches}"
+        remaining = budget - (time.time() - t0)
+        run_step(f"echo PERF_START:{tag}; /perf.sh || true; echo PERF_END:{tag}", int(max(remaining, 0) + 120))
+        ph = parser.phase_result(tag)
+        batch = ph["samples"] or ([ph["mean"]] if ph["mean"] is not None else [])
+        if not batch:
+            reason = "no_samples"
+            break
+        samples.extend(batch)
+        rel = relative_ci_halfwidth(samples)
+        if batches >= ADAPTIVE_MIN_BATCHES and rel is not None and rel <= target:
+            reason = "precision"
+        elif time.time() - t0 >= budget:
+            reason = "time_budget"
+        elif batches >= max_batches:
+            reason = "max_batches"
+        if reason:
+            break
+    return {"batches": batches, "samples": len(samples), "stop": reason, "relCi": rel, "target": target,
+            "budget": budget, "elapsed": round(time.time() - t0, 3)}
+
+# Profiling (opt-in, profile=true on /api/bench/run): after the timed phases the workload runs once more per
+# side under a profiler, so profiler overhead never reaches the timed samples. The job's profile/ directory is
+# mounted writable at /swef_prof; a sitecustomize shim on PYTHONPATH profiles every Python process /perf.sh
+# starts with cProfile and dumps <label>.<pid>.pstats there. profiler="sampling" uses py-spy instead when the
+# image has it (<label>.pyspy, collapsed stacks; no call counts). Output of the profiled runs is discarded.
+PROFILE_TOP = 40
+PYSPY_RATE = 100
+PROFILE_SHIM = """import os
+if os.environ.get("SWEF_PROFILE_OUT"):
+    import atexit, cProfile
+    _swef_profile = cProfile.Profile()
+    def _swef_dump(out=os.environ.pop("SWEF_PROFILE_OUT")):
+        _swef_profile.disable()
+        _swef_profile.dump_stats("%s.%d.pstats" % (out, os.getpid()))
+    atexit.register(_swef_dump)
+    _swef_profile.enable()
+"""
+PROFILE_RUN = (
+    "swef_profile() {{ echo SWEF_PROFILE:$1; "
+    "if [ {profiler} = sampling ] && command -v py-spy >/dev/null 2>&1; then "
+    "py-spy record --subprocesses --format raw --rate {rate} -o /swef_prof/$1.pyspy -- /perf.sh >/dev/null 2>&1 || true; fi; "
+    "if [ ! -s /swef_prof/$1.pyspy ]; then "
+    "SWEF_PROFILE_OUT=/swef_prof/$1 PYTHONPATH=/swef_prof/shim${{PYTHONPATH:+:$PYTHONPATH}} /perf.sh >/dev/null 2>&1 || true; fi; }}; "
+)
+PYSPY_FRAME_RE = re.compile(r"^(.*) \((.*):(\d+)\)$")
+
+def profile_script(patches: List[tuple], profiler: str) -> str:
+    """Profiling rounds: the baseline, then every (label, patch path) on a clean tree."""
+    parts = ["set +e; ", PROFILE_RUN.format(profiler=shlex.quote(profiler), rate=PYSPY_RATE), f"{TREE_RESET}; swef_profile before; "]
+    for label, src in patches:
+        parts.append(f"{TREE_RESET}; if (cd /testbed && git apply {src}); then swef_profile {label}; fi; ")
+    parts.append(TREE_RESET)
+    return "".join(parts)
+
+def prepare_profile_dir(job_dir: str) -> str:
+    prof_dir = os.path.join(job_dir, "profile")
+    shutil.rmtree(prof_dir, ignore_errors=True)
+    os.makedirs(os.path.join(prof_dir, "shim"))
+    with open(os.path.join(prof_dir, "shim", "sitecustomize.py"), "w", encoding="utf-8") as f:
+        f.write(PROFILE_SHIM)
+    os.chmod(prof_dir, 0o777)  # the container may write as a different user
+    return prof_dir
+
+def _profile_key(path: str, func: str) -> str:
+    # Line numbers move when a patch edits the file, so functions are matched by file and name
+    if path.startswith("/testbed/"):
+        path = path[len("/testbed/"):]
+    return f"{path}:{func}"
+
+def load_profile(prof_dir: str, label: str) -> Optional[dict]:
+    """Per-function {self, cum, calls} in seconds for one profiled run, from cProfile dumps or py-spy stacks."""
+    funcs = {}
+    pyspy = os.path.join(prof_dir, f"{label}.pyspy")
+    if os.path.exists(pyspy) and os.path.getsize(pyspy):
+        total = 0
+        with open(pyspy, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                stack, _, n = line.rstrip("\n").rpartition(" ")
+                if not n.isdigit():
+                    continue
+                count = int(n)
+                total += count
+                seen = set()
+                frames = [m for m in (PYSPY_FRAME_RE.match(fr) for fr in stack.split(";")) if m]
+                for i, m in enumerate(frames):
+                    key = _profile_key(m.group(2), m.group(1))
+                    fn = funcs.setdefault(key, {"self": 0.0, "cum": 0.0, "calls": None})
+                    if key not in seen:
+                        seen.add(key)
+                        fn["cum"] += count / PYSPY_RATE
+                    if i == len(frames) - 1:
+                        fn["self"] += count / PYSPY_RATE
+        return {"profiler": "py-spy", "total": total / PYSPY_RATE, "functions": funcs}
+    dumps = sorted(glob.glob(os.path.join(prof_dir, f"{label}.*.pstats")))
+    if not dumps:
+        return None
+    try:
+        stats = pstats.Stats(dumps[0])
+        for extra in dumps[1:]:
+            stats.add(extra)
+    except Exception:
+        return None
+    for (path, _line, func), (_cc, calls, tt, ct, _callers) in stats.stats.items():
+        fn = funcs.setdefault(_profile_key(path, func), {"self": 0.0, "cum": 0.0, "calls": 0})
+        fn["self"] += tt
+        fn["cum"] += ct
+        fn["calls"] += calls
+    return {"profiler": "cProfile", "total": stats.total_tt, "processes": len(dumps), "functions": funcs}
+
+def profile_diff(before: Optional[dict], after: Optional[dict], top: int = PROFILE_TOP) -> Optional[dict]:
+    """Function-level BEFORE/AFTER delta, largest self-time changes first."""
+    if not before or not after:
+        return None
+    rows = []
+    def missing(prof):
+        return {"self": 0.0, "cum": 0.0, "calls": 0 if prof["profiler"] == "cProfile" else None}
+    for key in set(before["functions"]) | set(after["functions"]):
+        b = before["functions"].get(key) or missing(before)
+        a = after["functions"].get(key) or missing(after)
+        rows.append({"function": key, "selfBefore": b["self"], "selfAfter": a["self"], "selfDelta": a["self"] - b["self"],
+                     "cumBefore": b["cum"], "cumAfter": a["cum"], "cumDelta": a["cum"] - b["cum"],
+                     "callsBefore": b["calls"], "callsAfter": a["calls"]})
+    rows.sort(key=lambda r: (-abs(r["selfDelta"]), -abs(r["cumDelta"])))
+    return {"totalBefore": before["total"], "totalAfter": after["total"], "functions": len(rows), "top": rows[:top]}
+
+def profile_hotspots(prof: Optional[dict], top: int = 15) -> List[dict]:
+    if not prof:
+        return []
+    rows = sorted(prof["functions"].items(), key=lambda kv: -kv[1]["self"])[:top]
+    return [dict(v, function=k) for k, v in rows]
+
+def profile_result(prof_dir: str, labels: List[tuple]) -> dict:
+    """labels: (label, name) of each profiled patch; the baseline is always "before"."""
+    before = load_profile(prof_dir, "before")
+    out = {"profiler": (before or {}).get("profiler"), "before": {"hotspots": profile_hotspots(before)}}
+    if before is None:
+        out["error"] = "no profile data (is /perf.sh running Python?)"
+    diffs = []
+    for label, name in labels:
+        after = load_profile(prof_dir, label)
+        diffs.append({"name": name, "hotspots": profile_hotspots(after), "diff": profile_diff(before, after)})
+    if len(labels) == 1 and labels[0][0] == "after":
+        out["after"] = {"hotspots": diffs[0]["hotspots"]}
+        out["diff"] = diffs[0]["diff"]
+    else:
+        out["patches"] = diffs
+    return out
+
+def container_limits(slot: Optional[int]) -> dict:
+    """Container limits pinning a worker slot to its cpuset and applying the configured cpu/memory limits."""
+    limits = {}
+    if slot is not None and slot < len(BENCH_CPUSETS):
+        limits["cpuset"] = BENCH_CPUSETS[slot]
+    if BENCH_CPUS:
+        limits["cpus"] = BENCH_CPUS
+    if BENCH_MEMORY:
+        limits["memory"] = BENCH_MEMORY
+    return limits
+
+# Warm container pool (opt-in): long-lived containers per image, driven through `docker exec`.
+# ROOT_DIR is mounted read-only at /swef so a job copies its workload/patch in, and after every job
+# /testbed is reset to its committed state and /tmp/patch.diff restored to what the image shipped.
+# At most POOL_MAX_PER_IMAGE containers exist per image; idle ones are removed after POOL_IDLE_SECS.
+POOL_SNAPSHOT = (
+    "if [ -f /tmp/patch.diff ]; then cp -p /tmp/patch.diff /tmp/.swef_patch.orig; fi; "
+    "if [ -f /tmp/workload.py ]; then cp -p /tmp/workload.py /tmp/.swef_workload.orig; fi"
+)
+POOL_RESET = (
+    f"{TREE_RESET}; "
+    "rm -rf /tmp/patch.diff /tmp/workload.py /tmp/swef_patches; "
+    "if [ -f /tmp/.swef_patch.orig ]; then cp -p /tmp/.swef_patch.orig /tmp/patch.diff; fi; "
+    "if [ -f /tmp/.swef_workload.orig ]; then cp -p /tmp/.swef_workload.orig /tmp/workload.py; fi"
+)
+_pool_lock = threading.Lock()
+_pool = {}
+_pool_reaper: List[threading.Thread] = []
+
+def _pool_remove(name: str):
+    try:
+        docker_backend().remove(name)
+    except Exception:
+        pass
+
+def _pool_start(image: str) -> Optional[dict]:
+    name = f"swef-pool-{secrets.token_hex(6)}"
+    root = pathlib.Path(ROOT_DIR).resolve()
+    backend = docker_backend()
+    try:
+        backend.run(image, ["tail", "-f", "/dev/null"], [(str(root), "/swef", True)], name=name,
+                    labels={"swef.pool": "1"}, detach=True, remove=False)
+        if backend.exec(name, ["/bin/bash", "-lc", POOL_SNAPSHOT], timeout=120) != 0:
+            raise DockerError("pool snapshot failed")
+    except Exception:
+        _pool_remove(name)
+        return None
+    now = time.time()
+    return {"name": name, "image": image, "created": now, "last_used": now, "busy": False, "jobs": 0}
+
+def _pool_reap():
+    while True:
+        time.sleep(30)
+        now = time.time()
+        expired = []
+        with _pool_lock:
+            for image, entries in _pool.items():
+                for e in list(entries):
+                    if not e["busy"] and now - e["last_used"] > POOL_IDLE_SECS:
+                        entries.remove(e)
+                        expired.append(e["name"])
+        for name in expired:
+            _pool_remove(name)
+
+def pool_acquire(image: str) -> Optional[dict]:
+    """Reserve an idle pooled container for image, starting one if the pool has room; None if it is full."""
+    with _pool_lock:
+        if not _pool_reaper:
+            t = threading.Thread(target=_pool_reap, name="pool-reaper", daemon=True)
+            _pool_reaper.append(t)
+            t.start()
+        entries = _pool.setdefault(image, [])
+        for e in entries:
+            if not e["busy"]:
+                e["busy"] = True
+                return e
+        if len(entries) >= POOL_MAX_PER_IMAGE:
+            return None
+        placeholder = {"name": None, "image": image, "busy": True, "last_used": time.time()}
+        entries.append(placeholder)
+    entry = _pool_start(image)
+    with _pool_lock:
+        entries.remove(placeholder)
+        if entry is not None:
+            entry["busy"] = True
+            entries.append(entry)
+    return entry
+
+def pool_release(entry: dict):
+    """Reset the container's tree and return it to the pool; containers that fail to reset are dropped."""
+    try:
+        healthy = docker_backend().exec(entry["name"], ["/bin/bash", "-lc", POOL_RESET], timeout=300) == 0
+    except Exception:
+        healthy = False
+    with _pool_lock:
+        entry["busy"] = False
+        entry["last_used"] = time.time()
+        entry["jobs"] += 1
+        if not healthy:
+            entries = _pool.get(entry["image"], [])
+            if entry in entries:
+                entries.remove(entry)
+    if not healthy:
+        _pool_remove(entry["name"])
+
+def pool_drain():
+    with _pool_lock:
+        names = [e["name"] for entries in _pool.values() for e in entries if e["name"] and not e["busy"]]
+        for entries in _pool.values():
+            entries[:] = [e for e in entries if e["busy"]]
+    for name in names:
+        _pool_remove(name)
+    return names
+
+atexit.register(pool_drain)
+
+def pool_info() -> dict:
+    with _pool_lock:
+        return {
+            "default": POOL_DEFAULT,
+            "maxPerImage": POOL_MAX_PER_IMAGE,
+            "idleSecs": POOL_IDLE_SECS,
+            "images": {img: [{k: e.get(k) for k in ("name", "busy", "created", "last_used", "jobs")} for e in entries]
+                       for img, entries in _pool.items() if entries},
+        }
+
+# Result cache: finished results keyed by (image digest, workload sha256, patch sha256s, measurement config).
+# Entries are <key>.json files under cache/results; a hit refreshes the file's mtime, and the least
+# recently used entries are evicted once RESULT_CACHE_MAX entries or RESULT_CACHE_BYTES are exceeded.
+_cache_lock = threading.Lock()
+_cache_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+def _sha256_file(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def result_cache_key(job_dir: str, meta: dict, digest: Optional[str], mode: str, options: dict) -> Optional[str]:
+    if not digest:
+        return None
+    key = {
+        "digest": digest,
+        "workload": meta.get("workload") or _sha256_file(os.path.join(job_dir, "workload.py")),
+        "patch": meta.get("patch") or _sha256_file(os.path.join(job_dir, "patch.diff")),
+        "patches": [[p["name"], p.get("sha") or _sha256_file(os.path.join(job_dir, p["file"]))] for p in meta.get("patches") or []],
+        "config": {"mode": mode, "rounds": options.get("rounds"), "target": options.get("target"),
+                   "budget": options.get("budget"), "maxBatches": options.get("maxBatches"),
+                   "profile": options.get("profiler") or "cprofile" if options.get("profile") else None,
+                   "normalize": bool(options.get("normalize")),
+                   "pinned": bool(BENCH_CPUSETS), "cpus": BENCH_CPUS, "memory": BENCH_MEMORY},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+def result_cacheable(result: dict, exit_code) -> bool:
+    """Whether a run measured everything it set out to. A phase's "error" text is just its non-trace
+    output, so failures are a missing mean, a patch that did not apply or a non-zero exit status
+    (timeouts raise before a result exists)."""
+    if exit_code not in (0, None):
+        return False
+    phases = [result["before"], result["after"]] + list(result.get("patches") or [])
+    for ph in phases:
+        if ph.get("mean") is None or (ph.get("adaptive") or {}).get("stop") == "patch_failed":
+            return False
+        if "ERROR: git apply failed" in (ph.get("error") or ""):
+            return False
+    return True
+
+def result_cache_get(key: str) -> Optional[dict]:
+    path = os.path.join(RESULT_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            res = json.load(f)
+        os.utime(path)
+    except Exception:
+        with _cache_lock:
+            _cache_counters["misses"] += 1
+        return None
+    with _cache_lock:
+        _cache_counters["hits"] += 1
+    return res
+
+def result_cache_put(key: str, result: dict):
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    path = os.path.join(RESULT_CACHE_DIR, f"{key}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+    with _cache_lock:
+        _cache_counters["stores"] += 1
+        entries = []
+        for de in os.scandir(RESULT_CACHE_DIR):
+            if de.name.endswith(".json"):
+                st = de.stat()
+                entries.append((st.st_mtime, st.st_size, de.path))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        while entries and (len(entries) > RESULT_CACHE_MAX or total > RESULT_CACHE_BYTES):
+            _, size, victim = entries.pop(0)
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+            total -= size
+            _cache_counters["evictions"] += 1
+
+def result_cache_info() -> dict:
+    with _cache_lock:
+        return dict(_cache_counters)
+
+_job_containers = {}  # jobId -> name of the container running it
+_job_streams = {}  # jobId -> stop() for the local docker run/exec client or Engine stream attached to it
+
+class BenchCancelled(Exception):
+    pass
+
+def execute_bench_job(job_id: str, options: Optional[dict] = None, slot: Optional[int] = None) -> dict:
+    options = options or {}
+    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, job_id))
+    meta_path = os.path.join(job_dir, "meta.json")
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    image = meta.get("image")
+    files = job_files(job_dir, meta)
+    if files["workload"] is None:
+        raise ValueError("workload missing for this job")
+
+    # Pull image if it is missing or stale (try our best)
+    image_info = ensure_image(image)
+    image_info.pop("output", None)
+
+    patches = meta.get("patches") or []
+    mode = options.get("mode") or ("tournament" if patches else "single")
+    if mode == "tournament":
+        if not patches:
+            raise ValueError("tournament mode needs patches in /api/bench/prepare")
+        script = tournament_script(patches)
+    elif mode == "interleaved":
+        rounds = max(1, min(int(options.get("rounds") or 5), 50))
+        script = interleaved_script(rounds)
+    elif mode == "adaptive":
+        script = None  # driven batch by batch below
+    else:
+        script = BENCH_SCRIPT
+
+    cache_key = result_cache_key(job_dir, meta, image_info.get("digest"), mode, options)
+    if cache_key and not options.get("force"):
+        cached = result_cache_get(cache_key)
+        if cached is not None:
+            cached["cache"] = dict(result_cache_info(), hit=True, key=cache_key)
+            return cached
+
+    profile_labels = None
+    if options.get("profile"):
+        if mode == "tournament":
+            profile_labels = [(p["tag"].lower(), p["name"], f"/tmp/swef_patches/{p['tag']}.diff") for p in patches]
+        else:
+            profile_labels = [("after", "after", "/tmp/patch.diff")]
+        profiling = profile_script([(label, src) for label, _, src in profile_labels], options.get("profiler") or "cprofile")
+        if script is not None:
+            script = f"{script}; {profiling}"
+    normalize = bool(options.get("normalize"))
+    if normalize and script is not None:
+        script = f"{CALIBRATION_STEP}; {script}"
+
+    backend = docker_backend()
+    limits = container_limits(slot)
+    warm = options.get("warm")
+    # Profiles are written back through a writable job-dir mount, which pooled containers do not have
+    use_pool = (POOL_DEFAULT if warm is None else warm) and not profile_labels
+    container = pool_acquire(image) if use_pool else None
+    if container is not None:
+        # Pooled container: copy this job's files in from the read-only /swef mount
+        root = pathlib.Path(ROOT_DIR).resolve()
+        def in_pool(path: str) -> str:
+            return shlex.quote("/swef/" + pathlib.Path(path).resolve().relative_to(root).as_posix())
+        prefix = f"cp {in_pool(files['workload'])} /tmp/workload.py; "
+        if files["patch"]:
+            prefix += f"cp {in_pool(files['patch'])} /tmp/patch.diff; "
+        if mode == "tournament":
+            prefix += "mkdir -p /tmp/swef_patches; " + "".join(
+                f"cp {in_pool(path)} /tmp/swef_patches/{p['tag']}.diff; " for p, path in files["patches"] if path)
+        if limits:
+            # Pooled containers are shared between slots: re-pin to this slot's cpuset
+            backend.update(container["name"], limits)
+        name = container["name"]
+    else:
+        mounts = [(files["workload"], "/tmp/workload.py", True)]
+        if files["patch"]:
+            mounts.append((files["patch"], "/tmp/patch.diff", True))
+        if mode == "tournament":
+            mounts.extend((path, f"/tmp/swef_patches/{p['tag']}.diff", True) for p, path in files["patches"] if path)
+        if profile_labels:
+            mounts.append((prepare_profile_dir(job_dir), "/swef_prof", False))
+        name = f"swef-{job_id}"
+    cancel = _bench_cancel.setdefault(job_id, threading.Event())
+    _job_containers[job_id] = name
+    if cancel.is_set():
+        _job_containers.pop(job_id, None)
+        if container is not None:
+            pool_release(container)
+        raise BenchCancelled()
+
+    # Container output goes straight to <job>/output.log, which /stream tails while the job runs
+    log_path = os.path.join(job_dir, "output.log")
+    parser = PerfLogParser()
+    adaptive = {}
+    started = [time.monotonic(), None]  # container start, first output line
+    calibration = []
+    load_start = host_load()
+    phase_t0 = {}
+    warm_label = "warm" if container is not None else "cold"
+    exit_code = 0
+    def on_start(stop):
+        _job_streams[job_id] = stop
+        if cancel.is_set():
+            stop()
+    try:
+        with open(log_path, "wb") as logf:
+            def on_line(line: bytes):
+                logf.write(line)
+                logf.flush()
+                parser.feed(line)
+                now = time.monotonic()
+                if started[1] is None:
+                    started[1] = now
+                    metric_observe("swef_container_start_seconds", now - started[0], container=warm_label)
+                if line.startswith(b"SWEF_CALIBRATION"):
+                    m = CALIBRATION_RE.match(line)
+                    if m:
+                        calibration.append(float(m.group(1)))
+                if line.startswith(b"PERF_"):
+                    m = PHASE_MARK_RE.match(line.decode("utf-8", "replace").strip())
+                    if m and m.group(1) == "START":
+                        phase_t0[m.group(2)] = now
+                    elif m and m.group(2) in phase_t0:
+                        side = m.group(2).split("_")[0]
+                        metric_observe("swef_bench_phase_seconds", now - phase_t0.pop(m.group(2)),
+                                       phase=side.lower() if side in ("BEFORE", "AFTER") else "patch", mode=mode)
+            if mode != "adaptive":
+                if container is not None:
+                    exit_code = backend.exec(name, ["/bin/bash", "-lc", prefix + script], on_line, timeout=1800, on_start=on_start)
+                else:
+                    exit_code = backend.run(image, ["/bin/bash", "-lc", script], mounts, limits, name=name, labels={"swef.job": job_id},
+                                            on_line=on_line, timeout=1800, on_start=on_start)
+            else:
+                if container is None:
+                    # Keep one container alive for all batches and drive it with exec
+                    backend.run(image, ["tail", "-f", "/dev/null"], mounts, limits, name=name, labels={"swef.job": job_id}, detach=True)
+                    started[1] = time.monotonic()
+                    metric_observe("swef_container_start_seconds", started[1] - started[0], container=warm_label)
+                else:
+                    backend.exec(name, ["/bin/bash", "-lc", prefix], timeout=120)  # copies the job files into the pooled container
+                def run_step(step: str, timeout: int) -> int:
+                    if cancel.is_set():
+                        raise BenchCancelled()
+                    return backend.exec(name, ["/bin/bash", "-lc", "set +e; " + step], on_line, timeout=timeout, on_start=on_start)
+                try:
+                    run_step("if [ -f /perf.sh ]; then chmod +x /perf.sh; fi", 60)
+                    if normalize:
+                        run_step(CALIBRATION_STEP, 120)
+                    adaptive["before"] = adaptive_phase("BEFORE", run_step, parser, options)
+                    applied = run_step(
+                        "if [ ! -f /tmp/patch.diff ]; then echo 'ERROR: docker内部不完全，没有/tmp/patch.diff'; exit 2; fi; "
+                        "cd /testbed && git apply /tmp/patch.diff", 300)
+                    if applied == 0:
+                        adaptive["after"] = adaptive_phase("AFTER", run_step, parser, options)
+                    if profile_labels:
+                        run_step(profiling, 1800)
+                finally:
+                    if container is None:
+                        backend.remove(name)
+    except Exception:
+        # A killed container surfaces as whatever error its command produced
+        if not cancel.is_set():
+            raise
+    finally:
+        _job_containers.pop(job_id, None)
+        _job_streams.pop(job_id, None)
+        if container is not None:
+            pool_release(container)
+    parsed = parser.close()
+    idx = compress_job_log(job_dir) or {"size": 0, "compressed": 0}
+    if cancel.is_set():
+        raise BenchCancelled()
+    # The raw log is only kept on disk; each phase carries its offset/length into it
+    log_info = {"size": idx["size"], "compressed": idx["compressed"], "url": f"/api/bench/jobs/{job_id}/log"}
+    result = {"ok": True, "mode": mode, "before": parsed["before"], "after": parsed["after"], "log": log_info, "image": image_info,
+              "container": {"warm": container is not None, "name": container["name"] if container else None}}
+    result["limits"] = limits
+    result["backend"] = backend.name
+    if mode == "interleaved":
+        result["rounds"] = rounds
+        result["before"] = aggregate_rounds(parsed, "before", rounds)
+        result["after"] = aggregate_rounds(parsed, "after", rounds)
+    if mode == "adaptive":
+        for side in ("before", "after"):
+            info = adaptive.get(side)
+            if info is None:
+                result[side] = {"mean": None, "std": None, "error": "git apply failed; AFTER not measured", "samples": [],
+                                "adaptive": {"batches": 0, "samples": 0, "stop": "patch_failed"}}
+            else:
+                result[side] = dict(aggregate_rounds(parsed, side, info["batches"], "b", "batch", "batches"), adaptive=info)
+    if profile_labels:
+        result["profile"] = profile_result(os.path.join(job_dir, "profile"), [(label, name) for label, name, _ in profile_labels])
+    if mode == "tournament":
+        # A container that died part-way never printed the later PERF_START markers
+        missing = {"mean": None, "std": None, "samples": [], "error": "phase not reached"}
+        phases = [dict(parsed.get(p["tag"].lower()) or missing, name=p["name"]) for p in patches]
+        result["patches"] = rank_patches(parsed["before"], phases)
+        # Keep before/after for the bench page: "after" is the best-ranked patch
+        result["after"] = result["patches"][0]
+        result["best"] = result["patches"][0]["name"]
+        result["stats"] = result["patches"][0]["stats"]
+    else:
+        result["stats"] = speedup_stats(result["before"], result["after"])
+    result["environment"] = {"host": host_fingerprint(), "limits": limits, "backend": backend.name,
+                             "load": {"start": load_start, "end": host_load()}}
+    if normalize:
+        if calibration:
+            result["normalized"] = normalized_timings(result, calibration[0], "container")
+        else:
+            result["normalized"] = normalized_timings(result, host_calibration(), "host")
+    # Only cache complete measurements; a failed run is worth repeating
+    if cache_key and result_cacheable(result, exit_code):
+        result_cache_put(cache_key, dict(result, cachedFrom=job_id, cachedAt=int(time.time())))
+    result["cache"] = dict(result_cache_info(), hit=False, key=cache_key)
+    return result
+
+# Bench job queue: /api/bench/run only enqueues, a bounded pool of worker threads runs the containers.
+# Job states: queued -> running -> done | error. The latest state is mirrored to <job>/state.json.
+_bench_cond = threading.Condition()
+_bench_pending = deque()
+_bench_jobs = {}
+_bench_finished = deque()
+_bench_workers: List[threading.Thread] = []
+_bench_cancel = {}  # jobId -> Event set when the job is cancelled
+_bench_seen = {}  # jobId -> last time a client polled or streamed it (for cancelOnDisconnect)
+
+def save_job_state(job_id: str, st: dict):
+    try:
+        job_dir = ensure_sandbox(os.path.join(ROOT_DIR, job_id))
+        tmp = os.path.join(job_dir, "state.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(st, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(job_dir, "state.json"))
+    except Exception:
+        pass
+
+def load_job_state(job_id: str) -> Optional[dict]:
+    with _bench_cond:
+        st = _bench_jobs.get(job_id)
+        if st is not None:
+            st = dict(st)
+            if st["status"] == "queued":
+                st["position"] = list(_bench_pending).index(job_id) + 1 if job_id in _bench_pending else None
+            return st
+    path = os.path.join(ensure_sandbox(os.path.join(ROOT_DIR, job_id)), "state.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            st = json.load(f)
+    except Exception:
+        return None
+    if st.get("status") in ("queued", "running"):
+        # The helper restarted while this job was in flight; it will never finish.
+        st["status"] = "error"
+        st["error"] = "helper restarted before the job finished"
+    return st
+
+def bench_queue_info() -> dict:
+    with _bench_cond:
+        running = [j for j, st in _bench_jobs.items() if st["status"] == "running"]
+        return {"workers": BENCH_WORKERS, "cpusets": BENCH_CPUSETS, "depth": len(_bench_pending), "running": running, "queued": list(_bench_pending)}
+
+def _bench_worker(slot: int):
+    while True:
+        with _bench_cond:
+            while not _bench_pending:
+                _bench_cond.wait()
+            job_id = _bench_pending.popleft()
+            st = _bench_jobs[job_id]
+            st.update({"status": "running", "started": int(time.time()), "slot": slot})
+            snapshot = dict(st)
+        save_job_state(job_id, snapshot)
+        try:
+            result = execute_bench_job(job_id, st.get("options"), slot)
+            update = {"status": "done", "result": result}
+        except BenchCancelled:
+            reason = st.get("cancelling") or "cancelled"
+            update = {"status": "cancelled", "error": reason, "result": {"ok": False, "error": reason}}
+        except Exception as e:
+            update = {"status": "error", "error": str(e), "result": {"ok": False, "error": str(e)}}
+        metric_inc("swef_bench_jobs_total", status=update["status"])
+        with _bench_cond:
+            st.update(update)
+            st["finished"] = int(time.time())
+            snapshot = dict(st)
+            # Finished jobs stay readable from state.json; only keep recent ones in memory
+            _bench_finished.append(job_id)
+            _bench_cancel.pop(job_id, None)
+            while len(_bench_finished) > 500:
+                _bench_jobs.pop(_bench_finished.popleft(), None)
+        save_job_state(job_id, snapshot)
+
+def _remove_orphan_containers():
+    """Containers labelled swef.job belong to runs of a previous helper process; none of them can finish."""
+    backend = docker_backend()
+    try:
+        for name in backend.containers("swef.job"):
+            backend.remove(name)
+    except Exception:
+        pass
+
+def ensure_bench_workers():
+    with _bench_cond:
+        if not _bench_workers:
+            threading.Thread(target=_remove_orphan_containers, name="bench-orphans", daemon=True).start()
+            threading.Thread(target=_bench_watchdog, name="bench-watchdog", daemon=True).start()
+        while len(_bench_workers) < BENCH_WORKERS:
+            t = threading.Thread(target=_bench_worker, args=(len(_bench_workers),), name=f"bench-worker-{len(_bench_workers)}", daemon=True)
+            _bench_workers.append(t)
+            t.start()
+
+@app.on_event("startup")
+def start_background():
+    """Background machinery starts with the server; /api/health only reports on it."""
+    ensure_bench_workers()
+    ensure_gc_thread()
+    ensure_outbox_thread()
+    ensure_sweep_thread()
+    ensure_host_fingerprint()
+
+def enqueue_bench_job(job_id: str, options: Optional[dict] = None) -> dict:
+    ensure_bench_workers()
+    with _bench_cond:
+        st = _bench_jobs.get(job_id)
+        if st is not None and st["status"] in ("queued", "running"):
+            return dict(st)
+        if len(_bench_pending) >= BENCH_QUEUE_MAX:
+            raise HTTPException(429, "bench queue is full")
+        st = {"jobId": job_id, "status": "queued", "queued": int(time.time()), "options": options or {}}
+        _bench_jobs[job_id] = st
+        _bench_cancel[job_id] = threading.Event()
+        _bench_seen[job_id] = time.time()
+        _bench_pending.append(job_id)
+        snapshot = dict(st)
+        _bench_cond.notify()
+    save_job_state(job_id, snapshot)
+    return snapshot
+
+def cancel_bench_job(job_id: str, reason: str = "cancelled") -> Optional[dict]:
+    """Cancel a queued job outright, or kill the container of a running one; None for unknown jobs."""
+    with _bench_cond:
+        st = _bench_jobs.get(job_id)
+        if st is None:
+            return None
+        if st["status"] == "queued":
+            try:
+                _bench_pending.remove(job_id)
+            except ValueError:
+                pass
+            st.update({"status": "cancelled", "error": reason, "finished": int(time.time())})
+            _bench_finished.append(job_id)
+            _bench_cancel.pop(job_id, None)
+            snapshot = dict(st)
+            save_job_state(job_id, snapshot)
+            return snapshot
+        if st["status"] != "running":
+            return dict(st)
+        st["cancelling"] = reason
+        _bench_cancel.setdefault(job_id, threading.Event()).set()
+        snapshot = dict(st)
+    _stop_job_stream(job_id)
+    threading.Thread(target=_kill_job_container, args=(job_id,), name=f"cancel-{job_id}", daemon=True).start()
+    return snapshot
+
+def _stop_job_stream(job_id: str):
+    """Stop the helper's end of a job's docker run/exec, so the worker returns without waiting for the client to exit."""
+    stop = _job_streams.get(job_id)
+    if stop is not None:
+        try:
+            stop()
+        except Exception:
+            pass
+
+def _kill_job_container(job_id: str, attempts: int = 30):
+    # The container may not exist yet (image still pulling); keep trying while the job is running
+    backend = docker_backend()
+    for _ in range(attempts):
+        name = _job_containers.get(job_id)
+        if name:
+            try:
+                backend.kill(name)
+            except Exception:
+                pass
+        _stop_job_stream(job_id)
+        with _bench_cond:
+            if (_bench_jobs.get(job_id) or {}).get("status") != "running":
+                return
+        time.sleep(1)
+
+def _bench_watchdog():
+    """Cancel cancelOnDisconnect jobs nobody has polled or streamed for BENCH_ORPHAN_SECS."""
+    while True:
+        time.sleep(5)
+        now = time.time()
+        with _bench_cond:
+            orphans = [j for j, st in _bench_jobs.items()
+                       if st["status"] in ("queued", "running") and (st.get("options") or {}).get("cancelOnDisconnect")
+                       and not st.get("cancelling") and now - _bench_seen.get(j, now) > BENCH_ORPHAN_SECS]
+        for job_id in orphans:
+            cancel_bench_job(job_id, "client disconnected")
+
+@app.post("/api/bench/run")
+def bench_run(req: BenchRunReq, request: Request):
     check_origin(request)
     os.makedirs(ROOT_DIR, exist_ok=True)
-    return {
-        "ok": True,
-        "root": ROOT_DIR,
-        "server": "swefficiency-helper",
-        "docker_sock": os.path.exists("/var/run/docker.sock"),
-        "allowed_origins": ALLOWED_ORIGINS,
-    }
+    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, req.jobId))
+    meta = read_job_meta(req.jobId)
+    if meta is None or job_files(job_dir, meta)["workload"] is None:
+        raise HTTPException(400, "invalid jobId")
+    if req.mode not in (None, "single", "interleaved", "adaptive", "tournament"):
+        raise HTTPException(400, f"unknown mode {req.mode}")
+    if req.profiler not in (None, "cprofile", "sampling"):
+        raise HTTPException(400, f"unknown profiler {req.profiler}")
+    enqueue_bench_job(req.jobId, {"warm": req.warm, "mode": req.mode, "rounds": req.rounds,
+                                  "target": req.target, "budget": req.budget, "maxBatches": req.maxBatches,
+                                  "force": bool(req.force), "cancelOnDisconnect": bool(req.cancelOnDisconnect),
+                                  "profile": bool(req.profile), "profiler": req.profiler, "normalize": bool(req.normalize)})
+    st = load_job_state(req.jobId) or {}
+    return JSONResponse({"ok": True, **st, "queueDepth": bench_queue_info()["depth"]}, status_code=202)
 
-@app.get("/api/docker/check")
-def docker_check(request: Request):
+@app.get("/api/bench/jobs/{job_id}")
+def bench_job(job_id: str, request: Request):
+    check_origin(request)
+    st = load_job_state(job_id)
+    if st is None:
+        raise HTTPException(404, "unknown jobId")
+    _bench_seen[job_id] = time.time()
+    return JSONResponse({"ok": True, **st})
+
+@app.post("/api/bench/jobs/{job_id}/cancel")
+def bench_job_cancel(job_id: str, request: Request):
     check_origin(request)
+    st = cancel_bench_job(job_id)
+    if st is None:
+        st = load_job_state(job_id)
+        if st is None:
+            raise HTTPException(404, "unknown jobId")
+    return JSONResponse({"ok": True, **st})
+
+PHASE_MARK_RE = re.compile(r"^PERF_(START|END):(\w+)$")
+
+def sse_event(event: str, data, event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    return f"{head}event: {event}\ndata: {payload}\n\n"
+
+def log_line_events(line: bytes, offset: int, parser: "PerfLogParser"):
+    """SSE events for one log line ending at byte offset: the line itself, plus a phase event on PERF marks."""
+    text = line.decode("utf-8", "ignore").rstrip("\r\n")
+    parser.feed(line)
+    yield sse_event("line", text, offset)
+    m = PHASE_MARK_RE.match(text.strip())
+    if m:
+        ev = {"phase": m.group(2), "mark": m.group(1).lower()}
+        if ev["mark"] == "end":
+            res = parser.phase_result(ev["phase"])
+            ev.update({"mean": res["mean"], "std": res["std"], "error": res["error"]})
+        yield sse_event("phase", ev, offset)
+
+def replay_job_log(job_id: str, offset: int, parser: "PerfLogParser"):
+    """Yield SSE events for a finished job's (compressed) log from offset on."""
+    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, job_id))
+    pos = offset
+    partial = b""
+    while True:
+        try:
+            data, _ = read_job_log(job_dir, pos, LOG_BLOCK)
+        except FileNotFoundError:
+            return
+        if not data:
+            break
+        pos += len(data)
+        lines = (partial + data).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            yield from log_line_events(line + b"\n", offset, parser)
+    if partial:
+        yield from log_line_events(partial, offset + len(partial), parser)
+
+def tail_job_log(job_id: str, offset: int = 0, poll: float = 0.25):
+    """Yield SSE events for a job: output lines as they are written, phase marks and a final status."""
+    log_path = os.path.join(ensure_sandbox(os.path.join(ROOT_DIR, job_id)), "output.log")
+    last_status = None
+    parser = PerfLogParser()
+    f = None
     try:
-        cp = run_cmd("docker version --format '{{json .}}'", timeout=20)
-        out = cp.stdout.decode("utf-8", "ignore")
-        available = (cp.returncode == 0)
-        return {"available": available, "output": out}
-    except Exception as e:
-        return {"available": False, "error": str(e)}
+        while True:
+            st = load_job_state(job_id) or {}
+            status = st.get("status")
+            _bench_seen[job_id] = time.time()
+            if f is None and os.path.exists(log_path):
+                try:
+                    f = open(log_path, "rb")
+                    f.seek(offset)
+                except FileNotFoundError:
+                    f = None
+            if status != last_status:
+                last_status = status
+                yield sse_event("status", {"status": status, "position": st.get("position")})
+            if f is None:
+                if status not in ("queued", "running"):
+                    # Finished before we attached: replay the compressed log
+                    yield from replay_job_log(job_id, offset, parser)
+                    break
+                time.sleep(poll)
+                continue
+            line = f.readline()
+            if line.endswith(b"\n"):
+                offset += len(line)
+                yield from log_line_events(line, offset, parser)
+                continue
+            # Partial or no data: rewind to the line start and wait for the writer
+            f.seek(offset)
+            if status not in ("queued", "running"):
+                rest = f.read()
+                if rest:
+                    offset += len(rest)
+                    yield from log_line_events(rest, offset, parser)
+                break
+            time.sleep(poll)
+    finally:
+        if f is not None:
+            f.close()
+    st = load_job_state(job_id) or {}
+    yield sse_event("done", {"status": st.get("status"), "error": st.get("error")})
 
-class RunReq(BaseModel):
-    repo: str
-    commit: Optional[str] = None
-    test: Optional[str] = None
-    image: Optional[str] = "ubuntu:22.04"
-    subdir: Optional[str] = "job"
+@app.get("/api/bench/jobs/{job_id}/log")
+def bench_job_log(job_id: str, request: Request, offset: int = 0, length: int = 65536):
+    check_origin(request)
+    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, job_id))
+    length = min(max(0, length), LOG_RANGE_MAX)
+    try:
+        data, size = read_job_log(job_dir, max(0, offset), length)
+    except FileNotFoundError:
+        raise HTTPException(404, "no log for this job")
+    return PlainTextResponse(data.decode("utf-8", "replace"), headers={
+        "X-Log-Offset": str(max(0, offset)),
+        "X-Log-Length": str(len(data)),
+        "X-Log-Size": str(size),
+        "Access-Control-Expose-Headers": "X-Log-Offset, X-Log-Length, X-Log-Size",
+    })
 
-@app.post("/api/run")
-def run_pipeline(req: RunReq, request: Request):
+@app.get("/api/bench/jobs/{job_id}/stream")
+def bench_job_stream(job_id: str, request: Request, offset: int = 0):
     check_origin(request)
-    os.makedirs(ROOT_DIR, exist_ok=True)
-    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, req.subdir or "job"))
-    os.makedirs(job_dir, exist_ok=True)
+    if load_job_state(job_id) is None:
+        raise HTTPException(404, "unknown jobId")
+    # EventSource reconnects send the byte offset of the last delivered line as Last-Event-ID
+    last_id = request.headers.get("last-event-id")
+    if last_id and last_id.isdigit():
+        offset = int(last_id)
+    return StreamingResponse(
+        tail_job_log(job_id, max(0, offset)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    pull = run_cmd(f"docker pull {req.image}", timeout=180)
+class PoolWarmReq(BaseModel):
+    image: Optional[str] = None
+    instance: Optional[str] = None
+    count: Optional[int] = 1
 
-    cmd = (
-        f"docker run --rm --cpus=1 --memory=1g --pids-limit=256 "
-        f"--network=none --cap-drop=ALL --security-opt no-new-privileges "
-        f"-v {shlex.quote(job_dir)}:/work "
-        f"{req.image} /bin/bash -lc "
-        f"\"set -e; echo 'repo={req.repo}'; echo 'commit={req.commit or ''}'; "
-        f"echo 'test={req.test or ''}'; echo 'working in /work'; ls -la /work; \""
-    )
-    try:
-        runp = run_cmd(cmd, timeout=180)
-        combined = (pull.stdout + b'\n---\n' + runp.stdout).decode("utf-8","ignore")
-        return PlainTextResponse(combined, media_type="text/plain")
-    except Exception as e:
-        return PlainTextResponse(f"error: {e}", status_code=500)
+@app.get("/api/pool")
+def pool_status(request: Request):
+    check_origin(request)
+    return JSONResponse({"ok": True, **pool_info()})
 
-class SubmitReq(BaseModel):
-    email: Optional[str] = None
-    notes: Optional[str] = None
-    meta: Optional[dict] = None
+@app.post("/api/pool/warm")
+def pool_warm(req: PoolWarmReq, request: Request):
+    check_origin(request)
+    image = req.image or (image_for_instance(req.instance) if req.instance else None)
+    if not image:
+        raise HTTPException(400, "image or instance required")
+    def warm():
+        ensure_image(image)
+        started = [e for e in (pool_acquire(image) for _ in range(max(1, min(int(req.count or 1), POOL_MAX_PER_IMAGE)))) if e]
+        with _pool_lock:
+            for e in started:
+                e["busy"] = False
+                e["last_used"] = time.time()
+    threading.Thread(target=warm, name="pool-warm", daemon=True).start()
+    return JSONResponse({"ok": True, "image": image}, status_code=202)
 
-@app.post("/api/submit")
-def submit(req: SubmitReq, request: Request):
+@app.post("/api/pool/drain")
+def pool_drain_endpoint(request: Request):
     check_origin(request)
-    os.makedirs(ROOT_DIR, exist_ok=True)
-    rec = {"ts": int(time.time()), "email": req.email, "notes": req.notes, "meta": req.meta or {}}
-    with open(SUBMIT_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-    return ok()
+    return JSONResponse({"ok": True, "removed": pool_drain()})
 
-class BenchPrepareReq(BaseModel):
-    instance: str
-    image: str
-    code: str
+@app.get("/api/cache")
+def cache_status(request: Request):
+    check_origin(request)
+    try:
+        entries = [de.stat().st_size for de in os.scandir(RESULT_CACHE_DIR) if de.name.endswith(".json")]
+    except FileNotFoundError:
+        entries = []
+    return JSONResponse({"ok": True, **result_cache_info(), "entries": len(entries), "bytes": sum(entries),
+                         "maxEntries": RESULT_CACHE_MAX, "maxBytes": RESULT_CACHE_BYTES})
 
-class BenchPrepareResp(BaseModel):
-    ok: bool
-    jobId: str
-    hostWorkloadPath: str
+@app.get("/api/bench/queue")
+def bench_queue(request: Request):
+    check_origin(request)
+    return JSONResponse({"ok": True, **bench_queue_info()})
 
-@app.post("/api/bench/prepare")
-def bench_prepare(req: BenchPrepareReq, request: Request):
+@app.get("/metrics")
+def metrics(request: Request):
     check_origin(request)
-    os.makedirs(ROOT_DIR, exist_ok=True)
-    job_id = f"job-{int(time.time())}-{secrets.token_hex(4)}"
-    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, job_id))
-    os.makedirs(job_dir, exist_ok=True)
-    workload_path = os.path.join(job_dir, "workload.py")
-    with open(workload_path, "w", encoding="utf-8") as f:
-        f.write(req.code)
-    meta = {"instance": req.instance, "image": req.image, "created": int(time.time())}
-    with open(os.path.join(job_dir, "meta.json"), "w", encoding="utf-8") as f:
-        json.dump(meta, f)
-    return JSONResponse({"ok": True, "jobId": job_id, "hostWorkloadPath": workload_path})
+    queue = bench_queue_info()
+    with _batch_lock:
+        outbox = len(_batch_load())
+    with _pool_lock:
+        pooled = sum(len(entries) for entries in _pool.values())
+    gauges = {
+        "swef_bench_queue_depth": ("Benchmark jobs waiting for a worker", len(queue["queued"])),
+        "swef_bench_running": ("Benchmark jobs running now", len(queue["running"])),
+        "swef_bench_workers": ("Benchmark worker slots", queue["workers"]),
+        "swef_pool_containers": ("Warm pooled containers", pooled),
+        "swef_upload_outbox_pending": ("Submissions waiting in the upload outbox", outbox),
+    }
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
 
-class BenchRunReq(BaseModel):
-    jobId: str
+@app.get("/api/bench/jobs/{job_id}/stats")
+def bench_job_stats(job_id: str, request: Request):
+    check_origin(request)
+    name = _job_containers.get(job_id)
+    if not name:
+        raise HTTPException(404, "job is not running")
+    backend = docker_backend()
+    try:
+        return JSONResponse({"ok": True, "container": name, "backend": backend.name, "stats": backend.stats(name)})
+    except Exception as e:
+        raise HTTPException(502, f"stats unavailable: {e}")
 
-# Simple log parser for PERF_START/END and Mean/Std extraction
-MEAN_RE = re.compile(r"Mean\s*:\s*([0-9.+-Ee]+)")
-STD_RE = re.compile(r"(?:Std\s*Dev|Std)\s*:\s*([0-9.+-Ee]+)")
+# Sweeps: POST /api/sweeps runs a whole manifest of (instance, image, workload, patch) entries.
+# Entries are handed out one at a time to whichever worker has a free slot: the local bench queue
+# (BENCH_WORKERS slots) and remote helpers registered as workers, driven through their own
+# /api/bench/* endpoints with the capacity their /api/bench/queue reports. Every change is written to
+# sweeps/<sweepId>.json, and unfinished sweeps are picked up again after a restart: pending entries
+# are dispatched, local jobs lost with the old process are re-queued, remote jobs are polled again.
+SWEEPS_DIR = os.path.join(ROOT_DIR, "sweeps")
+SWEEP_WORKERS_FILE = os.path.join(SWEEPS_DIR, "workers.json")
+SWEEP_WORKERS = env_list("SWEF_SWEEP_WORKERS", [])
+SWEEP_POLL = 2.0
+SWEEP_MAX_ATTEMPTS = 3
+SWEEP_REMOTE_FAILURES = 5  # consecutive failed polls before a remote entry is handed to another worker
+SWEEP_WORKER_RETRY = 60
+SWEEP_OPTION_KEYS = ("warm", "mode", "rounds", "target", "budget", "maxBatches", "force", "profile", "profiler", "normalize")
+_sweep_lock = threading.RLock()
+_sweep_wake = threading.Event()
+_sweeps = {}  # sweepId -> sweep state (mirrors sweeps/<sweepId>.json)
+_sweep_workers = {}  # url -> {"url", "capacity", "down_until", "error"}
+_sweep_thread: List[threading.Thread] = []
+_sweeps_read = False
+_sweeps_loaded: List[str] = []  # sweepIds read from disk, until _resume_sweeps has handled them
 
-# Parse BEFORE/AFTER two segments of output
-def parse_perf_two(txt: str):
-    def extract(tag: str):
-        start_tag = f"PERF_START:{tag}"
-        end_tag = f"PERF_END:{tag}"
+sweep_session = requests.Session()
+sweep_session.verify = os.environ.get("SWEF_SWEEP_CA") or True
+
+def _save_sweep(sw: dict):
+    os.makedirs(SWEEPS_DIR, exist_ok=True)
+    path = os.path.join(SWEEPS_DIR, f"{sw['sweepId']}.json")
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(sw, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def _save_sweep_workers():
+    os.makedirs(SWEEPS_DIR, exist_ok=True)
+    tmp = SWEEP_WORKERS_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({url: {"capacity": w.get("configured")} for url, w in _sweep_workers.items() if not w.get("env")}, f)
+    os.replace(tmp, SWEEP_WORKERS_FILE)
+
+def _load_sweeps_once():
+    """Read persisted sweeps and registered workers into memory, once per process; no jobs are touched."""
+    global _sweeps_read
+    with _sweep_lock:
+        if _sweeps_read:
+            return
+        _sweeps_read = True
         try:
-            s = txt.index(start_tag)
-            e = txt.index(end_tag, s)
-            seg = txt[s:e]
-        except ValueError:
-            return {"core": "", "mean": None, "std": None, "error": None}
-        # Prefer inner markers (from workload), anchored by shell trace + echo and Python run
-        inner_core = None
-        # Pattern 1: '+ echo PERF_START:' then '+ python ...' then a lone 'PERF_START:' line
-        m1 = re.search(r"(?ms)^\+\s+echo\s+PERF_START:\s*\n^PERF_START:\s*\n^\+\s+python\s+.*\n", seg)
-        # Pattern 2: fallback to a lone 'PERF_START:' line
-        m2 = re.search(r"(?m)^PERF_START:\s*$", seg)
-        start_idx = None
-        if m1:
-            start_idx = m1.end()
-        elif m2:
-            start_idx = m2.end()
-        # Pattern end: a lone 'PERF_END:' line, ideally before '+ echo PERF_END:'
-        m3 = re.search(r"(?ms)^PERF_END:\s*\n^\+\s+echo\s+PERF_END:\s*", seg)
-        m4 = re.search(r"(?m)^PERF_END:\s*$", seg)
-        end_idx = None
-        if m3:
-            end_idx = m3.start()
-        elif m4:
-            end_idx = m4.start()
-        if start_idx is not None and end_idx is not None and end_idx > start_idx:
-            inner_core = seg[start_idx:end_idx]
-        else:
-            # Last resort: simple inner between first PERF_START: and next PERF_END:
+            with open(SWEEP_WORKERS_FILE, "r", encoding="utf-8") as f:
+                for url, w in json.load(f).items():
+                    _sweep_workers[url] = {"url": url, "configured": w.get("capacity"), "capacity": w.get("capacity")}
+        except (OSError, ValueError):
+            pass
+        for url in SWEEP_WORKERS:
+            _sweep_workers.setdefault(url.rstrip("/"), {"url": url.rstrip("/"), "configured": None, "capacity": None, "env": True})
+        try:
+            names = [n for n in os.listdir(SWEEPS_DIR) if n.startswith("sweep-") and n.endswith(".json")]
+        except FileNotFoundError:
+            names = []
+        for name in names:
             try:
-                i_s = seg.index("PERF_START:")
-                i_e = seg.index("PERF_END:", i_s)
-                inner_core = seg[i_s + len("PERF_START:"): i_e]
-            except ValueError:
-                inner_core = None
-        core = (inner_core if inner_core is not None else seg).strip()
-        m = MEAN_RE.search(core)
-        mean = float(m.group(1)) if m else None
-        sdev = STD_RE.search(core)
-        std = float(sdev.group(1)) if sdev else None
-        # error = core content minus Mean/Std lines
-        err = re.sub(MEAN_RE, "", core)
-        err = re.sub(STD_RE, "", err)
-        # remove empty lines and shell trace lines
-        err_lines = [ln for ln in (err.splitlines()) if ln.strip() and not ln.lstrip().startswith('+')]
-        err = "\n".join(err_lines).strip()
-        return {"core": core, "mean": mean, "std": std, "error": (err if err else None)}
-    return {"before": extract("BEFORE"), "after": extract("AFTER")}
+                with open(os.path.join(SWEEPS_DIR, name), "r", encoding="utf-8") as f:
+                    sw = json.load(f)
+            except (OSError, ValueError):
+                continue
+            _sweeps[sw["sweepId"]] = sw
+            _sweeps_loaded.append(sw["sweepId"])
 
-@app.post("/api/bench/run")
-def bench_run(req: BenchRunReq, request: Request):
-    check_origin(request)
-    os.makedirs(ROOT_DIR, exist_ok=True)
-    job_dir = ensure_sandbox(os.path.join(ROOT_DIR, req.jobId))
-    meta_path = os.path.join(job_dir, "meta.json")
-    workload_path = os.path.join(job_dir, "workload.py")
-    patch_path = os.path.join(job_dir, "patch.diff")
-    if not (os.path.exists(meta_path) and os.path.exists(workload_path)):
-        raise HTTPException(400, "invalid jobId")
-    with open(meta_path, "r", encoding="utf-8") as f:
-        meta = json.load(f)
-    image = meta.get("image")
+def _resume_sweeps():
+    """Re-queue the local jobs that sweeps read from disk had in flight when the previous process stopped."""
+    while _sweeps_loaded:
+        sw = _sweeps.get(_sweeps_loaded.pop())
+        if sw is None or sw["status"] != "running":
+            continue
+        for e in sw["entries"]:
+            if e["status"] == "running" and e.get("worker") == "local":
+                try:
+                    enqueue_bench_job(e["jobId"], sw["options"])
+                except HTTPException:
+                    e.update({"status": "pending", "jobId": None, "worker": None})
+        sw["resumed"] = int(time.time())
+        _save_sweep(sw)
+
+def ensure_sweep_thread() -> dict:
+    with _sweep_lock:
+        if not _sweep_thread:
+            _load_sweeps_once()
+            _resume_sweeps()
+            t = threading.Thread(target=_sweep_loop, name="sweeps", daemon=True)
+            _sweep_thread.append(t)
+            t.start()
+    return sweeps_status()
 
-    # Pull image (try our best)
+def sweeps_status() -> dict:
+    with _sweep_lock:
+        return {"started": bool(_sweep_thread), "running": sum(1 for sw in _sweeps.values() if sw["status"] == "running"),
+                "workers": len(_sweep_workers)}
+
+def _remote_capacity(w: dict) -> int:
+    if w.get("configured"):
+        return int(w["configured"])
+    if w.get("capacity") is None:
+        resp = sweep_session.get(f"{w['url']}/api/bench/queue", timeout=10)
+        resp.raise_for_status()
+        w["capacity"] = max(1, int(resp.json().get("workers") or 1))
+    return w["capacity"]
+
+def _entry_summary(st: dict) -> dict:
+    """The per-instance numbers kept in the sweep file; the full result stays with the job."""
+    res = st.get("result") or {}
+    stats = res.get("stats") or {}
+    out = {"before": (res.get("before") or {}).get("mean"), "after": (res.get("after") or {}).get("mean"),
+           "speedup": stats.get("speedup"), "improvement": stats.get("improvement")}
+    if res.get("best"):
+        out["best"] = res["best"]
+    return out
+
+def _sweep_dispatch(options: dict, e: dict, worker: str) -> str:
+    """Prepare and queue one entry on a worker; returns the worker's jobId."""
+    if worker == "local":
+        job_id = prepare_job(e["instance"], e["image"], e["workload"], e.get("patch"))
+        enqueue_bench_job(job_id, options)
+        return job_id
+    with open(blob_path(e["workload"]), "r", encoding="utf-8") as f:
+        body = {"instance": e["instance"], "image": e["image"], "code": f.read()}
+    if e.get("patch"):
+        with open(blob_path(e["patch"]), "r", encoding="utf-8") as f:
+            body["patch"] = f.read()
+    resp = sweep_session.post(f"{worker}/api/bench/prepare", json=body, timeout=60)
+    resp.raise_for_status()
+    job_id = resp.json()["jobId"]
+    resp = sweep_session.post(f"{worker}/api/bench/run", json=dict(options, jobId=job_id), timeout=60)
+    resp.raise_for_status()
+    return job_id
+
+def _sweep_poll(worker: str, job_id: str) -> Optional[dict]:
+    if worker == "local":
+        return load_job_state(job_id)
+    resp = sweep_session.get(f"{worker}/api/bench/jobs/{job_id}", timeout=10)
+    resp.raise_for_status()
+    return resp.json()
+
+def _sweep_cancel_job(worker: str, job_id: str, reason: str):
     try:
-        run_cmd(f"docker pull {image}", timeout=240)
+        if worker == "local":
+            cancel_bench_job(job_id, reason)
+        else:
+            sweep_session.post(f"{worker}/api/bench/jobs/{job_id}/cancel", timeout=10)
     except Exception:
         pass
 
-    # Only one entry into the container: BEFORE, git apply, AFTER
-    mounts = [f"--mount type=bind,src={shlex.quote(workload_path)},dst=/tmp/workload.py"]
-    if os.path.exists(patch_path):
-        mounts.append(f"--mount type=bind,src={shlex.quote(patch_path)},dst=/tmp/patch.diff")
-    mounts_str = " ".join(mounts)
-
-    cmd = (
-        f"docker run --rm {mounts_str} {image} /bin/bash -lc "
-        f"\"set +e; "
-        f"if [ -f /perf.sh ]; then chmod +x /perf.sh; fi; "
-        f"echo PERF_START:BEFORE; /perf.sh || true; echo PERF_END:BEFORE; "
-        f"if [ ! -f /tmp/patch.diff ]; then echo 'ERROR: docker内部不完全，没有/tmp/patch.diff'; exit 2; fi; "
-        f"cd /testbed 2>/dev/null || true; git apply /tmp/patch.diff || true; cd - >/dev/null 2>&1 || true; "
-        f"echo PERF_START:AFTER; /perf.sh || true; echo PERF_END:AFTER\""
-    )
-    try:
-        cp = run_cmd(cmd, timeout=1800)
-        out = cp.stdout.decode("utf-8", "ignore")
-        parsed = parse_perf_two(out)
-        parsed["before"]["raw"] = out
-        parsed["after"]["raw"] = out
-        return JSONResponse({"ok": True, "before": parsed["before"], "after": parsed["after"]})
-    except Exception as e:
-        return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
+def _sweep_step():
+    """One scheduling pass: poll running entries, then hand pending ones to workers with free slots.
+
+    Network calls happen outside _sweep_lock; an entry cancelled or re-dispatched meanwhile is left alone.
+    """
+    now = time.time()
+    with _sweep_lock:
+        remotes = [w for w in _sweep_workers.values() if w.get("down_until", 0) <= now]
+        running = [(sw, e, e["worker"], e["jobId"]) for sw in _sweeps.values() if sw["status"] == "running"
+                   for e in sw["entries"] if e["status"] == "running" and e.get("jobId")]
+    capacity = {"local": BENCH_WORKERS}
+    for w in remotes:
+        try:
+            capacity[w["url"]] = _remote_capacity(w)
+        except Exception as ex:
+            w.update({"down_until": now + SWEEP_WORKER_RETRY, "error": str(ex)})
+    polled = []
+    for sw, e, worker, job_id in running:
+        try:
+            polled.append((sw, e, worker, job_id, _sweep_poll(worker, job_id), None))
+        except Exception as ex:
+            polled.append((sw, e, worker, job_id, None, ex))
+
+    dirty = {}
+    picks = []
+    with _sweep_lock:
+        for sw, e, worker, job_id, st, err in polled:
+            if e["status"] != "running" or e.get("jobId") != job_id:
+                continue
+            if err is not None:
+                e["failures"] = e.get("failures", 0) + 1
+                e["error"] = str(err)
+                if e["failures"] >= SWEEP_REMOTE_FAILURES:
+                    _sweep_workers.get(worker, {})["down_until"] = now + SWEEP_WORKER_RETRY
+                    e.update({"status": "pending", "worker": None, "jobId": None})
+                dirty[sw["sweepId"]] = sw
+            elif st is not None and st.get("status") not in ("queued", "running"):
+                status = st["status"] if st["status"] in ("done", "cancelled") else "error"
+                e.update({"status": status, "finished": int(now), "error": st.get("error"), "result": _entry_summary(st)})
+                dirty[sw["sweepId"]] = sw
+        active = sorted((sw for sw in _sweeps.values() if sw["status"] == "running"), key=lambda s: s["created"])
+        busy = {w: 0 for w in capacity}
+        for sw in active:
+            for e in sw["entries"]:
+                if e["status"] == "running" and e["worker"] in busy:
+                    busy[e["worker"]] += 1
+        for sw in active:
+            allowed = [w for w in (sw.get("workers") or capacity) if w in capacity]
+            for e in sw["entries"]:
+                if e["status"] != "pending":
+                    continue
+                free = [w for w in allowed if busy[w] < capacity[w]]
+                if not free:
+                    break
+                worker = min(free, key=lambda w: busy[w] / capacity[w])
+                busy[worker] += 1
+                e.update({"status": "running", "worker": worker, "jobId": None, "started": int(now), "failures": 0})
+                picks.append((sw, e, worker, dict(sw["options"])))
+                dirty[sw["sweepId"]] = sw
+
+    for sw, e, worker, options in picks:
+        try:
+            job_id, err = _sweep_dispatch(options, e, worker), None
+        except Exception as ex:
+            job_id, err = None, ex
+        with _sweep_lock:
+            if job_id and e["status"] != "running":
+                _sweep_cancel_job(worker, job_id, "sweep cancelled")  # the sweep was cancelled meanwhile
+            elif job_id:
+                e["jobId"] = job_id
+                e["attempts"] = e.get("attempts", 0) + 1
+            elif e["status"] == "running":
+                busy_queue = isinstance(err, HTTPException) and err.status_code == 429
+                e.update({"status": "pending", "worker": None, "error": str(getattr(err, "detail", None) or err)})
+                if worker != "local":
+                    _sweep_workers.get(worker, {}).update({"down_until": time.time() + SWEEP_WORKER_RETRY, "error": str(err)})
+                if not busy_queue:
+                    e["attempts"] = e.get("attempts", 0) + 1
+                    if e["attempts"] >= SWEEP_MAX_ATTEMPTS:
+                        e.update({"status": "error", "finished": int(time.time())})
+
+    with _sweep_lock:
+        for sw in active:
+            if sw["status"] == "running" and not any(e["status"] in ("pending", "running") for e in sw["entries"]):
+                sw.update({"status": "done", "finished": int(time.time())})
+                dirty[sw["sweepId"]] = sw
+        for sw in dirty.values():
+            sw["updated"] = int(time.time())
+            _save_sweep(sw)
+
+def _sweep_loop():
+    while True:
+        try:
+            _sweep_step()
+        except Exception:
+            pass
+        _sweep_wake.wait(SWEEP_POLL)
+        _sweep_wake.clear()
+
+def sweep_progress(sw: dict) -> dict:
+    counts = {k: 0 for k in ("pending", "running", "done", "error", "cancelled")}
+    durations = []
+    for e in sw["entries"]:
+        counts[e["status"]] += 1
+        if e["status"] == "done" and e.get("started"):
+            durations.append(e["finished"] - e["started"])
+    total = len(sw["entries"])
+    finished = counts["done"] + counts["error"] + counts["cancelled"]
+    slots = BENCH_WORKERS + sum(w.get("capacity") or 0 for w in _sweep_workers.values())
+    eta = None
+    if durations and sw["status"] == "running":
+        eta = int(statistics.fmean(durations) * (counts["pending"] + counts["running"]) / max(1, slots))
+    improvements = [e["result"]["improvement"] for e in sw["entries"] if e["status"] == "done"
+                    and (e.get("result") or {}).get("improvement") is not None]
+    return {"sweepId": sw["sweepId"], "name": sw.get("name"), "status": sw["status"], "created": sw["created"],
+            "finished": sw.get("finished"), "total": total, **counts, "percent": round(100.0 * finished / total, 1) if total else 100.0,
+            "etaSecs": eta, "meanImprovement": statistics.fmean(improvements) if improvements else None}
+
+class SweepEntry(BaseModel):
+    instance: str
+    image: Optional[str] = None  # default: the instance's SWEfficiency image
+    code: str
+    patch: Optional[str] = None
+
+class SweepReq(BaseModel):
+    entries: List[SweepEntry]
+    name: Optional[str] = None
+    options: Optional[dict] = None  # /api/bench/run options for every entry (mode, rounds, ...)
+    workers: Optional[List[str]] = None  # restrict to these workers ("local" and/or registered URLs)
+
+class SweepWorkerReq(BaseModel):
+    url: str
+    capacity: Optional[int] = None  # default: the worker's own SWEF_BENCH_WORKERS
+    remove: Optional[bool] = False
+
+@app.post("/api/sweeps")
+def sweep_create(req: SweepReq, request: Request):
+    check_origin(request)
+    ensure_sweep_thread()
+    if not req.entries:
+        raise HTTPException(400, "entries must not be empty")
+    options = {k: v for k, v in (req.options or {}).items() if k in SWEEP_OPTION_KEYS}
+    if options.get("mode") not in (None, "single", "interleaved", "adaptive"):
+        raise HTTPException(400, f"unsupported sweep mode {options.get('mode')}")
+    sweep_id = f"sweep-{int(time.time())}-{secrets.token_hex(4)}"
+    entries = []
+    for i, e in enumerate(req.entries):
+        entries.append({"i": i, "instance": e.instance, "image": e.image or image_for_instance(e.instance),
+                        "workload": store_blob(e.code.encode("utf-8")),
+                        "patch": store_blob(e.patch.encode("utf-8")) if e.patch else None,
+                        "status": "pending", "worker": None, "jobId": None})
+    sw = {"sweepId": sweep_id, "name": req.name, "status": "running", "created": int(time.time()),
+          "options": options, "workers": [w.rstrip("/") for w in req.workers or []], "entries": entries}
+    with _sweep_lock:
+        _sweeps[sweep_id] = sw
+        _save_sweep(sw)
+        progress = sweep_progress(sw)
+    _sweep_wake.set()
+    return JSONResponse({"ok": True, **progress}, status_code=202)
+
+@app.get("/api/sweeps")
+def sweep_list(request: Request):
+    check_origin(request)
+    ensure_sweep_thread()
+    with _sweep_lock:
+        return JSONResponse({"ok": True, "sweeps": [sweep_progress(sw) for sw in sorted(_sweeps.values(), key=lambda s: -s["created"])]})
+
+@app.get("/api/sweeps/workers")
+def sweep_workers(request: Request):
+    check_origin(request)
+    ensure_sweep_thread()
+    with _sweep_lock:
+        remote = [{"url": w["url"], "capacity": w.get("capacity"), "down": w.get("down_until", 0) > time.time(),
+                   "error": w.get("error"), "fromEnv": bool(w.get("env"))} for w in _sweep_workers.values()]
+    return JSONResponse({"ok": True, "local": {"capacity": BENCH_WORKERS}, "remote": remote})
+
+@app.post("/api/sweeps/workers")
+def sweep_worker_register(req: SweepWorkerReq, request: Request):
+    check_origin(request)
+    ensure_sweep_thread()
+    url = req.url.rstrip("/")
+    if not url.startswith(("http://", "https://")):
+        raise HTTPException(400, "worker url must be http(s)://host:port")
+    with _sweep_lock:
+        if req.remove:
+            _sweep_workers.pop(url, None)
+        else:
+            _sweep_workers[url] = {"url": url, "configured": req.capacity, "capacity": req.capacity}
+        _save_sweep_workers()
+    _sweep_wake.set()
+    return sweep_workers(request)
+
+@app.get("/api/sweeps/{sweep_id}")
+def sweep_status(sweep_id: str, request: Request, status: Optional[str] = None, offset: int = 0, limit: int = 1000):
+    check_origin(request)
+    ensure_sweep_thread()
+    with _sweep_lock:
+        sw = _sweeps.get(sweep_id)
+        if sw is None:
+            raise HTTPException(404, "unknown sweepId")
+        entries = [e for e in sw["entries"] if status is None or e["status"] == status]
+        page = [{k: e.get(k) for k in ("i", "instance", "image", "status", "worker", "jobId", "attempts", "started",
+                                       "finished", "error", "result")} for e in entries[max(0, offset):max(0, offset) + max(1, limit)]]
+        return JSONResponse({"ok": True, **sweep_progress(sw), "options": sw["options"], "matched": len(entries), "entries": page})
+
+@app.post("/api/sweeps/{sweep_id}/cancel")
+def sweep_cancel(sweep_id: str, request: Request):
+    check_origin(request)
+    ensure_sweep_thread()
+    with _sweep_lock:
+        sw = _sweeps.get(sweep_id)
+        if sw is None:
+            raise HTTPException(404, "unknown sweepId")
+        if sw["status"] == "running":
+            inflight = [(e["worker"], e["jobId"]) for e in sw["entries"] if e["status"] == "running" and e.get("jobId")]
+            for e in sw["entries"]:
+                if e["status"] in ("pending", "running"):
+                    e.update({"status": "cancelled", "finished": int(time.time())})
+            sw.update({"status": "cancelled", "finished": int(time.time())})
+            _save_sweep(sw)
+        else:
+            inflight = []
+        progress = sweep_progress(sw)
+    for worker, job_id in inflight:
+        _sweep_cancel_job(worker, job_id, "sweep cancelled")
+    return JSONResponse({"ok": True, **progress})
 
 class UploadReq(BaseModel):
     image: str
     instanceId: Optional[str] = None
     githubUrl: Optional[str] = None
     workload_b64: str
-    before: dict
-    after: dict
-    improvement: float
+    before: Optional[dict] = None
+    after: Optional[dict] = None
+    improvement: Optional[float] = None  # informational only; the helper computes its own
+    jobId: Optional[str] = None  # take before/after/stats from this finished bench job
     notes: Optional[str] = None
     ts: Optional[int] = None
+    batch: Optional[bool] = False  # queue for /api/upload/batch/flush instead of opening a PR now
 
 class TokenReq(BaseModel):
     token: str
@@ -295,12 +3716,381 @@ def save_token(req: TokenReq, request: Request):
         f.write(req.token.strip())
     return ok()
 
-GITHUB_API = "https://api.github.com"
+GITHUB_API = os.environ.get("SWEF_GITHUB_API", "https://api.github.com").rstrip("/")
 DEVICE_FLOW_FILE = os.path.join(TOKEN_DIR, "device_flow.json")
 
 def gh_headers(token: str):
     return {"Authorization": f"token {token}", "Accept": "application/vnd.github+json"}
 
+GH_REPO_PATH_RE = re.compile(r"^/repos/[^/]+/[^/]+(?:/(git/[^/]+|[^/]+))?")
+
+def gh_endpoint(url: str) -> str:
+    """Low-cardinality metric label for a GitHub URL: /repos/{owner}/{repo}/git/refs/heads/x -> repos/git/refs."""
+    path = urllib.parse.urlsplit(url).path
+    m = GH_REPO_PATH_RE.match(path)
+    if m:
+        return "repos/" + m.group(1) if m.group(1) else "repos"
+    return path.strip("/") or "/"
+
+def _gh_observe(resp, *args, **kwargs):
+    metric_observe("swef_github_request_seconds", resp.elapsed.total_seconds(), endpoint=gh_endpoint(resp.url),
+                   method=resp.request.method, status=str(resp.status_code))
+
+# One keep-alive session for all GitHub calls instead of a new connection per request
+gh_session = requests.Session()
+gh_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8))
+gh_session.hooks["response"].append(_gh_observe)
+
+def load_token() -> Optional[str]:
+    if os.path.exists(TOKEN_FILE):
+        with open(TOKEN_FILE, "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    return None
+
+# Local index of what is already in the data repo: "<instance>/<YYYYMMDD>/<hash8>" -> {path, prUrl, ts}.
+# Our own uploads are recorded as they happen; the rest is refreshed lazily from the repo tree
+# (one recursive trees request) so duplicate submissions are answered without touching GitHub.
+UPLOADED_INDEX_FILE = os.path.join(ROOT_DIR, "uploaded.json")
+UPLOADED_INDEX_TTL = int(os.environ.get("SWEF_UPLOADED_INDEX_TTL", "3600") or 3600)
+UPLOADED_NAME_RE = re.compile(r"^\d{4}-([0-9a-f]{8})\.json$")
+_uploaded_lock = threading.Lock()
+_uploaded_index = {}
+
+def _uploaded_load() -> dict:
+    if not _uploaded_index:
+        try:
+            with open(UPLOADED_INDEX_FILE, "r", encoding="utf-8") as f:
+                _uploaded_index.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        if _uploaded_index.get("repo") != DATA_REPO or _uploaded_index.get("path") != DATA_PATH:
+            _uploaded_index.clear()
+            _uploaded_index.update({"repo": DATA_REPO, "path": DATA_PATH, "refreshed": 0, "entries": {}})
+    return _uploaded_index
+
+def _uploaded_save():
+    os.makedirs(ROOT_DIR, exist_ok=True)
+    tmp = UPLOADED_INDEX_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_uploaded_index, f)
+    os.replace(tmp, UPLOADED_INDEX_FILE)
+
+def uploaded_lookup(instance: str, day: str, hash8: str) -> Optional[dict]:
+    with _uploaded_lock:
+        hit = _uploaded_load()["entries"].get(f"{instance}/{day}/{hash8}")
+        return dict(hit) if hit else None
+
+def uploaded_record(instance: str, day: str, hash8: str, path: str, pr_url: Optional[str] = None):
+    with _uploaded_lock:
+        _uploaded_load()["entries"][f"{instance}/{day}/{hash8}"] = {"path": path, "prUrl": pr_url, "ts": int(time.time())}
+        _uploaded_save()
+
+def uploaded_stale() -> bool:
+    with _uploaded_lock:
+        return time.time() - _uploaded_load().get("refreshed", 0) > UPLOADED_INDEX_TTL
+
+def uploaded_refresh(token: str, repo: str, branch: str) -> bool:
+    """Merge every <DATA_PATH>/<instance>/<day>/<hhmm>-<hash8>.json on `branch` into the index.
+
+    Returns False when the tree could not be listed completely (error or truncated listing)."""
+    resp = gh_session.get(f"{GITHUB_API}/repos/{repo}/git/trees/{branch}", headers=gh_headers(token), params={"recursive": "1"})
+    if not resp.ok:
+        return False
+    try:
+        body = resp.json()
+    except ValueError:
+        return False
+    prefix = DATA_PATH.strip("/") + "/"
+    found = {}
+    for it in body.get("tree") or []:
+        path = it.get("path") or ""
+        if it.get("type") != "blob" or not path.startswith(prefix):
+            continue
+        parts = path[len(prefix):].split("/")
+        m = UPLOADED_NAME_RE.match(parts[-1]) if len(parts) == 3 else None
+        if m:
+            found[f"{parts[0]}/{parts[1]}/{m.group(1)}"] = {"path": path, "prUrl": None, "ts": 0}
+    with _uploaded_lock:
+        idx = _uploaded_load()
+        for key, entry in found.items():
+            idx["entries"].setdefault(key, entry)
+        if not body.get("truncated"):
+            idx["refreshed"] = int(time.time())
+        _uploaded_save()
+    return not body.get("truncated")
+
+# Batch uploads: qualifying records are queued in upload_batch.json and flushed as a single commit
+# built with the Git Data API (one tree with inline contents, one commit, one branch, one PR),
+# so a sweep of hundreds of instances costs a handful of requests instead of ~8 per record.
+UPLOAD_BATCH_FILE = os.path.join(ROOT_DIR, "upload_batch.json")
+_batch_lock = threading.Lock()
+_batch_flush_lock = threading.Lock()
+
+def _batch_load() -> List[dict]:
+    try:
+        with open(UPLOAD_BATCH_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def _batch_save(items: List[dict]):
+    os.makedirs(ROOT_DIR, exist_ok=True)
+    tmp = UPLOAD_BATCH_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+    os.replace(tmp, UPLOAD_BATCH_FILE)
+
+def upload_batch_add(item: dict) -> int:
+    with _batch_lock:
+        items = _batch_load()
+        key = (item["instance"], item["day"], item["hash8"])
+        if not any((it["instance"], it["day"], it["hash8"]) == key for it in items):
+            items.append(dict(item, queuedAt=int(time.time())))
+            _batch_save(items)
+    ensure_outbox_thread()
+    _outbox_wake.set()
+    return len(items)
+
+def upload_batch_contains(item: dict) -> bool:
+    key = (item["instance"], item["day"], item["hash8"])
+    with _batch_lock:
+        return any((it["instance"], it["day"], it["hash8"]) == key for it in _batch_load())
+
+class GitHubError(RuntimeError):
+    def __init__(self, message: str, status: int = 0, retry_at: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_at = retry_at
+
+def github_retry_at(resp) -> Optional[float]:
+    """When GitHub says we may try again (Retry-After, or X-RateLimit-Reset once the quota is spent)."""
+    if resp is None:
+        return None
+    after = resp.headers.get("Retry-After")
+    if after:
+        try:
+            return time.time() + float(after)
+        except ValueError:
+            try:
+                return parsedate_to_datetime(after).timestamp()
+            except (TypeError, ValueError):
+                pass
+    if resp.headers.get("X-RateLimit-Remaining") == "0" and resp.headers.get("X-RateLimit-Reset"):
+        try:
+            return float(resp.headers["X-RateLimit-Reset"])
+        except ValueError:
+            pass
+    return None
+
+def github_retryable(resp) -> bool:
+    """Worth retrying later: no response at all (connection/timeout), 429, 5xx, or a rate-limited 403."""
+    if resp is None:
+        return True
+    if resp.status_code == 429 or resp.status_code >= 500:
+        return True
+    return resp.status_code == 403 and (resp.headers.get("X-RateLimit-Remaining") == "0" or bool(resp.headers.get("Retry-After")))
+
+def _gh_check(resp, what: str):
+    if not resp.ok:
+        try:
+            msg = resp.json().get("message") or resp.text
+        except ValueError:
+            msg = resp.text
+        raise GitHubError(f"{what} failed ({resp.status_code}): {msg}", resp.status_code, github_retry_at(resp))
+    return resp.json()
+
+def flush_upload_batch(token: str, items: List[dict]) -> dict:
+    """Commit `items` to a fresh branch off the default branch and open (or reuse) one PR for it."""
+    repo = DATA_REPO
+    api = f"{GITHUB_API}/repos/{repo}"
+    headers = gh_headers(token)
+    default_branch = _gh_check(gh_session.get(api, headers=headers), "Get repo").get("default_branch", "main")
+    base_sha = (_gh_check(gh_session.get(f"{api}/git/ref/heads/{default_branch}", headers=headers), "Get ref").get("object") or {}).get("sha")
+    # Drop anything that landed upstream since it was queued
+    if uploaded_stale():
+        uploaded_refresh(token, repo, default_branch)
+    skipped = [it for it in items if uploaded_lookup(it["instance"], it["day"], it["hash8"])]
+    items = [it for it in items if it not in skipped]
+    if not items:
+        return {"uploaded": 0, "skipped": skipped, "prUrl": None}
+    base_tree = (_gh_check(gh_session.get(f"{api}/git/commits/{base_sha}", headers=headers), "Get commit").get("tree") or {}).get("sha")
+    tree = _gh_check(gh_session.post(f"{api}/git/trees", headers=headers, json={
+        "base_tree": base_tree,
+        "tree": [{"path": it["path"], "mode": "100644", "type": "blob",
+                  "content": json.dumps(it["record"], ensure_ascii=False, indent=2)} for it in items],
+    }), "Create tree")
+    instances = sorted({it["instance"] for it in items})
+    commit = _gh_check(gh_session.post(f"{api}/git/commits", headers=headers, json={
+        "message": f"add Non-LLM user data: {len(items)} submissions ({', '.join(instances[:5])}{', ...' if len(instances) > 5 else ''})",
+        "tree": tree["sha"],
+        "parents": [base_sha],
+    }), "Create commit")
+    # Branch name follows the tree so re-flushing the same batch lands on the same branch/PR
+    branch = f"submission-batch-{datetime.utcnow().strftime('%Y%m%d')}-{tree['sha'][:8]}"
+    ref = gh_session.post(f"{api}/git/refs", headers=headers, json={"ref": f"refs/heads/{branch}", "sha": commit["sha"]})
+    if ref.status_code == 422:  # branch already exists
+        ref = gh_session.patch(f"{api}/git/refs/heads/{branch}", headers=headers, json={"sha": commit["sha"], "force": True})
+    _gh_check(ref, "Create ref")
+    owner = repo.split('/')[0] if '/' in repo else repo
+    prs = gh_session.get(f"{api}/pulls", headers=headers, params={"state": "open", "head": f"{owner}:{branch}"})
+    existing = prs.json() if prs.ok and isinstance(prs.json(), list) else []
+    if existing:
+        pr_url = existing[0].get("html_url")
+    else:
+        body = "Automated batch submission from SWEf Helper\n\n" + "\n".join(f"- `{it['path']}`" for it in items)
+        pr_url = _gh_check(gh_session.post(f"{api}/pulls", headers=headers, json={
+            "title": f"Non-LLM user data: {len(items)} submissions",
+            "head": branch,
+            "base": default_branch,
+            "body": body,
+        }), "Create PR").get("html_url")
+    for it in items:
+        uploaded_record(it["instance"], it["day"], it["hash8"], it["path"], pr_url)
+    return {"uploaded": len(items), "skipped": skipped, "prUrl": pr_url, "branch": branch}
+
+# The batch queue doubles as a durable outbox: a background thread drains it once the oldest entry
+# has waited OUTBOX_WINDOW seconds (so a sweep's records share one commit) and a token is available,
+# including one from a device flow the user completes later. Failures back off exponentially, or
+# until the time GitHub names in Retry-After / X-RateLimit-Reset.
+OUTBOX_WINDOW = int(os.environ.get("SWEF_OUTBOX_WINDOW", "60") or 60)
+OUTBOX_BATCH_MAX = 200
+OUTBOX_BACKOFF_BASE = 30
+OUTBOX_BACKOFF_MAX = 3600
+_outbox = {"attempts": 0, "nextAttempt": 0, "lastError": None, "lastPrUrl": None, "lastUpload": None}
+_outbox_wake = threading.Event()
+_outbox_thread: List[threading.Thread] = []
+
+def _outbox_defer(err: Exception):
+    _outbox["attempts"] += 1
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** (_outbox["attempts"] - 1))
+    retry_at = getattr(err, "retry_at", None) or github_retry_at(getattr(err, "response", None))
+    _outbox["nextAttempt"] = int(retry_at + 1 if retry_at else time.time() + delay * random.uniform(0.75, 1.0))
+    _outbox["lastError"] = str(err)
+
+def drain_outbox(force: bool = False) -> dict:
+    """Upload queued submissions. Without `force`, respects the batching window and any backoff."""
+    with _batch_flush_lock:
+        with _batch_lock:
+            items = _batch_load()
+        if not items:
+            return {"uploaded": 0, "pending": 0}
+        now = time.time()
+        if not force:
+            if now < _outbox["nextAttempt"]:
+                return {"uploaded": 0, "pending": len(items), "waiting": "backoff"}
+            oldest = min(it.get("queuedAt") or 0 for it in items)
+            if now - oldest < OUTBOX_WINDOW and len(items) < OUTBOX_BATCH_MAX:
+                return {"uploaded": 0, "pending": len(items), "waiting": "window"}
+        token = load_token()
+        if not token:
+            try:
+                token = poll_device_token()
+            except Exception as e:
+                _outbox["lastError"] = f"Device token polling failed: {e}"
+        if not token:
+            _outbox["lastError"] = _outbox["lastError"] or "waiting for GitHub authorization"
+            return {"uploaded": 0, "pending": len(items), "needToken": True}
+        items = items[:OUTBOX_BATCH_MAX]
+        try:
+            res = flush_upload_batch(token, items)
+        except (GitHubError, requests.RequestException) as e:
+            _outbox_defer(e)
+            raise
+        _outbox.update({"attempts": 0, "nextAttempt": 0, "lastError": None})
+        if res["prUrl"]:
+            _outbox.update({"lastPrUrl": res["prUrl"], "lastUpload": int(time.time())})
+        done = {(it["instance"], it["day"], it["hash8"]) for it in items}
+        with _batch_lock:
+            remaining = [it for it in _batch_load() if (it["instance"], it["day"], it["hash8"]) not in done]
+            _batch_save(remaining)
+        for it in items:
+            if it.get("jobId"):
+                update_job_meta(it["jobId"], pending_upload=False)
+        return {"uploaded": res["uploaded"], "skipped": len(res["skipped"]), "prUrl": res["prUrl"], "pending": len(remaining)}
+
+def _outbox_loop():
+    while True:
+        _outbox_wake.wait(timeout=15)
+        _outbox_wake.clear()
+        try:
+            drain_outbox()
+        except Exception:
+            pass  # recorded in _outbox by drain_outbox
+
+def ensure_outbox_thread() -> dict:
+    with _batch_lock:
+        if not _outbox_thread:
+            t = threading.Thread(target=_outbox_loop, name="upload-outbox", daemon=True)
+            _outbox_thread.append(t)
+            t.start()
+    return outbox_status()
+
+def outbox_status() -> dict:
+    with _batch_lock:
+        pending = len(_batch_load())
+        started = bool(_outbox_thread)
+    return {"started": started, "pending": pending, "attempts": _outbox["attempts"], "nextAttempt": _outbox["nextAttempt"] or None,
+            "lastError": _outbox["lastError"], "lastPrUrl": _outbox["lastPrUrl"]}
+
+@app.get("/api/upload/outbox")
+@app.get("/api/upload/batch")
+def upload_outbox_status(request: Request):
+    check_origin(request)
+    status = ensure_outbox_thread()
+    with _batch_lock:
+        items = _batch_load()
+    return JSONResponse({"ok": True, **status, "window": OUTBOX_WINDOW, "hasToken": bool(load_token()),
+                         "items": [{k: it.get(k) for k in ("instance", "day", "hash8", "path", "jobId", "queuedAt")} for it in items]})
+
+@app.post("/api/upload/batch/flush")
+def upload_batch_flush(request: Request):
+    check_origin(request)
+    try:
+        res = drain_outbox(force=True)
+    except Exception as e:
+        return JSONResponse({"ok": False, "uploaded": False, "message": f"Batch upload failed: {e}",
+                             "nextAttempt": _outbox["nextAttempt"] or None}, status_code=502)
+    if res.get("needToken"):
+        return JSONResponse({"ok": True, "uploaded": False, "needToken": True, "pending": res["pending"],
+                             "message": "GitHub token required. Use Submit & Upload once to authorize, or POST a token to /api/upload/token."})
+    if not res["uploaded"] and not res.get("skipped"):
+        return JSONResponse({"ok": True, "uploaded": False, "pending": res["pending"], "message": "Nothing to upload."})
+    return JSONResponse({"ok": True, "uploaded": res["uploaded"] > 0, "count": res["uploaded"],
+                         "skipped": res.get("skipped", 0), "prUrl": res.get("prUrl"), "pending": res["pending"]})
+
+def poll_device_token() -> Optional[str]:
+    """Exchange a pending device-flow code for a token; returns None while the user has not approved yet."""
+    if not (os.path.exists(DEVICE_FLOW_FILE) and GH_CLIENT_ID and GH_CLIENT_SECRET):
+        return None
+    with open(DEVICE_FLOW_FILE, "r", encoding="utf-8") as f:
+        st = json.load(f)
+    resp = gh_session.post(
+        "https://github.com/login/oauth/access_token",
+        data={
+            "client_id": GH_CLIENT_ID,
+            "device_code": st.get("device_code"),
+            "grant_type": "urn:ietf:params:oauth:grant-type:device_code",
+            "client_secret": GH_CLIENT_SECRET,
+        },
+        headers={
+            "Accept": "application/json",
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+    )
+    try:
+        tok = resp.json()
+    except ValueError:
+        raise ValueError(resp.text or "Device token polling returned non-JSON")
+    if not tok.get("access_token"):
+        return None
+    token = tok["access_token"]
+    os.makedirs(TOKEN_DIR, exist_ok=True)
+    with open(TOKEN_FILE, "w", encoding="utf-8") as f:
+        f.write(token)
+    try: os.remove(DEVICE_FLOW_FILE)
+    except Exception: pass
+    return token
+
 def parse_instance_from_github(url: str) -> Optional[str]:
     m = re.search(r"github\.com/([^/]+)/([^/]+)/pull/(\d+)", url)
     if not m: return None
@@ -324,7 +4114,7 @@ def upload_start(request: Request):
         except Exception:
             pass
     try:
-        resp = requests.post(
+        resp = gh_session.post(
             "https://github.com/login/device/code",
             data={"client_id": GH_CLIENT_ID, "scope": "repo"},
             headers={"Accept": "application/json", "Content-Type": "application/x-www-form-urlencoded"},
@@ -354,7 +4144,7 @@ def upload_run(req: UploadReq, request: Request):
 
     # Normalize instance/image
     instance = req.instanceId or (parse_instance_from_github(req.githubUrl or "") or "")
-    image = req.image or (f"docker.io/sweperf/sweperf_annotate:{instance}" if instance else req.image)
+    image = req.image or (image_for_instance(instance) if instance else req.image)
 
     # Local audit
     # Normalize timestamp to seconds (handle ms and string inputs)
@@ -374,6 +4164,22 @@ def upload_run(req: UploadReq, request: Request):
     except Exception:
         workload_str = None
 
+    # Prefer the helper's own measurement for this job over client-supplied numbers
+    before, after = req.before or {}, req.after or {}
+    stats = None
+    environment, normalized = None, None
+    if req.jobId:
+        st = load_job_state(req.jobId) or {}
+        res = st.get("result") or {}
+        if st.get("status") == "done" and res.get("ok"):
+            before, after, stats = res.get("before") or {}, res.get("after") or {}, res.get("stats")
+            environment, normalized = res.get("environment"), res.get("normalized")
+    if stats is None:
+        stats = speedup_stats(before, after)
+    # Raw logs stay in the job directory; older pages still send them inside before/after
+    before = {k: v for k, v in before.items() if k != "raw"}
+    after = {k: v for k, v in after.items() if k != "raw"}
+
     record = {
         "id": f"job-{int(time.time())}-{secrets.token_hex(4)}",
         "ts": _ts_norm,
@@ -381,60 +4187,76 @@ def upload_run(req: UploadReq, request: Request):
         "instanceId": instance,
         "githubUrl": req.githubUrl,
         "workload": workload_str,
-        "before": req.before,
-        "after": req.after,
-        "improvement": req.improvement,
+        "before": before,
+        "after": after,
+        "improvement": stats.get("improvement"),
+        "stats": stats,
+        "client_improvement": req.improvement,
         "notes": req.notes,
-        "client": {"helper_version": "1.0"}
+        "client": {"helper_version": "1.0"},
+        # Client-supplied numbers were at least submitted through this host
+        "environment": environment or {"host": host_fingerprint()},
     }
-    with open(SUBMIT_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if normalized:
+        record["normalized"] = normalized
+    submission = append_submission(record)
+
+    # Threshold check on the lower confidence bound (or the plain improvement without enough samples)
+    gate = improvement_lower_bound(stats)
+    if not isinstance(gate, (int, float)) or gate <= UPLOAD_MIN_IMPROVEMENT:
+        basis = "CI lower bound" if (stats.get("ci") or {}).get("improvement") else "improvement"
+        return JSONResponse({"ok": True, "uploaded": False, "stats": stats,
+                             "message": f"Thanks! Recorded locally ({basis} ≤ {UPLOAD_MIN_IMPROVEMENT:g}%, not uploaded)."})
 
-    # Threshold check
-    if not isinstance(req.improvement, (int, float)) or req.improvement <= 15:
-        return JSONResponse({"ok": True, "uploaded": False, "message": "Thanks! Recorded locally (improvement ≤ 15%, not uploaded)."})
+    # Compute per-minute path and content fingerprint (dedup within the same day)
+    _dt = datetime.utcfromtimestamp(record["ts"])
+    date_str = _dt.strftime("%Y%m%d")
+    hhmm = _dt.strftime("%H%M")
+    # fingerprint over key fields
+    _hash8 = submission[5][:8]
+    # Known duplicates are answered from the local index before any GitHub request
+    known = uploaded_lookup(instance, date_str, _hash8) if instance else None
+    if known:
+        return JSONResponse({"ok": True, "uploaded": False, "message": "Identical submission exists today; skipped.",
+                             "path": known.get("path"), "prUrl": known.get("prUrl")})
+    # Keep the job (and its objects) out of GC until the upload has gone through
+    if req.jobId:
+        update_job_meta(req.jobId, pending_upload=True)
+    def given_up(resp: JSONResponse) -> JSONResponse:
+        # Neither uploaded nor handed to the outbox: nothing will ever clear the flag otherwise
+        if req.jobId:
+            update_job_meta(req.jobId, pending_upload=False)
+        return resp
+    outbox_item = {"instance": instance, "day": date_str, "hash8": _hash8, "jobId": req.jobId,
+                   "path": f"{DATA_PATH}/{instance}/{date_str}/{hhmm}-{_hash8}.json", "record": record}
+    if instance and upload_batch_contains(outbox_item):
+        _outbox_wake.set()
+        return JSONResponse({"ok": True, "uploaded": False, "queued": True, "stats": stats,
+                             "message": "Already queued; it will be uploaded automatically."})
+    if req.batch:
+        if not instance:
+            return given_up(JSONResponse({"ok": False, "uploaded": False, "message": "instanceId missing; cannot determine upload path."}, status_code=400))
+        pending = upload_batch_add(outbox_item)
+        return JSONResponse({"ok": True, "uploaded": False, "queued": True, "pending": pending, "stats": stats,
+                             "message": f"Queued for batch upload ({pending} pending)."})
 
     # Need token
-    token = None
-    if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, "r", encoding="utf-8") as f:
-            token = f.read().strip()
+    token = load_token()
     # If have pending device flow, try a quick poll
-    if not token and os.path.exists(DEVICE_FLOW_FILE) and GH_CLIENT_ID and GH_CLIENT_SECRET:
+    if not token:
         try:
-            with open(DEVICE_FLOW_FILE, "r", encoding="utf-8") as f:
-                st = json.load(f)
-            device_code = st.get("device_code"); interval = int(st.get("interval", 5))
-            resp = requests.post(
-                "https://github.com/login/oauth/access_token",
-                data={
-                    "client_id": GH_CLIENT_ID,
-                    "device_code": device_code,
-                    "grant_type": "urn:ietf:params:oauth:grant-type:device_code",
-                    "client_secret": GH_CLIENT_SECRET,
-                },
-                headers={
-                    "Accept": "application/json",
-                    "Content-Type": "application/x-www-form-urlencoded",
-                },
-            )
-            try:
-                tok = resp.json()
-            except Exception:
-                return JSONResponse({"ok": False, "uploaded": False, "message": resp.text or "Device token polling returned non-JSON"}, status_code=502)
-            if tok.get("access_token"):
-                token = tok["access_token"]
-                os.makedirs(TOKEN_DIR, exist_ok=True)
-                with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-                    f.write(token)
-                try: os.remove(DEVICE_FLOW_FILE)
-                except Exception: pass
+            token = poll_device_token()
         except Exception as e:
-            return JSONResponse({"ok": False, "uploaded": False, "message": f"Device token polling failed: {e}"}, status_code=502)
+            return given_up(JSONResponse({"ok": False, "uploaded": False, "message": f"Device token polling failed: {e}"}, status_code=502))
 
     if not token:
+        # Park the record in the outbox; it is uploaded as soon as a token turns up
+        if instance:
+            upload_batch_add(outbox_item)
+        elif req.jobId:
+            update_job_meta(req.jobId, pending_upload=False)
         if not (GH_CLIENT_ID and GH_CLIENT_SECRET):
-            return JSONResponse({"ok": True, "uploaded": False, "needToken": True, "message": "GitHub token required. Please create a PAT with repo scope and POST it to /api/upload/token."})
+            return JSONResponse({"ok": True, "uploaded": False, "needToken": True, "queued": bool(instance), "message": "GitHub token required. Please create a PAT with repo scope and POST it to /api/upload/token; queued submissions are uploaded automatically afterwards."})
         # If there is a pending device authorization, reuse it, do not re-initialize to avoid rate limiting
         if os.path.exists(DEVICE_FLOW_FILE):
             try:
@@ -451,12 +4273,13 @@ def upload_run(req: UploadReq, request: Request):
                         "needDevice": True,
                         "verifyUri": verify_uri,
                         "userCode": user_code,
-                        "message": "Please open the verification URL and enter the code, then click Submit & Upload again."
+                        "queued": bool(instance),
+                        "message": "Please open the verification URL and enter the code; the upload continues automatically once authorized."
                     })
             except Exception:
                 pass
         try:
-            resp = requests.post(
+            resp = gh_session.post(
                 "https://github.com/login/device/code",
                 data={"client_id": GH_CLIENT_ID, "scope": "repo"},
                 headers={
@@ -503,74 +4326,74 @@ def upload_run(req: UploadReq, request: Request):
                 "needDevice": True,
                 "verifyUri": verify_uri,
                 "userCode": user_code,
-                "message": "Please open the verification URL and enter the code, then click Submit & Upload again."
+                "queued": bool(instance),
+                "message": "Please open the verification URL and enter the code; the upload continues automatically once authorized."
             })
         except Exception as e:
             return JSONResponse({"ok": False, "uploaded": False, "message": f"Device flow init failed: {e}"}, status_code=500)
 
     # Build path Non_LLM_user_data/<instance>/<YYYYMMDD>.json
     if not instance:
-        return JSONResponse({"ok": False, "uploaded": False, "message": "instanceId missing; cannot determine upload path."}, status_code=400)
-    # Compute per-minute path and content fingerprint (dedup within the same day)
-    _dt = datetime.utcfromtimestamp(record["ts"])
-    date_str = _dt.strftime("%Y%m%d")
-    hhmm = _dt.strftime("%H%M")
-    # fingerprint over key fields
-    _dedup_key = json.dumps({
-        "instanceId": instance,
-        "workload": record.get("workload"),
-        "before": record.get("before"),
-        "after": record.get("after"),
-        "improvement": record.get("improvement"),
-        "notes": record.get("notes")
-    }, ensure_ascii=False, sort_keys=True)
-    _hash8 = hashlib.sha256(_dedup_key.encode("utf-8")).hexdigest()[:8]
+        return given_up(JSONResponse({"ok": False, "uploaded": False, "message": "instanceId missing; cannot determine upload path."}, status_code=400))
     rel_path = f"{DATA_PATH}/{instance}/{date_str}/{hhmm}-{_hash8}.json"
 
     # Create branch and PR
     try:
         # Get repo info
         repo = DATA_REPO
-        s_resp = requests.get(f"{GITHUB_API}/repos/{repo}", headers=gh_headers(token))
+        s_resp = gh_session.get(f"{GITHUB_API}/repos/{repo}", headers=gh_headers(token))
         s_resp.raise_for_status()
         s = s_resp.json()
         default_branch = s.get("default_branch", "main")
+
+        # Dedup against default branch within the same day by content hash
+        dir_on_default = f"{DATA_PATH}/{instance}/{date_str}"
+        indexed = uploaded_refresh(token, repo, default_branch) if uploaded_stale() else True
+        known = uploaded_lookup(instance, date_str, _hash8)
+        if known:
+            if req.jobId:
+                update_job_meta(req.jobId, pending_upload=False)
+            return JSONResponse({"ok": True, "uploaded": False, "message": "Identical submission exists today; skipped.",
+                                 "path": known.get("path"), "prUrl": known.get("prUrl")})
  
         # Resolve base sha of default branch (try git/ref, fallback to branches API)
         base_sha = None
-        ref_resp = requests.get(f"{GITHUB_API}/repos/{repo}/git/ref/heads/{default_branch}", headers=gh_headers(token))
+        ref_resp = gh_session.get(f"{GITHUB_API}/repos/{repo}/git/ref/heads/{default_branch}", headers=gh_headers(token))
         if ref_resp.ok:
             try:
                 base_sha = (ref_resp.json().get("object") or {}).get("sha")
             except Exception:
                 base_sha = None
         if not base_sha:
-            br_resp = requests.get(f"{GITHUB_API}/repos/{repo}/branches/{default_branch}", headers=gh_headers(token))
+            br_resp = gh_session.get(f"{GITHUB_API}/repos/{repo}/branches/{default_branch}", headers=gh_headers(token))
             if br_resp.ok:
                 try:
                     base_sha = (br_resp.json().get("commit") or {}).get("sha")
                 except Exception:
                     base_sha = None
         if not base_sha or not isinstance(base_sha, str) or len(base_sha) < 7:
-            return JSONResponse({
+            return given_up(JSONResponse({
                 "ok": False,
                 "uploaded": False,
                 "message": f"Cannot resolve base SHA for {repo}@{default_branch}."
-            }, status_code=502)
+            }, status_code=502))
  
         # Deterministic branch per instance-minute to reduce duplicates
         minute_str = _dt.strftime("%Y%m%d-%H%M")
         branch = f"submission-{instance}-{minute_str}"
 
-        # Dedup against default branch within the same day by content hash
-        dir_on_default = f"{DATA_PATH}/{instance}/{date_str}"
-        list_resp = requests.get(f"{GITHUB_API}/repos/{repo}/contents/{dir_on_default}", headers=gh_headers(token), params={"ref": default_branch})
-        if list_resp.ok and isinstance(list_resp.json(), list):
+        # Repo tree could not be indexed: fall back to listing today's directory
+        list_resp = None if indexed else gh_session.get(f"{GITHUB_API}/repos/{repo}/contents/{dir_on_default}", headers=gh_headers(token), params={"ref": default_branch})
+        if list_resp is not None and list_resp.ok and isinstance(list_resp.json(), list):
             try:
                 names = [it.get("name","") for it in list_resp.json() if isinstance(it, dict)]
             except Exception:
                 names = []
-            if any(name.endswith(f"-{_hash8}.json") for name in names):
+            dup = next((name for name in names if name.endswith(f"-{_hash8}.json")), None)
+            if dup:
+                uploaded_record(instance, date_str, _hash8, f"{dir_on_default}/{dup}")
+                if req.jobId:
+                    update_job_meta(req.jobId, pending_upload=False)
                 return JSONResponse({
                     "ok": True,
                     "uploaded": False,
@@ -579,27 +4402,27 @@ def upload_run(req: UploadReq, request: Request):
                 })
 
         # Ensure branch exists (idempotent)
-        ref_check = requests.get(f"{GITHUB_API}/repos/{repo}/git/ref/heads/{branch}", headers=gh_headers(token))
+        ref_check = gh_session.get(f"{GITHUB_API}/repos/{repo}/git/ref/heads/{branch}", headers=gh_headers(token))
         if ref_check.status_code == 404:
             create_payload = {"ref": f"refs/heads/{branch}", "sha": base_sha}
-            create_resp = requests.post(f"{GITHUB_API}/repos/{repo}/git/refs", headers=gh_headers(token), json=create_payload)
+            create_resp = gh_session.post(f"{GITHUB_API}/repos/{repo}/git/refs", headers=gh_headers(token), json=create_payload)
             if not create_resp.ok:
                 try:
                     detail = create_resp.json()
                 except Exception:
                     detail = {"message": create_resp.text}
-                return JSONResponse({
+                return given_up(JSONResponse({
                     "ok": False,
                     "uploaded": False,
                     "message": f"Create ref failed: {detail.get('message','') or create_resp.text}",
                     "detail": detail
-                }, status_code=create_resp.status_code or 500)
+                }, status_code=create_resp.status_code or 500))
 
         # Ensure content exists on the branch at rel_path (create if missing)
-        getc = requests.get(f"{GITHUB_API}/repos/{repo}/contents/{rel_path}?ref={branch}", headers=gh_headers(token))
+        getc = gh_session.get(f"{GITHUB_API}/repos/{repo}/contents/{rel_path}?ref={branch}", headers=gh_headers(token))
         if getc.status_code == 404:
             content_b64 = base64.b64encode(json.dumps(record, ensure_ascii=False, indent=2).encode("utf-8")).decode("utf-8")
-            put = requests.put(f"{GITHUB_API}/repos/{repo}/contents/{rel_path}", headers=gh_headers(token), json={
+            put = gh_session.put(f"{GITHUB_API}/repos/{repo}/contents/{rel_path}", headers=gh_headers(token), json={
                 "message": f"add Non-LLM user data {instance} {date_str} {hhmm}",
                 "content": content_b64,
                 "branch": branch
@@ -609,24 +4432,27 @@ def upload_run(req: UploadReq, request: Request):
                     detail = put.json()
                 except Exception:
                     detail = {"message": put.text}
-                return JSONResponse({
+                return given_up(JSONResponse({
                     "ok": False,
                     "uploaded": False,
                     "message": f"Put content failed: {detail.get('message','') or put.text}",
                     "detail": detail
-                }, status_code=put.status_code or 500)
+                }, status_code=put.status_code or 500))
 
         # If a PR already exists for this branch, return it (idempotent)
         owner = repo.split('/')[0] if '/' in repo else repo
-        prs = requests.get(f"{GITHUB_API}/repos/{repo}/pulls", headers=gh_headers(token), params={"state": "open", "head": f"{owner}:{branch}"})
+        prs = gh_session.get(f"{GITHUB_API}/repos/{repo}/pulls", headers=gh_headers(token), params={"state": "open", "head": f"{owner}:{branch}"})
         if prs.ok:
             lst = prs.json() if isinstance(prs.json(), list) else []
             if lst:
                 pr_url = lst[0].get("html_url")
+                if req.jobId:
+                    update_job_meta(req.jobId, pending_upload=False)
+                uploaded_record(instance, date_str, _hash8, rel_path, pr_url)
                 return JSONResponse({"ok": True, "uploaded": True, "prUrl": pr_url, "path": rel_path})
 
         # Otherwise create a new PR
-        pr = requests.post(f"{GITHUB_API}/repos/{repo}/pulls", headers=gh_headers(token), json={
+        pr = gh_session.post(f"{GITHUB_API}/repos/{repo}/pulls", headers=gh_headers(token), json={
             "title": f"Non-LLM user data: {instance}/{date_str}/{hhmm}-{_hash8}.json",
             "head": branch,
             "base": default_branch,
@@ -634,6 +4460,28 @@ def upload_run(req: UploadReq, request: Request):
         })
         pr.raise_for_status()
         pr_url = pr.json().get("html_url")
+        if req.jobId:
+            update_job_meta(req.jobId, pending_upload=False)
+        uploaded_record(instance, date_str, _hash8, rel_path, pr_url)
         return JSONResponse({"ok": True, "uploaded": True, "prUrl": pr_url, "path": rel_path})
+    except requests.RequestException as e:
+        resp = getattr(e, "response", None)
+        if not github_retryable(resp):
+            # 401/404/422...: retrying will not help, and a queued copy could open a second PR for the same record
+            try:
+                detail = resp.json()
+            except Exception:
+                detail = {"message": resp.text}
+            return given_up(JSONResponse({
+                "ok": False,
+                "uploaded": False,
+                "message": f"Upload failed: {detail.get('message','') or resp.text}",
+                "detail": detail
+            }, status_code=resp.status_code or 500))
+        # Rate limits and network errors: hand the record to the outbox to retry with backoff
+        upload_batch_add(outbox_item)
+        _outbox_defer(e)
+        return JSONResponse({"ok": True, "uploaded": False, "queued": True,
+                             "message": f"Upload failed ({e}); queued for automatic retry."})
     except Exception as e:
-        return JSONResponse({"ok": False, "uploaded": False, "message": f"Upload failed: {e}"}, status_code=500)
+        return given_up(JSONResponse({"ok": False, "uploaded": False, "message": f"Upload failed: {e}"}, status_code=500))